@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,10 +45,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'location.middleware.RequestMetricsMiddleware',  # First, so it times everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Add this
     'django.middleware.common.CommonMiddleware',
+    'location.middleware.DatasetCacheMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -58,12 +61,44 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'location.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
     ],
 }
 
+# Request metrics, exposed in Prometheus format at /metrics.
+# Latency is recorded for every request; SQL and serialization breakdowns
+# only for this fraction of requests.
+METRICS_SAMPLE_RATE = 0.1
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# API responses are cached per dataset version (see DatasetCacheMiddleware).
+# The live version is re-read from the database at most every
+# DATASET_VERSION_TTL seconds.
+DATASET_VERSION_TTL = 5
+DATASET_CACHE_ALIAS = 'default'
+DATASET_CACHE_PATHS = ['/api/']
+DATASET_CACHE_TIMEOUT = 3600
+DATASET_CACHE_MAX_BYTES = 1024 * 1024
+
+# Build the in-memory city index and k-d tree when a server process starts
+# (core/wsgi.py, core/asgi.py) instead of on the first request using them.
+LOCATION_WARM_INDEXES = True
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    }
+}
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:4200",  # Angular default port
@@ -98,9 +133,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse connections across requests instead of reopening the file
+        # (and re-running the PRAGMAs below) every time. After a shadow
+        # import swaps the file, location.db closes connections to the old one.
+        'CONN_MAX_AGE': int(os.environ.get('LOCATION_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# PRAGMAs run on every new SQLite connection (location.db.configure_sqlite_connection).
+# WAL lets API reads carry on while an import writes; mmap and a larger page
+# cache keep hot pages out of read() calls. Set to {} for SQLite's defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 1024 * 1024 * 1024,
+    'cache_size': -32 * 1024,  # KiB
+}
+
+# PRAGMA query_only for processes that only serve the API, so a bug cannot
+# write to the data. Leave it off for management commands (imports,
+# migrations) and for the admin.
+SQLITE_QUERY_ONLY = os.environ.get('LOCATION_SQLITE_QUERY_ONLY', '') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory location indexes before the first request needs them
+from location.warmup import start_warming  # noqa: E402
+
+start_warming()
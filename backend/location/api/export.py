@@ -0,0 +1,46 @@
+import csv
+import json
+from itertools import islice
+from typing import Iterable, Iterator, Sequence
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+ROWS_PER_CHUNK = 1000
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _json_line(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data) + b'\n'
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def ndjson_chunks(mapper, rows: Iterable[tuple]) -> Iterator[bytes]:
+    """One JSON object per line, shaped like the list endpoint's results"""
+    for batch in _batches(rows, ROWS_PER_CHUNK):
+        yield b''.join(_json_line(mapper(row)) for row in batch)
+
+
+class _Buffer:
+    """File-like sink that hands back whatever csv.writer writes"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_chunks(header: Sequence[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    writer = csv.writer(_Buffer())
+    yield writer.writerow(header).encode()
+    for batch in _batches(rows, ROWS_PER_CHUNK):
+        yield ''.join(writer.writerow(row) for row in batch).encode()
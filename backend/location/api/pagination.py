@@ -0,0 +1,187 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from functools import reduce
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def bool_param(request, name, default):
+    """Read a boolean query parameter; missing or empty means ``default``"""
+    value = request.query_params.get(name, '').strip().lower()
+    if value == '':
+        return default
+    if value in FALSE_VALUES:
+        return False
+    if value in TRUE_VALUES:
+        return True
+    raise ValidationError({name: 'Must be true or false.'})
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """Page-number pagination with two cheaper modes for bulk consumers.
+
+    - ``?count=false`` keeps page numbers but skips the ``COUNT(*)``; one
+      extra row is fetched to know whether there is a next page and
+      ``count`` is returned as null.
+    - ``?pagination=cursor`` (or any ``?cursor=``) switches to keyset
+      pagination on the ordering field plus the primary key as tie-breaker,
+      so every page is an index range scan instead of a growing OFFSET.
+      Cursor pages only link forward and never count, and a relevance
+      ranked ``?search=`` needs an explicit ``?ordering=`` to use them.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    cursor_query_param = 'cursor'
+
+    mode = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        params = request.query_params
+        if isinstance(queryset, QuerySet) and (
+                self.cursor_query_param in params
+                or params.get(self.mode_query_param) == 'cursor'):
+            self.mode = 'cursor'
+            return self.paginate_keyset(queryset, request, view)
+        if not bool_param(request, self.count_query_param, default=True):
+            self.mode = 'uncounted'
+            return self.paginate_uncounted(queryset, request)
+        self.mode = 'page'
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.mode == 'page':
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.next_link),
+            ('previous', self.previous_link),
+            ('results', data),
+        ]))
+
+    def paginate_uncounted(self, queryset, request):
+        page_size = self.get_page_size(request)
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            page_number = 0
+        if page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='Invalid page.'))
+
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        url = request.build_absolute_uri()
+        self.next_link = (
+            replace_query_param(url, self.page_query_param, page_number + 1)
+            if len(rows) > page_size else None
+        )
+        if page_number == 1:
+            self.previous_link = None
+        elif page_number == 2:
+            self.previous_link = remove_query_param(url, self.page_query_param)
+        else:
+            self.previous_link = replace_query_param(url, self.page_query_param, page_number - 1)
+        return rows[:page_size]
+
+    def get_keyset_ordering(self, request, view):
+        """The single field the keyset is built on, and whether it descends"""
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM)
+        if ordering:
+            field = ordering.split(',')[0].strip()
+            if field.lstrip('-') not in (getattr(view, 'ordering_fields', None) or []):
+                raise ValidationError({api_settings.ORDERING_PARAM: f'Cannot page by {field}.'})
+        else:
+            default = getattr(view, 'ordering', None) or getattr(view, 'ordering_fields', None) or ['pk']
+            field = default[0]
+        # Public ordering names a view serves from differently named columns
+        columns = getattr(view, 'ordering_columns', None) or {}
+        return columns.get(field.lstrip('-'), field.lstrip('-')), field.startswith('-')
+
+    def required_columns(self, request, view):
+        """Columns besides the primary key that paging reads from ``values_list`` rows"""
+        params = request.query_params
+        if self.cursor_query_param in params or params.get(self.mode_query_param) == 'cursor':
+            field, _ = self.get_keyset_ordering(request, view)
+            return [] if field == 'pk' else [field]
+        return []
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (ValueError, TypeError, binascii.Error):
+            raise NotFound('Invalid cursor.')
+        return value, pk
+
+    def encode_cursor(self, value, pk):
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode('ascii')
+
+    def ranked(self, queryset):
+        """Whether ``queryset`` is in search relevance order, which no keyset can resume"""
+        order_by = queryset.query.order_by
+        if not order_by:
+            return False
+        first = order_by[0]
+        return not isinstance(first, str) or first.lstrip('-') in queryset.query.annotations
+
+    def paginate_keyset(self, queryset, request, view):
+        if self.ranked(queryset):
+            raise ValidationError({
+                api_settings.ORDERING_PARAM: 'Cursor pagination cannot follow search relevance; '
+                                             'pass an explicit ordering.'
+            })
+        field, descending = self.get_keyset_ordering(request, view)
+        pk_name = queryset.model._meta.pk.name
+        if descending:
+            queryset = queryset.order_by(f'-{field}', f'-{pk_name}')
+        else:
+            queryset = queryset.order_by(field, pk_name)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) |
+                Q(**{field: value, f'{pk_name}__{lookup}': pk})
+            )
+
+        page_size = self.get_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        self.previous_link = None
+        self.next_link = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            value, pk = self.keyset_values(queryset, rows[-1], field, pk_name)
+            url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+            self.next_link = replace_query_param(
+                url, self.cursor_query_param, self.encode_cursor(value, pk)
+            )
+        return rows
+
+    def keyset_values(self, queryset, row, field, pk_name):
+        """Read the keyset field and primary key from a model or values_list row"""
+        if isinstance(row, tuple):
+            columns = list(queryset.query.values_select)
+            if field == 'pk':
+                field = pk_name
+            try:
+                return row[columns.index(field)], row[columns.index(pk_name)]
+            except ValueError:
+                raise ValidationError({api_settings.ORDERING_PARAM: f'Cannot page by {field}.'})
+        return reduce(getattr, field.split('__'), row), row.pk
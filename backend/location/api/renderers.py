@@ -0,0 +1,57 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+from location import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+# orjson and the json module disagree only on exponent notation for floats
+# below 1e-4 or from 1e16 up ("1e-5" vs "1e-05", "1e16" vs "1e+16").
+# Payloads with anything that looks like an exponent go through json.
+EXPONENT_RE = re.compile(rb'[0-9]e[-+]?[0-9]')
+
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when the output is identical.
+
+    Falls back to the stock renderer for indented, non-compact or ASCII-only
+    output, for payloads orjson would format differently, and when orjson
+    is not installed. Rendering counts towards the sampled serialization
+    time, since it happens after the view has returned.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.serializing():
+            return self.encode(data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT_RE.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping JSONRenderer applies for JavaScript compatibility
+        if LINE_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028')
+        if PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
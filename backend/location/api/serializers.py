@@ -1,22 +1,209 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Union
+
 from rest_framework import serializers
 from location.models import Country, State, City, Location
 
+# Fields whose to_representation is the identity (or a no-op str/int/float
+# cast) on the values the database returns, so a row mapper can emit the
+# raw column value and match the serializer byte for byte.
+ROW_MAPPABLE_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.FloatField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+# What ``?expand=`` inlines for a related object: its id, name and code
+EXPANDED_FIELDS = {
+    Country: ('id', 'name', 'alpha2'),
+    State: ('id', 'name', 'abbreviation'),
+    City: ('id', 'name'),
+}
+
+# A key and either its column or, for an expanded relation, the
+# (key, column) pairs of the nested object
+RowField = Tuple[str, Union[str, Tuple[Tuple[str, str], ...]]]
+
+
+class RowMapper:
+    """Turns ``values_list`` tuples into the dicts a serializer would emit.
+
+    Rows are zipped straight onto the keys, which is several times cheaper
+    per row than instantiating models and running every field through DRF.
+    A field may map to a nested object read from several columns; only
+    mappers with such a field build their dicts key by key. ``columns``
+    lists every column in row order and ``headers`` names them for flat
+    formats such as CSV; rows may carry further columns after those, which
+    are ignored.
+    """
+
+    def __init__(self, fields: Sequence[RowField]):
+        self.keys = tuple(key for key, _ in fields)
+        columns: List[str] = []
+        headers: List[str] = []
+
+        def slot(header: str, column: str) -> int:
+            columns.append(column)
+            headers.append(header)
+            return len(columns) - 1
+
+        # Per key, its column's position in the row, or the (name, position)
+        # pairs of a nested object
+        layout = []
+        for key, column in fields:
+            if isinstance(column, tuple):
+                layout.append((key, tuple((name, slot(f'{key}.{name}', source)) for name, source in column)))
+            else:
+                layout.append((key, slot(key, column)))
+        self.columns = tuple(columns)
+        self.headers = tuple(headers)
+
+        keys = self.keys
+        if all(isinstance(position, int) for _, position in layout):
+            # Flat: the keys' columns are the first ones of the row, in order
+            self._map = lambda row: dict(zip(keys, row))
+        else:
+            def map_nested(row):
+                return {
+                    key: row[position] if isinstance(position, int)
+                    else {name: row[index] for name, index in position}
+                    for key, position in layout
+                }
+            self._map = map_nested
+
+    def __call__(self, row: tuple) -> dict:
+        return self._map(row)
+
+    def map_rows(self, rows) -> list:
+        return list(map(self._map, rows))
+
+
+# Where the LocationSerializer row columns live in the LocationSearch table
+LOCATION_SEARCH_COLUMNS = {
+    'city': 'city_id',
+    'state': 'state_id',
+    'country': 'country_id',
+    'city__id': 'city_id',
+    'state__id': 'state_id',
+    'country__id': 'country_id',
+    'city__name': 'city_name',
+    'state__name': 'state_name',
+    'country__name': 'country_name',
+    'state__abbreviation': 'state_abbreviation',
+    'country__alpha2': 'country_alpha2',
+}
+
+
+def row_fields(serializer_class) -> Optional[List[RowField]]:
+    """The (key, queryset column) pairs ``serializer_class`` emits, or None if unsafe.
+
+    Serializers that override ``to_representation`` must list the keys
+    they add in ``extra_row_columns`` as ``(key, queryset column)`` pairs.
+    """
+    overrides = serializer_class.to_representation is not serializers.ModelSerializer.to_representation
+    if overrides and not hasattr(serializer_class, 'extra_row_columns'):
+        return None
+
+    fields = []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if not isinstance(field, ROW_MAPPABLE_FIELDS) or len(field.source_attrs) != 1:
+            return None
+        fields.append((name, field.source))
+    fields.extend(getattr(serializer_class, 'extra_row_columns', ()))
+    return fields
+
+
+def expansion(serializer_class, key: str) -> Tuple[Tuple[str, str], ...]:
+    """The nested (key, column) pairs ``?expand=key`` inlines"""
+    path = serializer_class.expandable_fields[key]
+    model = serializer_class.Meta.model
+    for name in path.split('__'):
+        model = model._meta.get_field(name).related_model
+    return tuple((name, f'{path}__{name}') for name in EXPANDED_FIELDS[model])
+
+
+def shape_names(serializer_class) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """The names ``?fields=`` and ``?expand=`` accept for ``serializer_class``"""
+    expandable = tuple(getattr(serializer_class, 'expandable_fields', {}))
+    keys = [key for key, _ in row_fields(serializer_class) or ()]
+    return tuple(keys + [key for key in expandable if key not in keys]), expandable
+
+
+def shaped_fields(serializer_class, fields: Optional[Tuple[str, ...]],
+                  expand: Tuple[str, ...]) -> Optional[List[RowField]]:
+    """``row_fields`` narrowed to ``fields`` (all when None) with ``expand`` inlined"""
+    base = row_fields(serializer_class)
+    if base is None:
+        return None
+    shaped = []
+    for key, column in base:
+        if fields is not None and key not in fields:
+            continue
+        shaped.append((key, expansion(serializer_class, key) if key in expand else column))
+    for key in expand:
+        # Relations the serializer only reaches indirectly, e.g. a city's country
+        if key not in dict(base) and (fields is None or key in fields):
+            shaped.append((key, expansion(serializer_class, key)))
+    return shaped
+
+
+@lru_cache(maxsize=256)
+def row_mapper_for(serializer_class, fields: Optional[Tuple[str, ...]] = None,
+                   expand: Tuple[str, ...] = ()) -> Optional[RowMapper]:
+    """A RowMapper equivalent to ``serializer_class``, or None if unsafe.
+
+    ``fields`` and ``expand`` must already be validated against
+    ``shape_names``.
+    """
+    shaped = shaped_fields(serializer_class, fields, expand)
+    return RowMapper(shaped) if shaped is not None else None
+
+
+@lru_cache(maxsize=256)
+def search_row_mapper_for(serializer_class, fields: Optional[Tuple[str, ...]] = None,
+                          expand: Tuple[str, ...] = ()) -> Optional[RowMapper]:
+    """``row_mapper_for`` a Location serializer, reading the LocationSearch columns instead"""
+    shaped = shaped_fields(serializer_class, fields, expand)
+    if shaped is None:
+        return None
+
+    def column(source):
+        if isinstance(source, tuple):
+            return tuple((name, LOCATION_SEARCH_COLUMNS.get(nested, nested)) for name, nested in source)
+        return LOCATION_SEARCH_COLUMNS.get(source, source)
+    return RowMapper([(key, column(source)) for key, source in shaped])
+
+
 class CountrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = '__all__'
 
 class StateSerializer(serializers.ModelSerializer):
+    expandable_fields = {'country': 'country'}
+
     class Meta:
         model = State
         fields = '__all__'
 
 class CitySerializer(serializers.ModelSerializer):
+    expandable_fields = {'state': 'state', 'country': 'state__country'}
+
     class Meta:
         model = City
         fields = '__all__'
 
 class LocationSerializer(serializers.ModelSerializer):
+    extra_row_columns = (
+        ('city_name', 'city__name'),
+        ('state_name', 'state__name'),
+        ('country_name', 'country__name'),
+    )
+    expandable_fields = {'city': 'city', 'state': 'state', 'country': 'country'}
+
     class Meta:
         model = Location
         fields = '__all__'
@@ -26,4 +213,4 @@ class LocationSerializer(serializers.ModelSerializer):
         representation['city_name'] = instance.city.name
         representation['state_name'] = instance.state.name
         representation['country_name'] = instance.country.name
-        return representation
\ No newline at end of file
+        return representation
@@ -1,15 +1,167 @@
+import gzip
+
 from rest_framework import viewsets, filters
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from django_filters import rest_framework as django_filters
-from .serializers import CountrySerializer, StateSerializer, CitySerializer, LocationSerializer
-from location.models import Country, State, City, Location
+from .export import csv_chunks, ndjson_chunks
+from .pagination import StandardResultsSetPagination, bool_param
+from .serializers import (
+    CountrySerializer, StateSerializer, CitySerializer, LocationSerializer, LOCATION_SEARCH_COLUMNS,
+    row_mapper_for, search_row_mapper_for, shape_names,
+)
+from location import metrics
+from location.models import Country, State, City, Location, LocationSearch
+from location.autocomplete import get_city_index
+from location.city_zips import get_city_zip_lists
+from location.hierarchy import accepts_gzip, get_hierarchies
+from location.spatial import get_location_tree, locations_within
+from location.search import FTS_TABLE, fold_name, fts_available, fts_query, search_table_available
 from rest_framework.response import Response
-from django.db import models
+from rest_framework.settings import api_settings
+from django.db import connections, models
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.db.models.expressions import RawSQL
+
+def int_param(request, name, default=None, minimum=None, maximum=None):
+    """Read an integer query parameter, raising a 400 on bad input"""
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be an integer.'})
+    if minimum is not None and value < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+def float_param(request, name, minimum=None, maximum=None, required=False):
+    """Read a float query parameter, raising a 400 on bad or missing input"""
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        if required:
+            raise ValidationError({name: 'This parameter is required.'})
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be a number.'})
+    if value != value or (minimum is not None and value < minimum) or \
+            (maximum is not None and value > maximum):
+        raise ValidationError({name: f'Must be between {minimum} and {maximum}.'})
+    return value
+
+def name_list(value):
+    """The names of a comma separated query parameter, in order and without repeats"""
+    return list(dict.fromkeys(name.strip() for name in (value or '').split(',') if name.strip()))
+
+class InstrumentedListMixin:
+    """``ListModelMixin.list`` with a fast path and serializer timing.
+
+    When the serializer can be expressed as a RowMapper, the page is
+    fetched as ``values_list`` tuples and mapped straight to dicts instead
+    of going through model instances and DRF fields. Set ``fast_list =
+    False`` on a view to always use the serializer.
+
+    The mapper also shapes the ``shaped_actions``: ``?fields=a,b`` selects
+    and returns only those keys, and ``?expand=state,country`` replaces
+    each relation's id with an object holding its id, name and code, read
+    in the same query through the serializer's ``expandable_fields``.
+    """
+    fast_list = True
+    shaped_actions = ('list', 'export')
+
+    def get_shape(self):
+        """The validated ``?fields=`` (None for all) and ``?expand=`` of this request"""
+        params = self.request.query_params
+        if self.action not in self.shaped_actions or not (params.get('fields') or params.get('expand')):
+            return None, ()
+        allowed, expandable = shape_names(self.get_serializer_class())
+        fields, expand = name_list(params.get('fields')), name_list(params.get('expand'))
+        for param, names, choices in (('fields', fields, allowed), ('expand', expand, expandable)):
+            unknown = [name for name in names if name not in choices]
+            if unknown:
+                raise ValidationError({
+                    param: f"Unknown: {', '.join(unknown)}. Choose from {', '.join(choices) or 'nothing'}."
+                })
+        # Canonical order, so equivalent requests share a mapper
+        return (
+            tuple(name for name in allowed if name in fields) if fields else None,
+            tuple(name for name in expandable if name in expand),
+        )
+
+    def get_row_mapper(self):
+        fields, expand = self.get_shape()
+        mapper = row_mapper_for(self.get_serializer_class(), fields, expand) if self.fast_list else None
+        if mapper is None and (fields is not None or expand):
+            raise ValidationError({'fields': 'This endpoint cannot narrow or expand its fields.'})
+        return mapper
+
+    def hidden_columns(self, queryset, mapper):
+        """Columns paging and DISTINCT need that the requested fields leave out"""
+        required = getattr(self.paginator, 'required_columns', None)
+        wanted = [queryset.model._meta.pk.name]
+        if required is not None:
+            wanted += required(self.request, self)
+        return [column for column in dict.fromkeys(wanted) if column not in mapper.columns]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        mapper = self.get_row_mapper()
+        if mapper is not None:
+            queryset = queryset.values_list(*mapper.columns, *self.hidden_columns(queryset, mapper))
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else queryset
+        with metrics.serializing():
+            if mapper is not None:
+                data = mapper.map_rows(rows)
+            else:
+                data = self.get_serializer(rows, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+class LocationSearchListMixin(InstrumentedListMixin):
+    """Serve the list actions from the flat LocationSearch table.
+
+    Its rows already carry the city, state and country names, so a page
+    is one indexed read of one table instead of a three-way join, and name
+    filters compare precomputed folded keys. Views pick their queryset with
+    ``projected``; the filterset, the row mapper and the column behind
+    each ordering name follow it. Every other action, and any database
+    without the table, uses the joined Location queryset.
+    """
+    search_actions = ('list', 'export')
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 100
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
+    @property
+    def projected(self):
+        return (
+            self.fast_list
+            and self.action in self.search_actions
+            and search_table_available(LocationSearch.objects.db)
+        )
+
+    @property
+    def filterset_class(self):
+        return LocationSearchFilter if self.projected else LocationFilter
+
+    def get_queryset(self):
+        if self.projected:
+            return LocationSearch.objects.all()
+        return Location.objects.select_related('city', 'state', 'country')
+
+    @property
+    def ordering_columns(self):
+        return LOCATION_SEARCH_COLUMNS if self.projected else {}
+
+    def get_row_mapper(self):
+        if self.projected:
+            return search_row_mapper_for(self.get_serializer_class(), *self.get_shape())
+        return super().get_row_mapper()
 
 class LocationFilter(django_filters.FilterSet):
     city = django_filters.CharFilter(field_name='city__name', lookup_expr='icontains')
@@ -21,7 +173,123 @@ class LocationFilter(django_filters.FilterSet):
         model = Location
         fields = ['city', 'state', 'country', 'zip_code']
 
-class CountryViewSet(viewsets.ReadOnlyModelViewSet):
+class FoldedContainsFilter(django_filters.CharFilter):
+    """Substring match of the folded value against a folded ``*_key`` column"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'contains')
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        return super().filter(qs, fold_name(value) if value else value)
+
+class LocationSearchFilter(django_filters.FilterSet):
+    """LocationFilter for the LocationSearch table; names also match without accents"""
+    city = FoldedContainsFilter(field_name='city_key')
+    state = FoldedContainsFilter(field_name='state_key')
+    country = FoldedContainsFilter(field_name='country_key')
+    zip_code = django_filters.CharFilter(lookup_expr='icontains')
+
+    class Meta:
+        model = LocationSearch
+        fields = ['city', 'state', 'country', 'zip_code']
+
+def city_id_or_none(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+class ZipCodeFilter(LocationFilter):
+    """``city`` is a city id when numeric, otherwise part of a city name"""
+    city = django_filters.CharFilter(method='filter_city')
+
+    def filter_city(self, queryset, name, value):
+        city_id = city_id_or_none(value)
+        if city_id is not None:
+            return queryset.filter(city_id=city_id)
+        return queryset.filter(city__name__icontains=value)
+
+class ZipCodeSearchFilter(LocationSearchFilter):
+    """ZipCodeFilter for the LocationSearch table"""
+    city = django_filters.CharFilter(method='filter_city')
+
+    def filter_city(self, queryset, name, value):
+        city_id = city_id_or_none(value)
+        if city_id is not None:
+            return queryset.filter(city_id=city_id)
+        return queryset.filter(city_key__contains=fold_name(value))
+
+class LocationOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter that sorts each public name by ``view.ordering_columns`` where given"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        columns = getattr(view, 'ordering_columns', None)
+        if not ordering or not columns:
+            return ordering
+        return [
+            ('-' if term.startswith('-') else '') + columns.get(term.lstrip('-'), term.lstrip('-'))
+            for term in ordering
+        ]
+
+class LocationFullTextSearchFilter(filters.BaseFilterBackend):
+    """Route ``?search=`` on locations through the FTS5 index.
+
+    Sits after OrderingFilter: unless the client asks for an explicit
+    ``ordering`` the best ranked matches come first, with the view's
+    ordering as tie-breaker. FTS matches word prefixes only, so when it
+    finds nothing (``ork`` in New York, the middle of a ZIP code) the
+    search falls back to substring filters, as it does when the database
+    has no FTS table.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def substring_filter(self, queryset, search):
+        if queryset.model is LocationSearch:
+            key = fold_name(search)
+            return queryset.filter(
+                models.Q(zip_code__icontains=search) |
+                models.Q(city_key__contains=key) |
+                models.Q(state_key__contains=key) |
+                models.Q(country_key__contains=key)
+            )
+        return queryset.filter(
+            models.Q(zip_code__icontains=search) |
+            models.Q(city__name__icontains=search) |
+            models.Q(state__name__icontains=search) |
+            models.Q(country__name__icontains=search)
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        search = request.query_params.get(self.search_param, '').strip()
+        if not search:
+            return queryset
+
+        if not fts_available(queryset.db):
+            return self.substring_filter(queryset, search)
+
+        match = fts_query(search)
+        if match is None:
+            return queryset.none()
+
+        table = queryset.model._meta.db_table
+        matched = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        )
+        if not matched.exists():
+            return self.substring_filter(queryset, search)
+        queryset = matched
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            # An expression rather than an extra select, so it still
+            # applies when the list fast path narrows the columns.
+            rank = RawSQL(f'{FTS_TABLE}.rank', ())
+            queryset = queryset.order_by(rank.asc(), *queryset.query.order_by)
+        return queryset
+
+class CountryViewSet(InstrumentedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Country.objects.all()
     serializer_class = CountrySerializer
     pagination_class = StandardResultsSetPagination
@@ -45,7 +313,32 @@ class CountryViewSet(viewsets.ReadOnlyModelViewSet):
             )
         return queryset
 
-class StateViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=True, methods=['get'])
+    def hierarchy(self, request, pk=None):
+        """The country's states with their cities, for cascading pickers.
+
+        Served from the compressed documents built at import time: sent
+        as stored to clients that accept gzip, decompressed otherwise.
+        ``?zip_counts=true`` adds each city's number of zip codes.
+        """
+        try:
+            country_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        zip_counts = bool_param(request, 'zip_counts', default=False)
+        blob = get_hierarchies().blob(country_id, zip_counts)
+        if blob is None:
+            raise NotFound()
+
+        if accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(blob, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(blob), content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+class StateViewSet(InstrumentedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = State.objects.all()
     serializer_class = StateSerializer
     pagination_class = StandardResultsSetPagination
@@ -70,7 +363,7 @@ class StateViewSet(viewsets.ReadOnlyModelViewSet):
             )
         return queryset
 
-class CityViewSet(viewsets.ReadOnlyModelViewSet):
+class CityViewSet(InstrumentedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
     pagination_class = StandardResultsSetPagination
@@ -122,128 +415,193 @@ class CityViewSet(viewsets.ReadOnlyModelViewSet):
                     output_field=IntegerField(),
                 )
             ).filter(match_rank__gt=0).order_by('-match_rank', 'name')
-        
-        # Debug logging
-        print(f"Search terms: {search if search else 'None'}")
-        print(f"State ID: {state_id if state_id else 'None'}")
-        print(f"SQL Query: {queryset.query}")
-        print(f"Result count: {queryset.count()}")
-        
+
         return queryset.distinct()
 
-    def list(self, request, *args, **kwargs):
-        # Add debug info about request parameters
-        print(f"Request parameters: {request.query_params}")
-        
-        response = super().list(request, *args, **kwargs)
-        
-        # Add debug info about response
-        print(f"Response data count: {len(response.data['results'] if 'results' in response.data else [])}")
-        
-        return response
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Typeahead lookup served from the in-memory city index"""
+        search = request.query_params.get('search', '')
+        state_id = int_param(request, 'state')
+        limit = int_param(request, 'limit', default=10, minimum=1, maximum=100)
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+        results = get_city_index().search(search, state_id=state_id, limit=limit)
+        return Response(results)
+
+class LocationViewSet(LocationSearchListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
     pagination_class = StandardResultsSetPagination
     filter_backends = [
-        filters.SearchFilter,
-        filters.OrderingFilter,
-        django_filters.DjangoFilterBackend
-    ]
-    search_fields = [
-        'zip_code',
-        'city__name',
-        'state__name',
-        'country__name'
+        django_filters.DjangoFilterBackend,
+        LocationOrderingFilter,
+        LocationFullTextSearchFilter,
     ]
     ordering_fields = ['zip_code', 'city__name', 'state__name']
     ordering = ['zip_code']
-    filterset_class = LocationFilter
 
-    def get_queryset(self):
-        queryset = Location.objects.select_related('city', 'state', 'country')
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(
-                models.Q(zip_code__icontains=search) |
-                models.Q(city__name__icontains=search) |
-                models.Q(state__name__icontains=search) |
-                models.Q(country__name__icontains=search)
-            )
-        return queryset
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every matching location as NDJSON (default) or CSV.
+
+        Takes the same filters, search and ordering as the list endpoint.
+        Rows are read through a chunked iterator and written out as they
+        arrive, so memory use does not depend on the size of the table.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            raise ValidationError({'output': 'Must be ndjson or csv.'})
 
-class ZipCodeViewSet(viewsets.ReadOnlyModelViewSet):
+        mapper = self.get_row_mapper() or row_mapper_for(LocationSerializer)
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .values_list(*mapper.columns)
+            .iterator(chunk_size=5000)
+        )
+        if output == 'csv':
+            response = StreamingHttpResponse(csv_chunks(mapper.headers, rows), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(ndjson_chunks(mapper, rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="locations.{output}"'
+        return response
+
+class ZipCodeViewSet(LocationSearchListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
     pagination_class = StandardResultsSetPagination
     filter_backends = [
-        filters.SearchFilter,
-        filters.OrderingFilter,
-        django_filters.DjangoFilterBackend
-    ]
-    search_fields = [
-        'zip_code',
-        'city__name',
-        'state__name',
-        'country__name'
+        django_filters.DjangoFilterBackend,
+        LocationOrderingFilter,
+        LocationFullTextSearchFilter,
     ]
     ordering_fields = ['zip_code', 'city__name']
     ordering = ['zip_code']
-    filterset_class = LocationFilter
+    max_batch_size = 50000
+    # Query parameters a cached city listing can answer
+    city_list_params = frozenset(['city', 'page', 'page_size', 'count', 'format', 'fields', 'expand'])
 
-    def get_queryset(self):
-        queryset = Location.objects.select_related('city', 'state', 'country')
-        
-        # Get query parameters
-        city_param = self.request.query_params.get('city', None)
-        search = self.request.query_params.get('search', None)
-        
-        # Apply filters
-        if city_param:
-            try:
-                # First try to interpret as a city ID from zipcodes table
-                city_id = int(city_param)
-                # Look up the city name from the zipcodes table
-                city_name = Location.objects.filter(city_id=city_id).values_list('city__name', flat=True).first()
-                
-                if city_name:
-                    queryset = queryset.filter(city__name=city_name)
-                else:
-                    # If city_id doesn't exist in zipcodes, return empty queryset
-                    queryset = queryset.none()
-                
-                # Debug logging
-                print(f"Filtering by city_id: {city_id}, found city_name: {city_name}")
-                print(f"SQL Query: {queryset.query}")
-                print(f"Result count: {queryset.count()}")
-            except ValueError:
-                # If not a number, treat as a city name
-                queryset = queryset.filter(
-                    models.Q(city__name__icontains=city_param)
-                )
-            
-        if search:
-            queryset = queryset.filter(
-                models.Q(zip_code__icontains=search) |
-                models.Q(city__name__icontains=search) |
-                models.Q(state__name__icontains=search) |
-                models.Q(country__name__icontains=search)
-            )
-        
-        # Additional debug info
-        print(f"Final SQL Query: {queryset.query}")
-        print(f"Final Result count: {queryset.count()}")
-        
-        return queryset.distinct()
+    @property
+    def filterset_class(self):
+        return ZipCodeSearchFilter if self.projected else ZipCodeFilter
 
     def list(self, request, *args, **kwargs):
-        # Add debug info about request parameters
-        print(f"Request parameters: {request.query_params}")
-        
-        response = super().list(request, *args, **kwargs)
-        
-        # Add debug info about response
-        print(f"Response data count: {len(response.data['results'] if 'results' in response.data else [])}")
-        
-        return response
\ No newline at end of file
+        """The zip codes of one city come from the per-city lists, others from the database"""
+        city_id = self.cached_city_id()
+        if city_id is None:
+            return super().list(request, *args, **kwargs)
+        mapper = self.get_row_mapper()
+        page = self.paginate_queryset(get_city_zip_lists().rows(city_id, mapper.columns))
+        with metrics.serializing():
+            data = mapper.map_rows(page)
+        return self.get_paginated_response(data)
+
+    def cached_city_id(self):
+        """The city id of a plain ``?city=<id>`` listing in zip code order, else None"""
+        params = self.request.query_params
+        if 'city' not in params or not set(params) <= self.city_list_params or not self.projected:
+            return None
+        return city_id_or_none(params['city'])
+
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
+        """The k closest zip codes to a point, served from the k-d tree"""
+        lat = float_param(request, 'lat', minimum=-90, maximum=90, required=True)
+        lon = float_param(request, 'lon', minimum=-180, maximum=180, required=True)
+        k = int_param(request, 'k', default=1, minimum=1, maximum=100)
+
+        matches = get_location_tree().nearest(lat, lon, k)
+        locations = Location.objects.select_related('city', 'state', 'country').in_bulk(
+            [location_id for location_id, _ in matches]
+        )
+
+        results = []
+        with metrics.serializing():
+            for location_id, distance in matches:
+                location = locations.get(location_id)
+                if location is None:
+                    continue
+                data = self.get_serializer(location).data
+                data['distance_km'] = round(distance, 3)
+                results.append(data)
+        return Response(results)
+
+    @action(detail=False, methods=['get'])
+    def within(self, request):
+        """Zip codes within ``radius_km`` of a point or of another zip code"""
+        radius = float_param(request, 'radius_km', minimum=0, maximum=1000, required=True)
+        zip_code = request.query_params.get('zip')
+        if zip_code:
+            origin = (
+                Location.objects
+                .filter(zip_code=zip_code, latitude__isnull=False, longitude__isnull=False)
+                .values_list('latitude', 'longitude')
+                .first()
+            )
+            if origin is None:
+                raise NotFound(f'No geocoded location for zip code {zip_code}.')
+            lat, lon = origin
+        else:
+            lat = float_param(request, 'lat', minimum=-90, maximum=90, required=True)
+            lon = float_param(request, 'lon', minimum=-180, maximum=180, required=True)
+
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM, 'distance')
+        if ordering not in ('distance', '-distance'):
+            raise ValidationError({api_settings.ORDERING_PARAM: 'Must be distance or -distance.'})
+
+        ids, distances = locations_within(Location.objects.all(), lat, lon, radius)
+        matches = list(zip(ids.tolist(), distances.tolist()))
+        if ordering == '-distance':
+            matches.reverse()
+
+        page = self.paginate_queryset(matches)
+        locations = Location.objects.select_related('city', 'state', 'country').in_bulk(
+            [location_id for location_id, _ in page]
+        )
+        results = []
+        with metrics.serializing():
+            for location_id, distance in page:
+                # Deleted since the distance scan
+                location = locations.get(location_id)
+                if location is None:
+                    continue
+                data = self.get_serializer(location).data
+                data['distance_km'] = round(distance, 3)
+                results.append(data)
+        return self.get_paginated_response(results)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Resolve many zip codes in one call.
+
+        Expects ``{"zip_codes": [...]}`` with up to ``max_batch_size``
+        codes. Codes are matched exactly through the zip_code index in
+        chunked ``IN`` queries; the response maps each found code to its
+        locations and lists the codes that matched nothing.
+        """
+        zip_codes = request.data.get('zip_codes') if isinstance(request.data, dict) else None
+        if not isinstance(zip_codes, list) or not all(isinstance(code, str) for code in zip_codes):
+            raise ValidationError({'zip_codes': 'Must be a list of strings.'})
+        if len(zip_codes) > self.max_batch_size:
+            raise ValidationError({'zip_codes': f'At most {self.max_batch_size} codes per request.'})
+
+        wanted = list(dict.fromkeys(code.strip() for code in zip_codes))
+        mapper = self.get_row_mapper() or row_mapper_for(LocationSerializer)
+        zip_index = mapper.columns.index('zip_code')
+        chunk_size = (connections[Location.objects.db].features.max_query_params or 999) - 1
+
+        found = {}
+        with metrics.serializing():
+            for start in range(0, len(wanted), chunk_size):
+                rows = (
+                    Location.objects
+                    .filter(zip_code__in=wanted[start:start + chunk_size])
+                    .order_by('zip_code', 'id')
+                    .values_list(*mapper.columns)
+                )
+                for row in rows:
+                    found.setdefault(row[zip_index], []).append(mapper(row))
+
+        return Response({
+            'results': found,
+            'missing': [code for code in wanted if code not in found],
+        })
@@ -4,3 +4,27 @@ from django.apps import AppConfig
 class LocationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'location'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.models.signals import post_save
+        from django.db.backends.signals import connection_created
+
+        from location import autocomplete, city_zips, dataset, db, hierarchy, search, spatial
+        from location.signals import dataset_imported
+
+        dataset_imported.connect(dataset.reset, dispatch_uid='location.dataset')
+        # Rebuilt right away rather than by the next request; server
+        # processes warm them at startup (location.warmup)
+        dataset_imported.connect(autocomplete.city_index.rebuild, dispatch_uid='location.autocomplete')
+        dataset_imported.connect(spatial.location_tree.rebuild, dispatch_uid='location.spatial')
+        dataset_imported.connect(city_zips.city_zip_lists.invalidate, dispatch_uid='location.city_zips')
+        dataset_imported.connect(hierarchy.hierarchies.invalidate, dispatch_uid='location.hierarchy')
+
+        for model in (*search.SEARCH_KEY_COLUMNS, self.get_model('Location')):
+            post_save.connect(search.fold_saved_names, sender=model, dispatch_uid=f'location.search.{model.__name__}')
+
+        connection_created.connect(db.configure_sqlite_connection, dispatch_uid='location.db.configure')
+        connection_created.connect(db.register_sqlite_functions, dispatch_uid='location.db.functions')
+        connection_created.connect(db.remember_database_file, dispatch_uid='location.db.remember')
+        request_started.connect(db.reopen_swapped_databases, dispatch_uid='location.db.reopen')
@@ -0,0 +1,158 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from location.caches import DatasetCache
+from location.models import City
+from location.search import normalize_name
+
+EXACT_MATCH = 3
+PREFIX_MATCH = 2
+CONTAINS_MATCH = 1
+
+# Sorts after every character a normalized key can contain, so
+# ``bisect_left(keys, term + PREFIX_END)`` is the end of the prefix range.
+PREFIX_END = '\U0010ffff'
+
+
+def trigrams(key: str) -> Iterator[str]:
+    for i in range(len(key) - 2):
+        yield key[i:i + 3]
+
+
+class CityPrefixIndex:
+    """In-memory typeahead index over normalized city names.
+
+    Entries are sorted by normalized name, so exact and prefix matches are
+    contiguous ranges found with ``bisect`` and come out already in name
+    order. Substring matches are only looked up when the first two tiers do
+    not fill the requested limit, using a trigram posting table for
+    unscoped queries and the (small) per-state key list otherwise.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, str, int]]):
+        entries = sorted(
+            (normalize_name(name), name, city_id, state_id)
+            for city_id, name, state_id in rows
+        )
+        self.keys: List[str] = [entry[0] for entry in entries]
+        self.names: List[str] = [entry[1] for entry in entries]
+        self.ids = array('q', (entry[2] for entry in entries))
+        self.states = array('q', (entry[3] for entry in entries))
+
+        state_positions: Dict[int, array] = {}
+        postings: Dict[str, array] = {}
+        for position, key in enumerate(self.keys):
+            state_positions.setdefault(self.states[position], array('l')).append(position)
+            for gram in set(trigrams(key)):
+                postings.setdefault(gram, array('l')).append(position)
+
+        self.trigram_postings = postings
+        self.state_keys: Dict[int, Tuple[List[str], array]] = {
+            state_id: ([self.keys[p] for p in positions], positions)
+            for state_id, positions in state_positions.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _scope(self, state_id: Optional[int]) -> Tuple[List[str], Optional[array]]:
+        if state_id is None:
+            return self.keys, None
+        return self.state_keys.get(state_id, ([], array('l')))
+
+    @staticmethod
+    def _positions(positions: Optional[array], start: int, stop: int) -> Iterable[int]:
+        if positions is None:
+            return range(start, stop)
+        return positions[start:stop]
+
+    def _exact(self, terms: List[str], state_id: Optional[int]) -> Iterator[int]:
+        keys, positions = self._scope(state_id)
+        ranges = [
+            self._positions(positions, bisect_left(keys, term), bisect_right(keys, term))
+            for term in terms
+        ]
+        return heapq.merge(*ranges)
+
+    def _prefix(self, terms: List[str], state_id: Optional[int]) -> Iterator[int]:
+        keys, positions = self._scope(state_id)
+        ranges = [
+            self._positions(
+                positions,
+                bisect_left(keys, term),
+                bisect_left(keys, term + PREFIX_END),
+            )
+            for term in terms
+        ]
+        return heapq.merge(*ranges)
+
+    def _contains_term(self, term: str, state_id: Optional[int]) -> Iterator[int]:
+        if state_id is not None:
+            candidates = self._scope(state_id)[1]
+        elif len(term) >= 3:
+            lists = []
+            for gram in set(trigrams(term)):
+                posting = self.trigram_postings.get(gram)
+                if posting is None:
+                    return
+                lists.append(posting)
+            candidates = min(lists, key=len)
+        else:
+            candidates = range(len(self.keys))
+
+        keys = self.keys
+        for position in candidates:
+            if term in keys[position]:
+                yield position
+
+    def _contains(self, terms: List[str], state_id: Optional[int]) -> Iterator[int]:
+        return heapq.merge(*(self._contains_term(term, state_id) for term in terms))
+
+    def search(self, query: str, state_id: Optional[int] = None,
+               limit: int = 10) -> List[dict]:
+        """Rank cities like ``CityViewSet``: exact > starts with > contains.
+
+        As in the list endpoint each whitespace separated term is matched on
+        its own against the whole city name, and a city takes the best rank
+        any term gives it.
+        """
+        terms = sorted({normalize_name(term) for term in query.split()} - {''})
+        if not terms or limit <= 0:
+            return []
+
+        results: List[dict] = []
+        seen = set()
+        tiers = (
+            (EXACT_MATCH, self._exact),
+            (PREFIX_MATCH, self._prefix),
+            (CONTAINS_MATCH, self._contains),
+        )
+        for rank, lookup in tiers:
+            for position in lookup(terms, state_id):
+                if position in seen:
+                    continue
+                seen.add(position)
+                results.append({
+                    'id': self.ids[position],
+                    'name': self.names[position],
+                    'state': self.states[position],
+                    'match_rank': rank,
+                })
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+def build_city_index() -> CityPrefixIndex:
+    rows = City.objects.values_list('id', 'name', 'state_id').iterator(chunk_size=10000)
+    return CityPrefixIndex(rows)
+
+
+city_index = DatasetCache(build_city_index)
+
+
+def get_city_index() -> CityPrefixIndex:
+    """Return the process-wide city index, building it on first use"""
+    return city_index.get()
@@ -0,0 +1,49 @@
+import threading
+from typing import Callable, Generic, Optional, Tuple, TypeVar
+
+from location.dataset import current_tag
+
+T = TypeVar('T')
+
+
+class DatasetCache(Generic[T]):
+    """A process-wide value derived from the location tables.
+
+    The value is built on first use and rebuilt whenever the dataset
+    version changes, so imports run by other processes are picked up once
+    the version TTL expires. ``invalidate`` is connected to
+    ``dataset_imported`` in ``LocationConfig.ready`` to drop it right away
+    in the importing process.
+    """
+
+    def __init__(self, builder: Callable[[], T]):
+        self.builder = builder
+        self._entry: Optional[Tuple[Optional[str], T]] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        tag = current_tag()
+        entry = self._entry
+        if entry is None or entry[0] != tag:
+            with self._lock:
+                entry = self._entry
+                if entry is None or entry[0] != tag:
+                    entry = self._entry = (tag, self.builder())
+        return entry[1]
+
+    def invalidate(self, **kwargs) -> None:
+        with self._lock:
+            self._entry = None
+
+    def rebuild(self, **kwargs) -> None:
+        """Drop the value and, if this process had built it, build it again now.
+
+        Connected to ``dataset_imported`` in place of ``invalidate`` for
+        values requests should not wait for; an import command that never
+        used the value does not pay for it.
+        """
+        with self._lock:
+            built = self._entry is not None
+            self._entry = None
+        if built:
+            self.get()
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+
+from django.conf import settings
+
+from location.caches import DatasetCache
+from location.models import LocationSearch
+
+
+class CityZipLists:
+    """Zip code rows of recently listed cities, in zip code order.
+
+    The drill-down from a city to its zip codes asks for the same short
+    lists over and over with different page sizes, which the response
+    cache stores once per URL. Here each city's rows are read once, with
+    one range scan of the (city_id, zip_code) index, and every page of
+    every variant is sliced from that list. Cities are evicted least
+    recently used first once more than ``max_rows`` rows are held.
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self.held = 0
+        self._lists: 'OrderedDict[Tuple[int, Sequence[str]], List[tuple]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def rows(self, city_id: int, columns: Sequence[str]) -> List[tuple]:
+        """``values_list(*columns)`` of the city's LocationSearch rows, by zip_code and id"""
+        key = (city_id, tuple(columns))
+        with self._lock:
+            rows = self._lists.get(key)
+            if rows is not None:
+                self._lists.move_to_end(key)
+                return rows
+
+        rows = list(
+            LocationSearch.objects
+            .filter(city_id=city_id)
+            .order_by('zip_code', 'id')
+            .values_list(*columns)
+        )
+        if len(rows) > self.max_rows:
+            return rows
+        with self._lock:
+            if key not in self._lists:
+                self._lists[key] = rows
+                self.held += len(rows)
+            while self.held > self.max_rows:
+                _, evicted = self._lists.popitem(last=False)
+                self.held -= len(evicted)
+        return rows
+
+
+def build_city_zip_lists() -> CityZipLists:
+    return CityZipLists(getattr(settings, 'CITY_ZIP_CACHE_ROWS', 200000))
+
+
+city_zip_lists = DatasetCache(build_city_zip_lists)
+
+
+def get_city_zip_lists() -> CityZipLists:
+    """Return the process-wide per-city zip lists of the current dataset version"""
+    return city_zip_lists.get()
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from location.models import DatasetVersion
+from location.search import fold_location_search_keys, optimize_location_fts
+from location.signals import dataset_imported
+
+_lock = threading.Lock()
+_checked_at = float('-inf')
+_current: Optional[DatasetVersion] = None
+
+
+def current_version() -> Optional[DatasetVersion]:
+    """The live dataset version, or None before the first import.
+
+    The lookup is cached for ``DATASET_VERSION_TTL`` seconds, so request
+    paths that only need the version (ETags, cache keys, in-memory index
+    freshness) do not query the database each time. Imports done by other
+    processes are therefore picked up within that TTL.
+    """
+    global _checked_at, _current
+    ttl = getattr(settings, 'DATASET_VERSION_TTL', 5)
+    now = time.monotonic()
+    if now - _checked_at < ttl:
+        return _current
+    with _lock:
+        if now - _checked_at >= ttl:
+            try:
+                _current = DatasetVersion.objects.order_by('-id').first()
+            except DatabaseError:
+                # Table not migrated yet; behave as if nothing was imported
+                _current = None
+            _checked_at = now
+    return _current
+
+
+def current_tag() -> Optional[str]:
+    version = current_version()
+    return version.tag if version is not None else None
+
+
+def reset(**kwargs) -> None:
+    """Forget the cached version; connected to ``dataset_imported``"""
+    global _checked_at
+    with _lock:
+        _checked_at = float('-inf')
+
+
+def stamp_version(source: str = '', using: str = 'default') -> DatasetVersion:
+    """Record a completed import as the new live dataset version"""
+    version = DatasetVersion.objects.using(using).create(source=source[:255])
+    reset()
+    return version
+
+
+def publish_import(source: str = '', sender=None, using: str = 'default') -> DatasetVersion:
+    """Make freshly imported data live: compact FTS, fold search keys, store the hierarchies,
+    stamp a version, notify caches"""
+    # Imported here: location.hierarchy uses the caches, which use this module
+    from location.hierarchy import build_hierarchies
+
+    optimize_location_fts(using)
+    fold_location_search_keys(using)
+    build_hierarchies(using)
+    version = stamp_version(source=source, using=using)
+    dataset_imported.send(sender=sender)
+    return version
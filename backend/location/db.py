@@ -0,0 +1,85 @@
+import logging
+import os
+import sqlite3
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from location import dataset
+from location.search import fold_name
+
+
+logger = logging.getLogger(__name__)
+
+FileId = Tuple[int, int]
+
+# Last file seen behind each alias by this process
+_live_files: Dict[str, FileId] = {}
+
+
+def database_file_id(path) -> Optional[FileId]:
+    """Identity of the file at ``path``, or None for in-memory or missing databases"""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def configure_sqlite_connection(sender, connection, **kwargs) -> None:
+    """Apply ``SQLITE_PRAGMAS`` and ``SQLITE_QUERY_ONLY``; connected to ``connection_created``"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    if getattr(settings, 'SQLITE_QUERY_ONLY', False):
+        # Last: switching the journal mode writes to the file
+        pragmas['query_only'] = 1
+    for name, value in pragmas.items():
+        try:
+            connection.connection.execute(f'PRAGMA {name} = {value}')
+        except sqlite3.OperationalError as e:
+            # e.g. journal_mode while another process holds a lock; the
+            # next connection tries again
+            logger.warning(f"PRAGMA {name} = {value} failed on {connection.alias}: {e}")
+
+
+def register_sqlite_functions(sender, connection, **kwargs) -> None:
+    """Define ``location_fold`` for the LocationSearch bulk statements; connected to ``connection_created``"""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('location_fold', 1, fold_name, deterministic=True)
+
+
+def remember_database_file(sender, connection, **kwargs) -> None:
+    """Record which file a new SQLite connection opened; connected to ``connection_created``"""
+    if connection.vendor == 'sqlite':
+        connection.location_file_id = database_file_id(connection.settings_dict['NAME'])
+
+
+def reopen_swapped_databases(**kwargs) -> None:
+    """Move this process onto a database file that was swapped in.
+
+    A shadow import replaces the database file with a rename, and open
+    connections keep reading the old, unlinked file. Connected to
+    ``request_started``: connections opened on a file that is no longer at
+    the configured path are closed, so the next query reconnects to the new
+    one, and the cached dataset version is dropped as soon as any request
+    notices the swap so in-memory indexes and response caches follow.
+    """
+    swapped = False
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        current = database_file_id(connection.settings_dict['NAME'])
+        if current is None:
+            continue
+        previous = _live_files.get(alias)
+        _live_files[alias] = current
+        if previous is not None and previous != current:
+            swapped = True
+        opened = getattr(connection, 'location_file_id', None)
+        if connection.connection is not None and opened is not None and opened != current:
+            connection.close()
+    if swapped:
+        dataset.reset()
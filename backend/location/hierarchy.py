@@ -0,0 +1,134 @@
+import gzip
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count
+
+from location.caches import DatasetCache
+from location.models import City, Country, CountryHierarchy, Location, State
+
+# The gzip-compressed JSON of one country without and with zip counts
+Blobs = Tuple[bytes, bytes]
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows a gzip body; ``gzip;q=0`` refuses it"""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = (part.strip() for part in item.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+def compress(document: dict) -> bytes:
+    # mtime=0 so the same data always compresses to the same bytes
+    return gzip.compress(json.dumps(document, separators=(',', ':')).encode(), mtime=0)
+
+
+def hierarchy_blobs(country_ids: Optional[Iterable[int]] = None, using: str = 'default') -> Dict[int, Blobs]:
+    """The compressed hierarchy of every country, or only of ``country_ids``.
+
+    Four queries, however many countries: states and cities come back
+    already in name order and the zip counts are one grouped scan of the
+    (city, zip_code) index.
+    """
+    countries = Country.objects.using(using).order_by('id')
+    states = State.objects.using(using).order_by('country_id', 'name', 'id')
+    cities = City.objects.using(using).order_by('state_id', 'name', 'id')
+    locations = Location.objects.using(using).order_by()
+    if country_ids is not None:
+        country_ids = list(country_ids)
+        countries = countries.filter(id__in=country_ids)
+        states = states.filter(country_id__in=country_ids)
+        cities = cities.filter(state__country_id__in=country_ids)
+        locations = locations.filter(country_id__in=country_ids)
+
+    zip_counts = dict(locations.values('city_id').annotate(n=Count('id')).values_list('city_id', 'n'))
+    state_cities = defaultdict(list)
+    for city_id, name, state_id in cities.values_list('id', 'name', 'state_id'):
+        state_cities[state_id].append((city_id, name))
+    country_states = defaultdict(list)
+    for row in states.values_list('id', 'name', 'abbreviation', 'country_id'):
+        country_states[row[3]].append(row[:3])
+
+    blobs = {}
+    for country_id, name, alpha2 in countries.values_list('id', 'name', 'alpha2'):
+        plain = {'id': country_id, 'name': name, 'alpha2': alpha2, 'states': []}
+        counted = {**plain, 'states': []}
+        for state_id, state_name, abbreviation in country_states[country_id]:
+            state = {'id': state_id, 'name': state_name, 'abbreviation': abbreviation}
+            pairs = state_cities[state_id]
+            plain['states'].append({**state, 'cities': [
+                {'id': city_id, 'name': city_name} for city_id, city_name in pairs
+            ]})
+            counted['states'].append({**state, 'cities': [
+                {'id': city_id, 'name': city_name, 'zip_count': zip_counts.get(city_id, 0)}
+                for city_id, city_name in pairs
+            ]})
+        blobs[country_id] = (compress(plain), compress(counted))
+    return blobs
+
+
+def build_hierarchies(using: str = 'default') -> int:
+    """Replace the stored CountryHierarchy rows with fresh ones; called when an import is published"""
+    blobs = hierarchy_blobs(using=using)
+    with transaction.atomic(using=using):
+        CountryHierarchy.objects.using(using).all().delete()
+        CountryHierarchy.objects.using(using).bulk_create(
+            CountryHierarchy(country_id=country_id, data=plain, data_with_zip_counts=counted)
+            for country_id, (plain, counted) in blobs.items()
+        )
+    return len(blobs)
+
+
+class Hierarchies:
+    """The stored hierarchies of the current dataset, held in memory.
+
+    The stored documents and the ids of every country are read on first
+    use, so an unknown country id is answered without a query. A country
+    without a stored row (data written after the last import, or an
+    import that predates the table) is built from the location tables on
+    its first request and kept as well.
+    """
+
+    def __init__(self):
+        self.country_ids = frozenset(Country.objects.values_list('id', flat=True))
+        self.blobs: Dict[int, Blobs] = {
+            country_id: (bytes(plain), bytes(counted))
+            for country_id, plain, counted in CountryHierarchy.objects.values_list(
+                'country_id', 'data', 'data_with_zip_counts'
+            )
+        }
+
+    def blob(self, country_id: int, zip_counts: bool = False) -> Optional[bytes]:
+        """The gzip-compressed JSON of the country, or None if there is no such country"""
+        if country_id not in self.country_ids:
+            return None
+        blobs = self.blobs.get(country_id)
+        if blobs is None:
+            # None when the country was deleted after the ids were read
+            blobs = hierarchy_blobs([country_id]).get(country_id)
+            if blobs is None:
+                return None
+            self.blobs[country_id] = blobs
+        return blobs[1] if zip_counts else blobs[0]
+
+
+hierarchies = DatasetCache(Hierarchies)
+
+
+def get_hierarchies() -> Hierarchies:
+    """Return the process-wide hierarchies of the current dataset version"""
+    return hierarchies.get()
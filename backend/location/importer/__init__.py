@@ -0,0 +1,5 @@
+from location.importer.delta import IncrementalImport
+from location.importer.pipeline import ImportPipeline, clear_location_tables
+from location.importer.writers import WRITERS, BulkWriter, OrmWriter, RawWriter
+
+__all__ = ['ImportPipeline', 'IncrementalImport', 'WRITERS', 'BulkWriter', 'OrmWriter', 'RawWriter']
@@ -0,0 +1,251 @@
+import csv
+import io
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from django.db import connections
+from django.db.models import Max, Model
+
+from location.importer.pipeline import CITY_FIELDS, COUNTRY_FIELDS, LOCATION_FIELDS, STATE_FIELDS
+from location.importer.writers import BulkWriter, RawWriter
+from location.models import City, Country, Location, State
+
+logger = logging.getLogger(__name__)
+
+# Columns a feed row is parsed into, in this order
+FEED_FIELDS = (
+    'country', 'country_code', 'state', 'state_code', 'city', 'zip_code', 'latitude', 'longitude',
+)
+REQUIRED_FIELDS = ('country', 'state', 'city', 'zip_code')
+
+# Header names recognised for each field, compared case-insensitively
+COLUMN_ALIASES = {
+    'country': ('country', 'country_name'),
+    'country_code': ('country_code', 'iso', 'iso2', 'alpha2', 'alpha3'),
+    'state': ('state', 'state_name', 'province', 'region'),
+    'state_code': ('state_code', 'state_abbr', 'abbr', 'abbreviation'),
+    'city': ('city', 'city_name', 'place', 'place_name'),
+    'zip_code': ('zip_code', 'zip', 'zipcode', 'postal_code', 'postcode'),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon', 'lng', 'long'),
+}
+
+ZIP_CODE_LENGTH = Location._meta.get_field('zip_code').max_length
+
+ParsedRow = Tuple[str, str, str, str, str, str, Optional[float], Optional[float]]
+
+
+def resolve_columns(header: Sequence[str], overrides: Dict[str, str]) -> Tuple[int, ...]:
+    """Position of every FEED_FIELDS column in the header, -1 when absent"""
+    positions = {name.strip().casefold(): i for i, name in enumerate(header)}
+    indexes = []
+    for field in FEED_FIELDS:
+        names = (overrides[field],) if field in overrides else COLUMN_ALIASES[field]
+        index = next((positions[name.casefold()] for name in names if name.casefold() in positions), -1)
+        if index < 0 and field in REQUIRED_FIELDS:
+            raise ValueError(f"No column for {field}; expected one of: {', '.join(names)}")
+        indexes.append(index)
+    return tuple(indexes)
+
+
+def read_chunks(stream: TextIO, chunk_size: int) -> Iterator[str]:
+    """Split a CSV stream into blocks of whole records of about ``chunk_size`` characters.
+
+    A block only ends where the running count of quote characters is even,
+    so a quoted field spanning several lines is never cut in half.
+    """
+    lines: List[str] = []
+    size = quotes = 0
+    for line in stream:
+        lines.append(line)
+        size += len(line)
+        quotes += line.count('"')
+        if size >= chunk_size and not quotes % 2:
+            yield ''.join(lines)
+            lines = []
+            size = quotes = 0
+    if lines:
+        yield ''.join(lines)
+
+
+def _coordinate(value: str) -> Optional[float]:
+    return float(value) if value else None
+
+
+def parse_chunk(text: str, delimiter: str, indexes: Tuple[int, ...]) -> Tuple[List[ParsedRow], int]:
+    """Parse one block of records into normalized tuples in FEED_FIELDS order.
+
+    Runs in the worker processes. Returns the rows and the number rejected
+    for missing required values, bad coordinates or an over-long ZIP code.
+    """
+    rows: List[ParsedRow] = []
+    rejected = 0
+    width = max(indexes) + 1
+    for record in csv.reader(io.StringIO(text), delimiter=delimiter):
+        if not record:
+            continue
+        if len(record) < width:
+            record += [''] * (width - len(record))
+        country, country_code, state, state_code, city, zip_code, lat, lon = (
+            record[i].strip() if i >= 0 else '' for i in indexes
+        )
+        if not (country and state and city and zip_code) or len(zip_code) > ZIP_CODE_LENGTH:
+            rejected += 1
+            continue
+        try:
+            latitude, longitude = _coordinate(lat), _coordinate(lon)
+        except ValueError:
+            rejected += 1
+            continue
+        rows.append((country, country_code, state, state_code, city, zip_code, latitude, longitude))
+    return rows, rejected
+
+
+class CsvImport:
+    """Loads a flat country/state/city/ZIP feed into the location tables.
+
+    Parsing is the CPU-heavy part and runs in a process pool over blocks of
+    whole records; the parent resolves countries, states and cities through
+    in-memory dictionaries (preloaded from the database, so existing parents
+    are reused) and hands new rows to ``writer`` in FK order. At most
+    ``2 * workers`` blocks are in flight, which bounds memory on multi-GB
+    feeds. With ``workers=0`` everything runs in this process.
+
+    Locations are keyed on (city, zip_code), like the feed itself: a pair
+    already in the database, or earlier in the feed, has its coordinates
+    updated instead of being added again, so loading the same feed twice
+    changes nothing. Feed rows carry no source ids, so no
+    ``SourceFingerprint`` rows are written; ``import_locations
+    --incremental`` needs a full ``import_locations`` first.
+    """
+
+    def __init__(self, delimiter: str, indexes: Tuple[int, ...], workers: int = 0,
+                 using: str = 'default', writer: Optional[BulkWriter] = None):
+        self.delimiter = delimiter
+        self.indexes = indexes
+        self.workers = workers
+        self.using = using
+        self.writer = writer if writer is not None else RawWriter(using)
+        self.country_ids: Dict[str, int] = {}
+        self.state_ids: Dict[Tuple[int, str], int] = {}
+        self.city_ids: Dict[Tuple[int, str], int] = {}
+        # (city_id, zip_code) -> (id, latitude, longitude)
+        self.location_keys: Dict[Tuple[int, str], Tuple[int, Optional[float], Optional[float]]] = {}
+        self.next_ids: Dict[type, int] = {}
+        self.counts: Dict[str, int] = {
+            'countries': 0, 'states': 0, 'cities': 0, 'locations': 0, 'updated': 0, 'unchanged': 0,
+            'rejected': 0,
+        }
+
+    def next_id(self, model: Model) -> int:
+        return (model.objects.using(self.using).aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def preload(self) -> None:
+        db = self.using
+        self.country_ids = {name: pk for pk, name in Country.objects.using(db).values_list('id', 'name')}
+        self.state_ids = {
+            (country_id, name): pk
+            for pk, name, country_id in State.objects.using(db).values_list('id', 'name', 'country_id')
+        }
+        self.city_ids = {
+            (state_id, name): pk
+            for pk, name, state_id in City.objects.using(db).values_list('id', 'name', 'state_id')
+        }
+        self.location_keys = {
+            (city_id, zip_code): (pk, lat, lon)
+            for pk, city_id, zip_code, lat, lon in Location.objects.using(db).values_list(
+                'id', 'city_id', 'zip_code', 'latitude', 'longitude'
+            ).iterator(chunk_size=10000)
+        }
+        self.next_ids = {model: self.next_id(model) for model in (Country, State, City, Location)}
+
+    def allocate(self, model: Model) -> int:
+        pk = self.next_ids[model]
+        self.next_ids[model] = pk + 1
+        return pk
+
+    def parsed_chunks(self, chunks: Iterable[str]) -> Iterator[Tuple[List[ParsedRow], int]]:
+        if self.workers <= 0:
+            for chunk in chunks:
+                yield parse_chunk(chunk, self.delimiter, self.indexes)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(parse_chunk, chunk, self.delimiter, self.indexes))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def update_coordinates(self, rows: List[tuple]) -> None:
+        """Set latitude and longitude by id; every row is (latitude, longitude, id)"""
+        if rows:
+            quote = connections[self.using].ops.quote_name
+            with connections[self.using].cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {quote(Location._meta.db_table)} SET latitude = %s, longitude = %s WHERE id = %s',
+                    rows,
+                )
+
+    def load(self, rows: List[ParsedRow]) -> int:
+        countries, states, cities, locations, updates = [], [], [], [], []
+        for country, country_code, state, state_code, city, zip_code, lat, lon in rows:
+            country_id = self.country_ids.get(country)
+            if country_id is None:
+                country_id = self.country_ids[country] = self.allocate(Country)
+                code = country_code.upper()
+                countries.append((
+                    country_id, country,
+                    code if len(code) == 2 else '',
+                    code if len(code) == 3 else '',
+                ))
+
+            state_key = (country_id, state)
+            state_id = self.state_ids.get(state_key)
+            if state_id is None:
+                state_id = self.state_ids[state_key] = self.allocate(State)
+                code = state_code.upper()
+                states.append((state_id, state, country_id, code if len(code) <= 2 else ''))
+
+            city_key = (state_id, city)
+            city_id = self.city_ids.get(city_key)
+            if city_id is None:
+                city_id = self.city_ids[city_key] = self.allocate(City)
+                cities.append((city_id, city, state_id))
+
+            location_key = (city_id, zip_code)
+            existing = self.location_keys.get(location_key)
+            if existing is None:
+                location_id = self.allocate(Location)
+                locations.append((location_id, city_id, state_id, country_id, zip_code, lat, lon))
+            elif existing[1:] != (lat, lon):
+                location_id = existing[0]
+                updates.append((lat, lon, location_id))
+            else:
+                self.counts['unchanged'] += 1
+                continue
+            self.location_keys[location_key] = (location_id, lat, lon)
+
+        self.writer.write(Country, COUNTRY_FIELDS, countries)
+        self.writer.write(State, STATE_FIELDS, states)
+        self.writer.write(City, CITY_FIELDS, cities)
+        self.writer.write(Location, LOCATION_FIELDS, locations)
+        self.update_coordinates(updates)
+        self.counts['countries'] += len(countries)
+        self.counts['states'] += len(states)
+        self.counts['cities'] += len(cities)
+        self.counts['locations'] += len(locations)
+        self.counts['updated'] += len(updates)
+        return len(locations)
+
+    def run(self, chunks: Iterable[str]) -> Dict[str, int]:
+        self.preload()
+        for rows, rejected in self.parsed_chunks(chunks):
+            self.counts['rejected'] += rejected
+            self.load(rows)
+        if self.counts['rejected']:
+            logger.warning(f"Rejected {self.counts['rejected']} rows with missing or invalid values")
+        return self.counts
@@ -0,0 +1,296 @@
+import logging
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from django.db.models import Model
+
+from location.importer.pipeline import (
+    CITY_FIELDS, COUNTRIES_SQL, COUNTRY_FIELDS, FINGERPRINT_FIELDS, LOCATION_FIELDS,
+    STATE_FIELDS, ZIPCODES_SELECT, ImportPipeline, fetch_chunks, row_digest,
+)
+from location.models import City, Country, Location, SourceFingerprint, State
+
+logger = logging.getLogger(__name__)
+
+# The merge join needs both sides in source id order
+STATES_BY_ID_SQL = 'SELECT id, name, country_id, abbr FROM states ORDER BY id'
+ZIPCODES_BY_ID_SQL = ZIPCODES_SELECT + ' ORDER BY id'
+
+Stored = Tuple[int, int, int]  # (source_id, digest, target_id)
+
+# The source table each fingerprinted model is imported from
+FINGERPRINTED = ((Country, 'countries'), (State, 'states'), (Location, 'zipcodes'))
+
+
+def unfingerprinted_rows(using: str = 'default') -> int:
+    """How many countries, states and locations no stored fingerprint points at.
+
+    ``IncrementalImport`` only reaches rows through their fingerprints, so
+    any such row (appended by import_from_csv, or left behind by an import
+    that did not replace the tables) would survive every later delta.
+    """
+    fingerprints = SourceFingerprint.objects.using(using)
+    return sum(
+        model.objects.using(using)
+        .exclude(id__in=fingerprints.filter(table=table).values('target_id'))
+        .count()
+        for model, table in FINGERPRINTED
+    )
+
+
+def merge_diff(rows: Iterator[tuple], stored: Iterator[Stored]
+               ) -> Iterator[Tuple[Optional[tuple], int, Optional[Stored]]]:
+    """Merge-join source rows with stored fingerprints, both ordered by id.
+
+    Yields ``(row, digest, stored)`` for every row that was added
+    (``stored`` is None), removed (``row`` is None) or changed. Unchanged
+    rows are skipped, so the work done by the caller scales with the churn.
+    """
+    stored = iter(stored)
+    current = next(stored, None)
+    for row in rows:
+        source_id = row[0]
+        while current is not None and current[0] < source_id:
+            yield None, current[1], current
+            current = next(stored, None)
+        digest = row_digest(row[1:])
+        if current is not None and current[0] == source_id:
+            if current[1] != digest:
+                yield row, digest, current
+            current = next(stored, None)
+        else:
+            yield row, digest, None
+    while current is not None:
+        yield None, current[1], current
+        current = next(stored, None)
+
+
+class IncrementalImport(ImportPipeline):
+    """Applies only the rows that changed since the last import.
+
+    Each source table is read in id order and merge-joined with the
+    fingerprints stored by the previous run; inserts, updates and deletes
+    are then applied in FK-safe order (parents inserted first, deleted
+    last) and cities left without locations are removed. Fingerprint
+    changes are buffered per table and written after its merge, because
+    SQLite gives no isolation between a cursor and writes to the table it
+    is reading.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delta: Dict[str, Dict[str, int]] = {
+            table: {'inserted': 0, 'updated': 0, 'deleted': 0}
+            for table in ('countries', 'states', 'cities', 'locations')
+        }
+        self.city_ids: Dict[Tuple[int, str], int] = {}
+        self.next_city_id = 0
+
+    def run(self) -> Dict[str, Dict[str, int]]:
+        removed_countries = self.sync_countries()
+        removed_states = self.sync_states()
+        self.cascade_removals(removed_countries, removed_states)
+        self.load_state_ids()
+        self.sync_locations()
+        self.prune_cities()
+        self.delete_rows(State, removed_states)
+        self.delete_rows(Country, removed_countries)
+        return self.delta
+
+    @property
+    def changed(self) -> bool:
+        return any(any(counts.values()) for counts in self.delta.values())
+
+    def execute_many(self, sql: str, rows: Sequence[tuple]) -> None:
+        if rows:
+            with connections[self.using].cursor() as cursor:
+                cursor.executemany(sql, rows)
+
+    def update_rows(self, model: Model, fields: Sequence[str], rows: Sequence[tuple]) -> None:
+        """Update ``fields`` by id; every row is the new values followed by the id"""
+        quote = connections[self.using].ops.quote_name
+        assignments = ', '.join(f'{quote(model._meta.get_field(name).column)} = %s' for name in fields)
+        self.execute_many(
+            f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE id = %s', rows
+        )
+
+    def delete_rows(self, model: Model, ids: Sequence[int]) -> None:
+        quote = connections[self.using].ops.quote_name
+        self.execute_many(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE id = %s', [(pk,) for pk in ids]
+        )
+
+    def diff(self, table: str, sql: str):
+        stored = (
+            SourceFingerprint.objects.using(self.using)
+            .filter(table=table)
+            .order_by('source_id')
+            .values_list('source_id', 'digest', 'target_id')
+            .iterator(chunk_size=self.batch_size)
+        )
+        rows = chain.from_iterable(fetch_chunks(self.source, sql, self.batch_size))
+        return merge_diff(rows, stored)
+
+    def save_fingerprints(self, inserted: List[tuple], updated: List[tuple], deleted: List[tuple]) -> None:
+        self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, inserted)
+        quote = connections[self.using].ops.quote_name
+        table, key = quote(SourceFingerprint._meta.db_table), f"{quote('table')} = %s AND source_id = %s"
+        self.execute_many(f'UPDATE {table} SET digest = %s WHERE {key}', updated)
+        self.execute_many(f'DELETE FROM {table} WHERE {key}', deleted)
+
+    def sync_countries(self) -> List[int]:
+        """Insert and update countries; return the ids to delete at the end"""
+        logger.info("Comparing countries...")
+        next_id = self.next_id(Country)
+        inserts, updates, removed = [], [], []
+        fingerprints = ([], [], [])
+        for row, digest, stored in self.diff('countries', COUNTRIES_SQL):
+            if row is None:
+                removed.append(stored[2])
+                fingerprints[2].append(('countries', stored[0]))
+                continue
+            source_id, name, alpha2, alpha3 = row
+            values = (name, alpha2 or '', alpha3 or '')
+            if stored is None:
+                inserts.append((next_id, *values))
+                fingerprints[0].append(('countries', source_id, digest, next_id))
+                next_id += 1
+            else:
+                updates.append((*values, stored[2]))
+                fingerprints[1].append((digest, 'countries', source_id))
+
+        self.writer.write(Country, COUNTRY_FIELDS, inserts)
+        self.update_rows(Country, COUNTRY_FIELDS[1:], updates)
+        self.save_fingerprints(*fingerprints)
+        self.country_ids = self.target_ids('countries')
+        self.delta['countries'].update(inserted=len(inserts), updated=len(updates), deleted=len(removed))
+        return removed
+
+    def sync_states(self) -> List[int]:
+        """Insert and update states; return the ids to delete at the end"""
+        logger.info("Comparing states...")
+        next_id = self.next_id(State)
+        inserts, updates, removed, moved = [], [], [], []
+        fingerprints = ([], [], [])
+        for row, digest, stored in self.diff('states', STATES_BY_ID_SQL):
+            country_id = self.country_ids.get(row[2]) if row is not None else None
+            if country_id is None:
+                if row is not None:
+                    logger.warning(f"Country not found for state: {row[1]}")
+                if stored is not None:
+                    removed.append(stored[2])
+                    fingerprints[2].append(('states', stored[0]))
+                continue
+            source_id, name, _, abbr = row
+            values = (name, country_id, abbr or '')
+            if stored is None:
+                inserts.append((next_id, *values))
+                fingerprints[0].append(('states', source_id, digest, next_id))
+                next_id += 1
+            else:
+                updates.append((*values, stored[2]))
+                moved.append((country_id, stored[2]))
+                fingerprints[1].append((digest, 'states', source_id))
+
+        self.writer.write(State, STATE_FIELDS, inserts)
+        self.update_rows(State, STATE_FIELDS[1:], updates)
+        # Locations carry their own country_id; keep it in step with the state
+        location_table = connections[self.using].ops.quote_name(Location._meta.db_table)
+        self.execute_many(
+            f'UPDATE {location_table} SET country_id = %s WHERE state_id = %s AND country_id != %s',
+            [(country_id, state_id, country_id) for country_id, state_id in moved],
+        )
+        self.save_fingerprints(*fingerprints)
+        self.delta['states'].update(inserted=len(inserts), updated=len(updates), deleted=len(removed))
+        return removed
+
+    def cascade_removals(self, removed_countries: List[int], removed_states: List[int]) -> None:
+        """Drop unchanged rows whose parent is no longer in the source.
+
+        The merge only sees rows whose own content changed, so states of a
+        removed country and zipcodes of a removed state are handled here,
+        before zipcodes are compared.
+        """
+        fingerprints = SourceFingerprint.objects.using(self.using)
+        orphaned = list(
+            State.objects.using(self.using)
+            .filter(country_id__in=removed_countries)
+            .exclude(id__in=removed_states)
+            .values_list('id', flat=True)
+        )
+        fingerprints.filter(table='states', target_id__in=orphaned).delete()
+        removed_states.extend(orphaned)
+        self.delta['states']['deleted'] += len(orphaned)
+
+        locations = Location.objects.using(self.using).filter(state_id__in=removed_states)
+        fingerprints.filter(table='zipcodes', target_id__in=locations.values('id')).delete()
+        deleted, _ = locations.delete()
+        self.delta['locations']['deleted'] += deleted
+
+    def city_id(self, state_id: int, name: str, new_cities: List[tuple]) -> int:
+        key = (state_id, name)
+        city_id = self.city_ids.get(key)
+        if city_id is None:
+            city_id = self.city_ids[key] = self.next_city_id
+            self.next_city_id += 1
+            new_cities.append((city_id, name, state_id))
+        return city_id
+
+    def sync_locations(self) -> None:
+        logger.info("Comparing zipcodes...")
+        self.city_ids = {
+            (state_id, name): city_id
+            for city_id, name, state_id in City.objects.using(self.using).values_list('id', 'name', 'state_id')
+        }
+        self.next_city_id = self.next_id(City)
+        next_id = self.next_id(Location)
+        cities, inserts, updates, removed = [], [], [], []
+        fingerprints = ([], [], [])
+
+        def flush():
+            self.writer.write(City, CITY_FIELDS, cities)
+            self.writer.write(Location, LOCATION_FIELDS, inserts)
+            self.update_rows(Location, LOCATION_FIELDS[1:], updates)
+            self.delete_rows(Location, removed)
+            counts = self.delta
+            counts['cities']['inserted'] += len(cities)
+            counts['locations']['inserted'] += len(inserts)
+            counts['locations']['updated'] += len(updates)
+            counts['locations']['deleted'] += len(removed)
+            for pending in (cities, inserts, updates, removed):
+                pending.clear()
+
+        for row, digest, stored in self.diff('zipcodes', ZIPCODES_BY_ID_SQL):
+            state = self.state_ids.get(row[3]) if row is not None else None
+            if state is None:
+                if stored is not None:
+                    removed.append(stored[2])
+                    fingerprints[2].append(('zipcodes', stored[0]))
+            else:
+                source_id, code, city_name, _, lat, lon = row
+                city_id = self.city_id(state[0], city_name, cities)
+                values = (city_id, state[0], state[1], code, lat, lon)
+                if stored is None:
+                    inserts.append((next_id, *values))
+                    fingerprints[0].append(('zipcodes', source_id, digest, next_id))
+                    next_id += 1
+                else:
+                    updates.append((*values, stored[2]))
+                    fingerprints[1].append((digest, 'zipcodes', source_id))
+            if len(inserts) + len(updates) + len(removed) >= self.batch_size:
+                flush()
+        flush()
+        self.save_fingerprints(*fingerprints)
+
+    def prune_cities(self) -> None:
+        """Delete cities that lost their last location"""
+        if not (self.delta['locations']['updated'] or self.delta['locations']['deleted']):
+            return
+        quote = connections[self.using].ops.quote_name
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(City._meta.db_table)} '
+                f'WHERE id NOT IN (SELECT city_id FROM {quote(Location._meta.db_table)})'
+            )
+            self.delta['cities']['deleted'] = cursor.rowcount
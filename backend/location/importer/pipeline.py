@@ -0,0 +1,242 @@
+import hashlib
+import logging
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from django.db.models import Max, Model
+from tqdm import tqdm
+
+from location.importer.writers import BulkWriter, RawWriter
+from location.models import City, Country, Location, SourceFingerprint, State
+from location.search import FTS_TABLE, SEARCH_TABLE, fts_available, search_table_available
+
+logger = logging.getLogger(__name__)
+
+COUNTRIES_SQL = 'SELECT id, name, alpha2, alpha3 FROM countries ORDER BY id'
+
+STATES_SQL = 'SELECT id, name, country_id, abbr FROM states ORDER BY country_id, id'
+
+ZIPCODES_SELECT = '''
+    SELECT id, code, city, state_id, lat, lon
+    FROM zipcodes
+    WHERE city IS NOT NULL
+      AND state_id IS NOT NULL
+      AND city != ''
+      AND code IS NOT NULL
+'''
+
+# Cities have no table of their own in the source: they are the distinct
+# (state_id, city) pairs of zipcodes with a code, so a city whose rows all
+# lack one is not imported, just as an incremental import prunes it. Reading zipcodes in that order lets
+# one pass emit each city the first time it is seen and then its
+# locations, without keeping a map of every city in memory.
+ZIPCODES_SQL = ZIPCODES_SELECT + ' ORDER BY state_id, city, id'
+
+COUNTRY_FIELDS = ('id', 'name', 'alpha2', 'alpha3')
+STATE_FIELDS = ('id', 'name', 'country_id', 'abbreviation')
+CITY_FIELDS = ('id', 'name', 'state_id')
+LOCATION_FIELDS = ('id', 'city_id', 'state_id', 'country_id', 'zip_code', 'latitude', 'longitude')
+FINGERPRINT_FIELDS = ('table', 'source_id', 'digest', 'target_id')
+
+
+# The tables a full import replaces, children first so no DELETE leaves a
+# dangling foreign key
+REPLACED_MODELS = (SourceFingerprint, Location, City, State, Country)
+
+
+def clear_location_tables(using: str = 'default') -> None:
+    """Empty every table a full import rebuilds; call inside its transaction.
+
+    Plain DELETEs rather than ``QuerySet.delete()``, which would load every
+    row to collect cascades. On SQLite the FTS table is recreated from its
+    own schema and the triggers on location_location are lifted for the
+    DELETE, which otherwise fire once per row; both come back unchanged
+    before this returns. Call before entering ``deferred_location_fts`` or
+    ``deferred_location_search``, which index the ids above the highest
+    one present on entry.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        triggers = []
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                [Location._meta.db_table],
+            )
+            triggers = cursor.fetchall()
+            for name, _ in triggers:
+                cursor.execute(f'DROP TRIGGER {quote(name)}')
+        if fts_available(using):
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            create_fts = cursor.fetchone()[0]
+            cursor.execute(f'DROP TABLE {FTS_TABLE}')
+            cursor.execute(create_fts)
+        if search_table_available(using):
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        for model in REPLACED_MODELS:
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)}')
+        for _, sql in triggers:
+            cursor.execute(sql)
+
+
+def row_digest(values: tuple) -> int:
+    """Signed 64-bit content hash of a source row's values, stable across runs"""
+    digest = hashlib.blake2b(repr(values).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def fetch_chunks(cursor, sql: str, size: int, params: Sequence = ()) -> Iterator[List[tuple]]:
+    """Run a source query and yield its rows ``size`` at a time"""
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+class ImportPipeline:
+    """Streams the source database into the location tables.
+
+    Stages run in FK order (countries, states, then cities and locations in
+    one pass) and every stage reads, maps and writes ``batch_size`` rows at
+    a time. Target ids are allocated here rather than by the database, so
+    the only state carried between stages is two small integer maps:
+    source country id -> target id and source state id -> (target id,
+    target country id). Peak memory is bounded by the batch size, not by
+    the size of the source.
+
+    Every imported source row is fingerprinted (see ``SourceFingerprint``)
+    so later runs can use ``IncrementalImport`` to apply only what changed.
+    Fingerprints of earlier imports are discarded at the start of a run;
+    the rows themselves are not, so a full import into a database that
+    already holds data must run ``clear_location_tables`` first.
+
+    Batches are handed to ``writer`` as plain tuples; by default that is a
+    ``RawWriter`` doing prepared ``executemany`` INSERTs on ``using``.
+    """
+
+    show_progress = True
+
+    def __init__(self, source_cursor, batch_size: int = 10000, using: str = 'default',
+                 writer: Optional[BulkWriter] = None):
+        self.source = source_cursor
+        self.batch_size = batch_size
+        self.using = using
+        self.writer = writer if writer is not None else RawWriter(using)
+        self.country_ids: Dict[int, int] = {}
+        self.state_ids: Dict[int, Tuple[int, int]] = {}
+        self.counts: Dict[str, int] = {'countries': 0, 'states': 0, 'cities': 0, 'locations': 0}
+
+    def run(self) -> Dict[str, int]:
+        SourceFingerprint.objects.using(self.using).all().delete()
+        self.import_countries()
+        self.import_states()
+        self.import_cities_and_locations()
+        return self.counts
+
+    def next_id(self, model: Model) -> int:
+        return (model.objects.using(self.using).aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def target_ids(self, table: str) -> Dict[int, int]:
+        """Source id -> target id for every fingerprinted row of a source table"""
+        return dict(
+            SourceFingerprint.objects.using(self.using)
+            .filter(table=table)
+            .values_list('source_id', 'target_id')
+        )
+
+    def load_state_ids(self) -> None:
+        """Rebuild ``state_ids`` from the fingerprints of imported states"""
+        countries = dict(State.objects.using(self.using).values_list('id', 'country_id'))
+        self.state_ids = {
+            source_id: (target_id, countries[target_id])
+            for source_id, target_id in self.target_ids('states').items()
+            if target_id in countries
+        }
+
+    def import_countries(self) -> None:
+        logger.info("Importing countries...")
+        next_id = self.next_id(Country)
+        with tqdm(desc="Importing countries", disable=not self.show_progress) as pbar:
+            for chunk in fetch_chunks(self.source, COUNTRIES_SQL, self.batch_size):
+                batch = []
+                fingerprints = []
+                for row in chunk:
+                    source_id, name, alpha2, alpha3 = row
+                    self.country_ids[source_id] = next_id
+                    batch.append((next_id, name, alpha2 or '', alpha3 or ''))
+                    fingerprints.append(('countries', source_id, row_digest(row[1:]), next_id))
+                    next_id += 1
+                self.writer.write(Country, COUNTRY_FIELDS, batch)
+                self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                self.counts['countries'] += len(batch)
+                pbar.update(len(batch))
+
+    def import_states(self) -> None:
+        logger.info("Importing states...")
+        next_id = self.next_id(State)
+        with tqdm(desc="Importing states", disable=not self.show_progress) as pbar:
+            for chunk in fetch_chunks(self.source, STATES_SQL, self.batch_size):
+                batch = []
+                fingerprints = []
+                for row in chunk:
+                    source_id, name, source_country_id, abbr = row
+                    country_id = self.country_ids.get(source_country_id)
+                    if country_id is None:
+                        logger.warning(f"Country not found for state: {name}")
+                        continue
+                    self.state_ids[source_id] = (next_id, country_id)
+                    batch.append((next_id, name, country_id, abbr or ''))
+                    fingerprints.append(('states', source_id, row_digest(row[1:]), next_id))
+                    next_id += 1
+                self.writer.write(State, STATE_FIELDS, batch)
+                self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                self.counts['states'] += len(batch)
+                pbar.update(len(batch))
+
+    def import_cities_and_locations(self, sql: str = ZIPCODES_SQL, params: Sequence = ()) -> None:
+        logger.info("Importing cities and locations...")
+        next_city_id = self.next_id(City)
+        next_location_id = self.next_id(Location)
+        current_key = None
+        city_id = state = None
+        skipped_states = set()
+
+        with tqdm(desc="Importing locations", disable=not self.show_progress) as pbar:
+            for chunk in fetch_chunks(self.source, sql, self.batch_size, params):
+                city_batch = []
+                location_batch = []
+                fingerprints = []
+                for row in chunk:
+                    source_id, code, city_name, source_state_id, lat, lon = row
+                    key = (source_state_id, city_name)
+                    if key != current_key:
+                        current_key = key
+                        state = self.state_ids.get(source_state_id)
+                        if state is None:
+                            if source_state_id not in skipped_states:
+                                skipped_states.add(source_state_id)
+                                logger.warning(f"State not found for zipcodes with state_id {source_state_id}")
+                            continue
+                        city_id = next_city_id
+                        next_city_id += 1
+                        city_batch.append((city_id, city_name, state[0]))
+                    if state is None:
+                        continue
+                    location_batch.append(
+                        (next_location_id, city_id, state[0], state[1], code, lat, lon)
+                    )
+                    fingerprints.append(('zipcodes', source_id, row_digest(row[1:]), next_location_id))
+                    next_location_id += 1
+
+                # Cities first so every location batch references rows that exist
+                self.writer.write(City, CITY_FIELDS, city_batch)
+                self.writer.write(Location, LOCATION_FIELDS, location_batch)
+                self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                self.counts['cities'] += len(city_batch)
+                self.counts['locations'] += len(location_batch)
+                pbar.update(len(location_batch))
+
+        logger.info(f"Imported {self.counts['locations']} locations")
@@ -0,0 +1,236 @@
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from tqdm import tqdm
+
+from location.importer.pipeline import (
+    CITY_FIELDS, COUNTRIES_SQL, COUNTRY_FIELDS, FINGERPRINT_FIELDS, LOCATION_FIELDS,
+    STATE_FIELDS, ZIPCODES_SELECT, ImportPipeline, clear_location_tables, fetch_chunks, row_digest,
+)
+from location.models import City, Country, ImportCheckpoint, Location, SourceFingerprint, State
+from location.search import (
+    resume_location_fts, resume_location_search, suspend_location_fts, suspend_location_search,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('countries', 'states', 'cities', 'locations')
+
+# Every stage reads its source rows in key order from just past the last
+# committed key, so a resumed stage continues exactly where it stopped.
+COUNTRIES_AFTER_SQL = 'SELECT id, name, alpha2, alpha3 FROM countries WHERE id > ? ORDER BY id'
+STATES_AFTER_SQL = 'SELECT id, name, country_id, abbr FROM states WHERE id > ? ORDER BY id'
+CITIES_AFTER_SQL = '''
+    SELECT state_id, city
+    FROM zipcodes
+    WHERE city IS NOT NULL
+      AND state_id IS NOT NULL
+      AND city != ''
+      AND code IS NOT NULL
+      AND (state_id > ? OR (state_id = ? AND city > ?))
+    GROUP BY state_id, city
+    ORDER BY state_id, city
+'''
+ZIPCODES_AFTER_SQL = ZIPCODES_SELECT + ' AND id > ? ORDER BY id'
+
+
+class SourceChanged(Exception):
+    pass
+
+
+def source_signature(path: str) -> str:
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class ResumableImport(ImportPipeline):
+    """A full import that commits every batch together with a checkpoint.
+
+    Stages run as countries, states, cities, then locations keyed by source
+    ``zipcodes.id``, and each batch is written in its own transaction with
+    an ``ImportCheckpoint`` update, so an interrupted run can be continued
+    without redoing or duplicating committed batches. The id maps between
+    stages are rebuilt from ``SourceFingerprint`` rows and the cities of
+    the imported states, so nothing needs to survive in memory. A fresh
+    run empties the imported tables in its first transaction.
+
+    The FTS and LocationSearch insert triggers stay dropped from the start
+    of the locations stage until it finishes; new locations become
+    searchable and listed once the import (or its resumption) completes.
+    """
+
+    def __init__(self, source_cursor, source_path: str, batch_size: int = 10000,
+                 using: str = 'default', writer=None):
+        super().__init__(source_cursor, batch_size=batch_size, using=using, writer=writer)
+        self.source_path = os.path.abspath(source_path)[-255:]
+        self.signature = source_signature(source_path)
+        self.city_ids: Dict[Tuple[int, str], int] = {}
+        self.resumed = False
+
+    def checkpoints(self):
+        return ImportCheckpoint.objects.using(self.using).filter(source=self.source_path)
+
+    def start(self) -> Dict[str, ImportCheckpoint]:
+        """Load the checkpoints of an interrupted run, or begin a new one"""
+        existing = {checkpoint.stage: checkpoint for checkpoint in self.checkpoints()}
+        if existing:
+            if any(checkpoint.signature != self.signature for checkpoint in existing.values()):
+                raise SourceChanged(
+                    f'{self.source_path} changed since the interrupted import; '
+                    'it cannot be resumed'
+                )
+            self.resumed = True
+            for stage, checkpoint in existing.items():
+                self.counts[stage] = checkpoint.rows
+            return existing
+
+        with transaction.atomic(using=self.using):
+            clear_location_tables(self.using)
+            return {
+                stage: ImportCheckpoint.objects.using(self.using).create(
+                    source=self.source_path, signature=self.signature, stage=stage,
+                )
+                for stage in STAGES
+            }
+
+    def commit(self, checkpoint: ImportCheckpoint, position, rows: int) -> None:
+        """Advance a checkpoint; call inside the batch's transaction"""
+        checkpoint.position = position
+        checkpoint.rows += rows
+        ImportCheckpoint.objects.using(self.using).filter(pk=checkpoint.pk).update(
+            position=position, rows=F('rows') + rows,
+        )
+        self.counts[checkpoint.stage] += rows
+
+    def finish(self, checkpoint: ImportCheckpoint) -> None:
+        checkpoint.finished = True
+        ImportCheckpoint.objects.using(self.using).filter(pk=checkpoint.pk).update(finished=True)
+
+    def run(self) -> Dict[str, int]:
+        checkpoints = self.start()
+        for stage in STAGES:
+            checkpoint = checkpoints[stage]
+            if not checkpoint.finished:
+                getattr(self, f'resume_{stage}')(checkpoint)
+        # The run is complete; the next --resume starts a fresh import
+        self.checkpoints().delete()
+        return self.counts
+
+    def resume_countries(self, checkpoint: ImportCheckpoint) -> None:
+        logger.info("Importing countries...")
+        next_id = self.next_id(Country)
+        after = checkpoint.position or 0
+        for chunk in fetch_chunks(self.source, COUNTRIES_AFTER_SQL, self.batch_size, [after]):
+            batch, fingerprints = [], []
+            for row in chunk:
+                source_id, name, alpha2, alpha3 = row
+                batch.append((next_id, name, alpha2 or '', alpha3 or ''))
+                fingerprints.append(('countries', source_id, row_digest(row[1:]), next_id))
+                next_id += 1
+            with transaction.atomic(using=self.using):
+                self.writer.write(Country, COUNTRY_FIELDS, batch)
+                self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                self.commit(checkpoint, chunk[-1][0], len(batch))
+        self.finish(checkpoint)
+
+    def resume_states(self, checkpoint: ImportCheckpoint) -> None:
+        logger.info("Importing states...")
+        country_ids = self.target_ids('countries')
+        next_id = self.next_id(State)
+        after = checkpoint.position or 0
+        for chunk in fetch_chunks(self.source, STATES_AFTER_SQL, self.batch_size, [after]):
+            batch, fingerprints = [], []
+            for row in chunk:
+                source_id, name, source_country_id, abbr = row
+                country_id = country_ids.get(source_country_id)
+                if country_id is None:
+                    logger.warning(f"Country not found for state: {name}")
+                    continue
+                batch.append((next_id, name, country_id, abbr or ''))
+                fingerprints.append(('states', source_id, row_digest(row[1:]), next_id))
+                next_id += 1
+            with transaction.atomic(using=self.using):
+                self.writer.write(State, STATE_FIELDS, batch)
+                self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                self.commit(checkpoint, chunk[-1][0], len(batch))
+        self.finish(checkpoint)
+
+    def resume_cities(self, checkpoint: ImportCheckpoint) -> None:
+        logger.info("Importing cities...")
+        self.load_state_ids()
+        next_id = self.next_id(City)
+        # (state_id, city) of the last committed city; sorts before every real key
+        last_state, last_city = checkpoint.position or (-1, '')
+        params = [last_state, last_state, last_city]
+        with tqdm(desc="Importing cities", disable=not self.show_progress) as pbar:
+            for chunk in fetch_chunks(self.source, CITIES_AFTER_SQL, self.batch_size, params):
+                batch = []
+                for source_state_id, name in chunk:
+                    state = self.state_ids.get(source_state_id)
+                    if state is None:
+                        continue
+                    batch.append((next_id, name, state[0]))
+                    next_id += 1
+                with transaction.atomic(using=self.using):
+                    self.writer.write(City, CITY_FIELDS, batch)
+                    self.commit(checkpoint, list(chunk[-1]), len(batch))
+                pbar.update(len(batch))
+        self.finish(checkpoint)
+
+    def load_city_ids(self) -> None:
+        state_ids = [target_id for target_id, _ in self.state_ids.values()]
+        self.city_ids = {
+            (state_id, name): city_id
+            for city_id, name, state_id in (
+                City.objects.using(self.using)
+                .filter(state_id__in=state_ids)
+                .values_list('id', 'name', 'state_id')
+                .iterator(chunk_size=self.batch_size)
+            )
+        }
+
+    def resume_locations(self, checkpoint: ImportCheckpoint) -> None:
+        logger.info("Importing locations...")
+        self.load_state_ids()
+        self.load_city_ids()
+        position = checkpoint.position or {}
+        if 'fts_after' not in position:
+            # Committed with the checkpoint so a resumed run knows which
+            # locations still need indexing and that the triggers are gone.
+            with transaction.atomic(using=self.using):
+                position = {
+                    'id': 0,
+                    'fts_after': suspend_location_fts(self.using),
+                    'search_after': suspend_location_search(self.using),
+                }
+                self.commit(checkpoint, position, 0)
+
+        next_id = self.next_id(Location)
+        with tqdm(desc="Importing locations", disable=not self.show_progress) as pbar:
+            for chunk in fetch_chunks(self.source, ZIPCODES_AFTER_SQL, self.batch_size, [position['id']]):
+                batch, fingerprints = [], []
+                for row in chunk:
+                    source_id, code, city_name, source_state_id, lat, lon = row
+                    state = self.state_ids.get(source_state_id)
+                    if state is None or code is None:
+                        continue
+                    city_id: Optional[int] = self.city_ids.get((state[0], city_name))
+                    if city_id is None:
+                        continue
+                    batch.append((next_id, city_id, state[0], state[1], code, lat, lon))
+                    fingerprints.append(('zipcodes', source_id, row_digest(row[1:]), next_id))
+                    next_id += 1
+                position = {**position, 'id': chunk[-1][0]}
+                with transaction.atomic(using=self.using):
+                    self.writer.write(Location, LOCATION_FIELDS, batch)
+                    self.writer.write(SourceFingerprint, FINGERPRINT_FIELDS, fingerprints)
+                    self.commit(checkpoint, position, len(batch))
+                pbar.update(len(batch))
+
+        with transaction.atomic(using=self.using):
+            resume_location_fts(position['fts_after'], self.using)
+            resume_location_search(position.get('search_after'), self.using)
+            self.finish(checkpoint)
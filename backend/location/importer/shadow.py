@@ -0,0 +1,167 @@
+import logging
+import os
+import sqlite3
+from typing import Iterable
+
+from django.core.management import call_command
+from django.db import connections, transaction
+
+from location.models import (
+    City, Country, CountryHierarchy, Location, LocationSearch, SourceFingerprint, State,
+)
+from location.search import FTS_TABLE, optimize_location_fts
+
+logger = logging.getLogger(__name__)
+
+# Tables the import rebuilds from scratch; every other table is copied over
+# from the live database so users, sessions and version history survive.
+IMPORTED_TABLES = tuple(
+    model._meta.db_table for model in (Country, State, City, Location, LocationSearch, CountryHierarchy, SourceFingerprint)
+) + (FTS_TABLE,)
+
+
+def fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ShadowDatabase:
+    """A complete SQLite database built next to the live one, then swapped in.
+
+    ``create`` migrates an empty file at ``<live>.shadow`` and registers it
+    as the ``alias`` connection, so the import writes there through the
+    ordinary ``using`` plumbing while the live file keeps serving reads.
+    ``finish`` collects ``ANALYZE`` statistics and flushes the file, and
+    ``swap`` renames it over the live path. The rename is atomic: readers
+    see either the old file or the new one, never a partial import, and
+    ``location.db.reopen_swapped_databases`` moves server processes to the
+    new file on their next request. A live file in WAL mode is overwritten
+    in one transaction instead (see ``copy_into_live``).
+    """
+
+    def __init__(self, using: str = 'default', alias: str = 'location_shadow'):
+        self.using = using
+        self.alias = alias
+        settings_dict = connections[using].settings_dict
+        if connections[using].vendor != 'sqlite':
+            raise ValueError('Shadow imports need a SQLite database')
+        self.live_path = str(settings_dict['NAME'])
+        self.path = f'{self.live_path}.shadow'
+
+    def remove_files(self) -> None:
+        # A build that crashed in WAL mode (SQLITE_PRAGMAS applies to the
+        # shadow connection too) leaves -wal and -shm files SQLite would
+        # replay into the next file created at this path
+        for path in (self.path, *(f'{self.path}{suffix}' for suffix in ('-journal', '-wal', '-shm'))):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def create(self) -> None:
+        self.remove_files()
+        connections.settings[self.alias] = {**connections[self.using].settings_dict, 'NAME': self.path}
+        call_command('migrate', database=self.alias, interactive=False, verbosity=0)
+        self.copy_live_tables()
+        with connections[self.alias].cursor() as cursor:
+            # Nothing reads the shadow until it is finished, and a failed
+            # build is thrown away, so skip the durability work.
+            cursor.execute('PRAGMA synchronous = OFF')
+            cursor.execute('PRAGMA journal_mode = MEMORY')
+
+    def shadow_tables(self, cursor) -> Iterable[str]:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%%' AND name NOT LIKE %s",
+            [f'{FTS_TABLE}_%'],
+        )
+        skip = set(IMPORTED_TABLES) | {'django_migrations'}
+        return [name for name, in cursor.fetchall() if name not in skip]
+
+    def copy_live_tables(self) -> None:
+        connection = connections[self.alias]
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute('ATTACH DATABASE %s AS live', [self.live_path])
+            try:
+                cursor.execute("SELECT name FROM live.sqlite_master WHERE type = 'table'")
+                live_tables = {name for name, in cursor.fetchall()}
+                with transaction.atomic(using=self.alias):
+                    for table in self.shadow_tables(cursor):
+                        if table not in live_tables:
+                            continue
+                        cursor.execute(f'PRAGMA main.table_info({quote(table)})')
+                        columns = ', '.join(quote(row[1]) for row in cursor.fetchall())
+                        cursor.execute(f'DELETE FROM main.{quote(table)}')
+                        cursor.execute(
+                            f'INSERT INTO main.{quote(table)} ({columns}) '
+                            f'SELECT {columns} FROM live.{quote(table)}'
+                        )
+            finally:
+                cursor.execute('DETACH DATABASE live')
+
+    def finish(self) -> None:
+        """Gather planner statistics and make the file durable before the swap"""
+        optimize_location_fts(self.alias)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        connections[self.alias].close()
+        fsync_path(self.path)
+
+    def live_journal_mode(self) -> str:
+        live = sqlite3.connect(self.live_path)
+        try:
+            return live.execute('PRAGMA journal_mode').fetchone()[0].lower()
+        finally:
+            live.close()
+
+    def swap(self) -> None:
+        """Atomically replace the live database's contents with the shadow"""
+        connections[self.using].close()
+        if self.live_journal_mode() == 'wal':
+            self.copy_into_live()
+        else:
+            self.rename_over_live()
+        self.discard()
+        logger.info(f"Swapped {self.path} into {self.live_path}")
+
+    def rename_over_live(self) -> None:
+        # Holding the write lock keeps any other writer from having a hot
+        # journal that would otherwise be replayed into the new file.
+        live = sqlite3.connect(self.live_path, isolation_level=None)
+        try:
+            live.execute('BEGIN IMMEDIATE')
+            os.replace(self.path, self.live_path)
+            live.execute('ROLLBACK')
+        finally:
+            live.close()
+        fsync_path(os.path.dirname(os.path.abspath(self.live_path)))
+
+    def copy_into_live(self) -> None:
+        """Swap for a live file in WAL mode, which cannot be renamed over.
+
+        The -wal and -shm files belong to the path, not the file: open
+        connections keep using them for the old file, and a new file at the
+        same path would pick up the old file's frames. Instead the shadow is
+        copied into the live file with the backup API, in one write
+        transaction. Readers keep their snapshot until it commits and then
+        see the new data; the file and its WAL mode stay in place.
+        """
+        shadow = sqlite3.connect(self.path)
+        live = sqlite3.connect(self.live_path, timeout=60)
+        try:
+            shadow.backup(live)
+            live.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            live.close()
+            shadow.close()
+
+    def discard(self) -> None:
+        if self.alias in connections.settings:
+            connections[self.alias].close()
+            # Drop the cached connection too, or the next shadow import in
+            # this process would reuse it with this database's settings.
+            del connections[self.alias]
+            del connections.settings[self.alias]
+        self.remove_files()
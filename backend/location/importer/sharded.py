@@ -0,0 +1,288 @@
+import heapq
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from django.db.models import Model
+from tqdm import tqdm
+
+from location.importer.pipeline import (
+    CITY_FIELDS, FINGERPRINT_FIELDS, LOCATION_FIELDS, ZIPCODES_SELECT, ImportPipeline,
+)
+from location.importer.writers import BulkWriter
+from location.models import City, Location, SourceFingerprint
+
+logger = logging.getLogger(__name__)
+
+# Zipcodes per source state, for states whose country is in the source; the
+# same rows import_states keeps and ZIPCODES_SELECT reads.
+SHARD_SIZES_SQL = '''
+    SELECT z.state_id, count(*)
+    FROM zipcodes z
+    JOIN states s ON s.id = z.state_id
+    JOIN countries c ON c.id = s.country_id
+    WHERE z.city IS NOT NULL
+      AND z.city != ''
+      AND z.code IS NOT NULL
+    GROUP BY z.state_id
+'''
+
+STAGED = ((City, CITY_FIELDS), (Location, LOCATION_FIELDS), (SourceFingerprint, FINGERPRINT_FIELDS))
+
+# Staged ids are dense from 1 within a file. Merging adds an offset per id
+# space; state_id and country_id are still source state ids and are mapped
+# through location_state_map when the rows reach the target.
+OFFSETS = {
+    (City, 'id'): 'city',
+    (Location, 'id'): 'location',
+    (Location, 'city_id'): 'city',
+    (SourceFingerprint, 'target_id'): 'location',
+}
+
+
+def quote(name: str) -> str:
+    return '"%s"' % name
+
+
+def staged_columns(model: Model, fields: Sequence[str]) -> List[str]:
+    return [model._meta.get_field(name).column for name in fields]
+
+
+def create_staging(connection: sqlite3.Connection) -> None:
+    """Create the staged tables, named and laid out like their targets"""
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute('PRAGMA journal_mode = OFF')
+    for model, fields in STAGED:
+        columns = ', '.join(
+            f'{quote(column)} INTEGER PRIMARY KEY' if column == 'id' else quote(column)
+            for column in staged_columns(model, fields)
+        )
+        connection.execute(f'CREATE TABLE {quote(model._meta.db_table)} ({columns})')
+
+
+class StagingWriter(BulkWriter):
+    """Writes batches to a staging SQLite file instead of a Django database"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        super().__init__(using=None)
+        self.connection = connection
+
+    def insert(self, model: Model, fields: Sequence[str], rows: List[tuple]) -> None:
+        columns = ', '.join(quote(column) for column in staged_columns(model, fields))
+        placeholders = ', '.join(['?'] * len(fields))
+        self.connection.executemany(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows
+        )
+
+
+class ShardPipeline(ImportPipeline):
+    """The cities and locations pass over some source states, into a staging file"""
+
+    show_progress = False
+
+    def next_id(self, model: Model) -> int:
+        return 1
+
+
+def build_shard(source_path: str, shard_path: str, state_ids: Sequence[int],
+                batch_size: int, cache_mb: int) -> Dict[str, int]:
+    """Stage the cities and locations of ``state_ids``; runs in a worker process"""
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    staging = sqlite3.connect(shard_path)
+    try:
+        source.execute(f'PRAGMA cache_size = -{cache_mb * 1024}')
+        source.execute('PRAGMA temp_store = FILE')
+        create_staging(staging)
+        pipeline = ShardPipeline(source.cursor(), batch_size=batch_size, writer=StagingWriter(staging))
+        # Identity map: staged rows keep the source state id, and country 0
+        # until the merge looks the real ones up.
+        pipeline.state_ids = {state_id: (state_id, 0) for state_id in state_ids}
+        placeholders = ', '.join(['?'] * len(state_ids))
+        pipeline.import_cities_and_locations(
+            ZIPCODES_SELECT + f' AND state_id IN ({placeholders}) ORDER BY state_id, city, id',
+            list(state_ids),
+        )
+        staging.commit()
+        return pipeline.counts
+    finally:
+        staging.close()
+        source.close()
+
+
+def partition(sizes: Sequence[Tuple[int, int]], shards: int) -> List[List[int]]:
+    """Spread (state_id, rows) over ``shards`` lists, largest state first onto the lightest"""
+    heap = [(0, shard) for shard in range(shards)]
+    states: List[List[int]] = [[] for _ in range(shards)]
+    for state_id, rows in sorted(sizes, key=lambda size: (-size[1], size[0])):
+        load, shard = heapq.heappop(heap)
+        states[shard].append(state_id)
+        heapq.heappush(heap, (load + rows, shard))
+    return [shard for shard in states if shard]
+
+
+class ShardedImport(ImportPipeline):
+    """A full import whose cities and locations pass runs in ``workers`` processes.
+
+    ``prepare`` splits the source states into shards balanced by zipcode
+    count (a city never spans states, so shards share nothing) and each
+    worker runs the ordinary single-pass loop over its states into a private
+    staging SQLite file. The shard files are then concatenated into one
+    staging file with their city and location ids offset so they no longer
+    overlap. This happens before the import transaction; SQLite can attach
+    only a handful of databases at once and cannot detach one inside a
+    transaction, so the target only ever attaches the merged file.
+
+    ``run`` then imports countries and states as usual and copies the staged
+    rows with ``INSERT ... SELECT``, shifting ids past the target's current
+    maximum and swapping source state ids for target state and country ids.
+    ``cleanup`` detaches and deletes the staging files; ``staged`` runs
+    ``prepare`` and ``cleanup`` around the import transaction.
+    """
+
+    def __init__(self, source_cursor, source_path: str, workers: int, batch_size: int = 10000,
+                 using: str = 'default', writer: Optional[BulkWriter] = None,
+                 source_cache_mb: int = 64):
+        super().__init__(source_cursor, batch_size=batch_size, using=using, writer=writer)
+        self.source_path = os.path.abspath(source_path)
+        self.workers = workers
+        self.source_cache_mb = source_cache_mb
+        self.directory: Optional[str] = None
+        self.staging_path: Optional[str] = None
+        self.attached = False
+
+    def staging_dir(self) -> Optional[str]:
+        """Beside the target database, since the staged rows are as large as the import"""
+        name = connections[self.using].settings_dict['NAME']
+        if connections[self.using].vendor == 'sqlite' and os.path.isabs(str(name)):
+            return os.path.dirname(str(name))
+        return None
+
+    def prepare(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='location-import-', dir=self.staging_dir())
+        self.source.execute(SHARD_SIZES_SQL)
+        shards = partition(self.source.fetchall(), self.workers)
+        logger.info(f"Staging cities and locations in {len(shards)} shards...")
+
+        paths = [os.path.join(self.directory, f'shard-{n}.sqlite3') for n in range(len(shards))]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool, \
+                tqdm(total=len(shards), desc="Staging shards", unit='shard') as pbar:
+            futures = [
+                pool.submit(build_shard, self.source_path, path, states,
+                            self.batch_size, self.source_cache_mb)
+                for path, states in zip(paths, shards)
+            ]
+            for future in as_completed(futures):
+                future.result()
+                pbar.update(1)
+
+        self.staging_path = os.path.join(self.directory, 'staging.sqlite3')
+        self.merge_shards(paths)
+
+    def merge_shards(self, paths: Sequence[str]) -> None:
+        staging = sqlite3.connect(self.staging_path, isolation_level=None)
+        try:
+            create_staging(staging)
+            offsets = {'city': 0, 'location': 0}
+            for path in paths:
+                staging.execute('ATTACH DATABASE ? AS shard', [path])
+                staging.execute('BEGIN')
+                for model, fields in STAGED:
+                    table = quote(model._meta.db_table)
+                    columns = staged_columns(model, fields)
+                    select = ', '.join(
+                        f'{quote(column)} + {offsets[OFFSETS[model, name]]}'
+                        if (model, name) in OFFSETS else quote(column)
+                        for name, column in zip(fields, columns)
+                    )
+                    staging.execute(
+                        f'INSERT INTO main.{table} ({", ".join(map(quote, columns))}) '
+                        f'SELECT {select} FROM shard.{table}'
+                    )
+                staging.execute('COMMIT')
+                offsets['city'] = staging.execute('SELECT coalesce(max(id), 0) FROM location_city').fetchone()[0]
+                offsets['location'] = staging.execute('SELECT coalesce(max(id), 0) FROM location_location').fetchone()[0]
+                staging.execute('DETACH DATABASE shard')
+                os.remove(path)
+        finally:
+            staging.close()
+
+    def run(self) -> Dict[str, int]:
+        if self.staging_path is None:
+            raise RuntimeError('ShardedImport.prepare() must run before run()')
+        SourceFingerprint.objects.using(self.using).all().delete()
+        self.import_countries()
+        self.import_states()
+        self.load_staging()
+        return self.counts
+
+    def load_staging(self) -> None:
+        logger.info("Merging staged cities and locations...")
+        city_offset = self.next_id(City) - 1
+        location_offset = self.next_id(Location) - 1
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('ATTACH DATABASE %s AS staging', [self.staging_path])
+            self.attached = True
+            cursor.execute(
+                'CREATE TEMP TABLE location_state_map '
+                '(source_id INTEGER PRIMARY KEY, state_id INTEGER, country_id INTEGER)'
+            )
+            cursor.executemany(
+                'INSERT INTO location_state_map VALUES (%s, %s, %s)',
+                [(source_id, *target) for source_id, target in self.state_ids.items()],
+            )
+
+            start = time.perf_counter()
+            cursor.execute(
+                'INSERT INTO location_city (id, name, state_id) '
+                'SELECT c.id + %s, c.name, m.state_id '
+                'FROM staging.location_city c JOIN location_state_map m ON m.source_id = c.state_id',
+                [city_offset],
+            )
+            self.counts['cities'] = cursor.rowcount
+            self.writer.record(City._meta.db_table, cursor.rowcount, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            cursor.execute(
+                'INSERT INTO location_location '
+                '(id, city_id, state_id, country_id, zip_code, latitude, longitude) '
+                'SELECT l.id + %s, l.city_id + %s, m.state_id, m.country_id, l.zip_code, l.latitude, l.longitude '
+                'FROM staging.location_location l JOIN location_state_map m ON m.source_id = l.state_id',
+                [location_offset, city_offset],
+            )
+            self.counts['locations'] = cursor.rowcount
+            self.writer.record(Location._meta.db_table, cursor.rowcount, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            cursor.execute(
+                'INSERT INTO location_sourcefingerprint ("table", source_id, digest, target_id) '
+                'SELECT "table", source_id, digest, target_id + %s FROM staging.location_sourcefingerprint',
+                [location_offset],
+            )
+            self.writer.record(SourceFingerprint._meta.db_table, cursor.rowcount, time.perf_counter() - start)
+            cursor.execute('DROP TABLE location_state_map')
+        logger.info(f"Imported {self.counts['locations']} locations")
+
+    @contextmanager
+    def staged(self):
+        """Build the staging file on entry and remove it on exit; wrap the import transaction"""
+        try:
+            self.prepare()
+            yield self
+        finally:
+            self.cleanup()
+
+    def cleanup(self) -> None:
+        if self.attached:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute('DETACH DATABASE staging')
+            self.attached = False
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = self.staging_path = None
@@ -0,0 +1,103 @@
+import itertools
+import random
+import sqlite3
+import string
+from typing import Dict, List
+
+# The layout import_locations.validate_database expects of a source file
+SOURCE_SCHEMA = '''
+    CREATE TABLE countries (id INTEGER PRIMARY KEY, alpha2 TEXT, alpha3 TEXT, iso TEXT, name TEXT);
+    CREATE TABLE states (id INTEGER PRIMARY KEY, country_id INTEGER, abbr TEXT, name TEXT);
+    CREATE TABLE counties (
+        id INTEGER PRIMARY KEY, state_id INTEGER, abbr TEXT, name TEXT, county_seat TEXT
+    );
+    CREATE TABLE zipcodes (
+        id INTEGER PRIMARY KEY, code TEXT, state_id INTEGER, city TEXT, area_code TEXT,
+        lat REAL, lon REAL, accuracy INTEGER
+    );
+'''
+
+SYLLABLES = (
+    'an', 'ber', 'cas', 'del', 'es', 'for', 'gan', 'har', 'is', 'jo', 'ka', 'lin', 'mar',
+    'nor', 'o', 'pe', 'qui', 'ros', 'san', 'ter', 'u', 'val', 'wes', 'xa', 'yor', 'zé',
+    'ñu', 'lö', 'ville', 'ton', 'burg', 'field', 'port', 'ford',
+)
+
+
+def make_name(rng: random.Random, syllables: int) -> str:
+    """A pronounceable, title-cased name, sometimes with accents or two words"""
+    words = [
+        ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+        for _ in range(2 if rng.random() < 0.2 else 1)
+    ]
+    return ' '.join(words)
+
+
+def letter_code(n: int, length: int) -> str:
+    letters = []
+    for _ in range(length):
+        n, letter = divmod(n, 26)
+        letters.append(string.ascii_uppercase[letter])
+    return ''.join(reversed(letters))
+
+
+def generate_source(path: str, countries: int = 3, states: int = 50, cities: int = 200,
+                    zipcodes: int = 300000, seed: int = 1, batch_size: int = 10000) -> Dict[str, int]:
+    """Write a synthetic source database for ``import_locations`` to ``path``.
+
+    ``states`` is per country and ``cities`` per state; the ``zipcodes``
+    rows are spread over the cities with a long tail, as in real data, so
+    a few cities get hundreds of codes and most get a handful. Each city
+    sits in a small box around its own centre, inside its state's box.
+    The same arguments and ``seed`` always produce the same file.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SOURCE_SCHEMA)
+
+        connection.executemany('INSERT INTO countries VALUES (?, ?, ?, ?, ?)', [
+            (n + 1, letter_code(n, 2), letter_code(n, 3), f'{n + 1:03d}', make_name(rng, 3))
+            for n in range(countries)
+        ])
+
+        state_rows, centres = [], []
+        for country_id in range(1, countries + 1):
+            for n in range(states):
+                state_rows.append((len(state_rows) + 1, country_id, letter_code(n, 2), make_name(rng, 3)))
+                centres.append((rng.uniform(-60, 60), rng.uniform(-170, 170)))
+        connection.executemany('INSERT INTO states VALUES (?, ?, ?, ?)', state_rows)
+
+        # (state id, name, lat, lon) per city; zipcodes pick cities with a
+        # Zipf-like weight by rank within the state
+        city_rows: List[tuple] = []
+        for state_id, (lat, lon) in enumerate(centres, start=1):
+            names = set()
+            while len(names) < cities:
+                names.add(make_name(rng, rng.randint(2, 3)))
+            for name in sorted(names):
+                city_rows.append((state_id, name, lat + rng.uniform(-3, 3), lon + rng.uniform(-3, 3)))
+        cum_weights = list(itertools.accumulate(1 / (rank % cities + 1) for rank in range(len(city_rows))))
+        picks = range(len(city_rows))
+
+        for start in range(1, zipcodes + 1, batch_size):
+            batch = []
+            count = min(batch_size, zipcodes + 1 - start)
+            for zip_id, city in enumerate(rng.choices(picks, cum_weights=cum_weights, k=count), start=start):
+                state_id, name, lat, lon = city_rows[city]
+                batch.append((
+                    zip_id, f'{zip_id % 100000:05d}', state_id, name, f'{rng.randint(200, 999)}',
+                    round(lat + rng.uniform(-0.2, 0.2), 4), round(lon + rng.uniform(-0.2, 0.2), 4), 4,
+                ))
+            connection.executemany('INSERT INTO zipcodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+        connection.commit()
+    finally:
+        connection.close()
+    return {
+        'countries': countries,
+        'states': len(state_rows),
+        'cities': len(city_rows),
+        'zipcodes': zipcodes,
+    }
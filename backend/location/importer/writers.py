@@ -0,0 +1,144 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from django.db.models import Model
+
+
+class BulkWriter:
+    """Writes batches of plain tuples to one table at a time.
+
+    Subclasses implement ``insert``; this base class keeps per-table row
+    counts and the time spent writing, so the import can report rows/sec
+    for each table whichever writer ran.
+    """
+
+    def __init__(self, using: str = 'default'):
+        self.using = using
+        self.rows: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def write(self, model: Model, fields: Sequence[str], rows: List[tuple]) -> None:
+        if not rows:
+            return
+        start = time.perf_counter()
+        self.insert(model, fields, rows)
+        self.record(model._meta.db_table, len(rows), time.perf_counter() - start)
+
+    def record(self, table: str, rows: int, seconds: float) -> None:
+        """Count rows written to ``table`` by other means, e.g. INSERT ... SELECT"""
+        self.seconds[table] = self.seconds.get(table, 0.0) + seconds
+        self.rows[table] = self.rows.get(table, 0) + rows
+
+    def insert(self, model: Model, fields: Sequence[str], rows: List[tuple]) -> None:
+        raise NotImplementedError
+
+    def rates(self) -> Dict[str, Optional[float]]:
+        """Rows per second of write time for every table written so far; None where no time was measured"""
+        return {
+            table: self.rows[table] / seconds if seconds else None
+            for table, seconds in self.seconds.items()
+        }
+
+
+class OrmWriter(BulkWriter):
+    """Builds model instances and goes through ``bulk_create``"""
+
+    def insert(self, model: Model, fields: Sequence[str], rows: List[tuple]) -> None:
+        objects = [model(**dict(zip(fields, row))) for row in rows]
+        model.objects.using(self.using).bulk_create(objects, batch_size=len(objects))
+
+
+class RawWriter(BulkWriter):
+    """Sends tuples straight to the cursor with one prepared INSERT per table.
+
+    No model instances are built and the statement text is the same for
+    every batch, so the driver reuses its prepared statement and each row
+    is a single bind-and-step. Rows must already be in ``fields`` order with
+    database-ready values; nothing is validated or converted.
+    """
+
+    def __init__(self, using: str = 'default'):
+        super().__init__(using)
+        self.statements: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+
+    def statement(self, model: Model, fields: Sequence[str]) -> str:
+        key = (model._meta.label, tuple(fields))
+        sql = self.statements.get(key)
+        if sql is None:
+            quote = connections[self.using].ops.quote_name
+            columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+            placeholders = ', '.join(['%s'] * len(fields))
+            sql = self.statements[key] = (
+                f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+            )
+        return sql
+
+    def insert(self, model: Model, fields: Sequence[str], rows: List[tuple]) -> None:
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(self.statement(model, fields), rows)
+
+
+WRITERS = {
+    'raw': RawWriter,
+    'orm': OrmWriter,
+}
+
+
+@contextmanager
+def deferred_indexes(model: Model, using: str = 'default'):
+    """Drop a table's secondary indexes for a bulk load and rebuild them after.
+
+    Inserting in arbitrary key order keeps every index's pages churning;
+    building each index once from the finished table is much cheaper. The
+    indexes are recreated from their own SQL, so Django-managed and raw
+    indexes come back unchanged. SQLite only; use inside a transaction so a
+    failed load cannot leave the table without its indexes.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            [model._meta.db_table],
+        )
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for _, sql in indexes:
+                cursor.execute(sql)
+
+
+def drop_model_indexes(model: Model, using: str = 'default') -> None:
+    """Drop the ``Meta.indexes`` of ``model`` ahead of a bulk load.
+
+    Unlike ``deferred_indexes`` this does not need to stay inside one
+    transaction: ``create_model_indexes`` rebuilds the indexes from the
+    model, so even a run that was killed in between can restore them.
+    """
+    connection = connections[using]
+    editor = connection.schema_editor()
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for index in model._meta.indexes:
+            if index.name in existing:
+                cursor.execute(str(index.remove_sql(model, editor)))
+
+
+def create_model_indexes(model: Model, using: str = 'default') -> None:
+    """Create whichever of ``model``'s ``Meta.indexes`` are missing"""
+    connection = connections[using]
+    editor = connection.schema_editor()
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for index in model._meta.indexes:
+            if index.name not in existing:
+                cursor.execute(str(index.create_sql(model, editor)))
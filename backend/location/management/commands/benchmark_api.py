@@ -0,0 +1,302 @@
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, NamedTuple, Tuple
+from urllib.parse import urlencode
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from location.importer.synthetic import generate_source
+from location.management.commands.benchmark_import import scratch_database
+from location.management.commands.generate_source import add_size_arguments, size_options
+from location.models import City, Country, Location, State
+
+
+class Scenario(NamedTuple):
+    name: str
+    weight: int
+    endpoint: str
+    params: Callable[[random.Random, dict], dict]
+
+
+def prefix(rng: random.Random, name: str) -> str:
+    """What a user has typed so far: the first one to four characters"""
+    return name[:rng.randint(1, min(4, len(name)))]
+
+
+def page_count(count: int, page_size: int) -> int:
+    return max(1, -(-count // page_size))
+
+
+def deep_page(rng: random.Random, count: int, page_size: int = 100) -> int:
+    """A page from the second half, where OFFSET pagination costs most"""
+    pages = page_count(count, page_size)
+    return rng.randint(max(1, pages // 2), pages)
+
+
+# A mix of what the frontend and API clients send: drill-down filters,
+# typeahead on partial words, deep OFFSET pages and bulk-sized pages.
+SCENARIOS = (
+    Scenario('countries.list', 2, '/api/countries/', lambda rng, s: {}),
+    Scenario('countries.search', 2, '/api/countries/',
+             lambda rng, s: {'search': prefix(rng, rng.choice(s['countries'])[1])}),
+    Scenario('states.by_country', 5, '/api/states/',
+             lambda rng, s: {'country': rng.choice(s['countries'])[0]}),
+    Scenario('states.search', 3, '/api/states/',
+             lambda rng, s: {'search': prefix(rng, rng.choice(s['states'])[1])}),
+    Scenario('cities.by_state', 10, '/api/cities/',
+             lambda rng, s: {'state': rng.choice(s['states'])[0]}),
+    Scenario('cities.typeahead', 12, '/api/cities/',
+             lambda rng, s: {'search': prefix(rng, rng.choice(s['cities'])[1])}),
+    Scenario('cities.autocomplete', 12, '/api/cities/autocomplete/',
+             lambda rng, s: {'search': prefix(rng, rng.choice(s['cities'])[1])}),
+    Scenario('cities.large_page', 3, '/api/cities/',
+             lambda rng, s: {'page_size': 1000, 'page': deep_page(rng, s['city_count'], 1000)}),
+    Scenario('locations.search', 10, '/api/locations/',
+             lambda rng, s: {'search': prefix(rng, rng.choice(s['cities'])[1])}),
+    Scenario('locations.by_state', 5, '/api/locations/',
+             lambda rng, s: {'state': rng.choice(s['states'])[1]}),
+    Scenario('locations.deep_page', 5, '/api/locations/',
+             lambda rng, s: {'page': deep_page(rng, s['location_count'])}),
+    Scenario('locations.large_page', 3, '/api/locations/',
+             lambda rng, s: {'page_size': 1000, 'page': deep_page(rng, s['location_count'], 1000)}),
+    Scenario('zipcodes.by_city', 15, '/api/zipcodes/',
+             lambda rng, s: {'city': rng.choice(s['cities'])[0]}),
+    Scenario('zipcodes.search', 8, '/api/zipcodes/',
+             lambda rng, s: {'search': rng.choice(s['zip_codes'])[:3]}),
+    Scenario('zipcodes.deep_page', 5, '/api/zipcodes/',
+             lambda rng, s: {'page': deep_page(rng, s['location_count'])}),
+)
+
+
+class Result(NamedTuple):
+    scenario: str
+    endpoint: str
+    status: int
+    seconds: float
+
+
+def summarize(results: List[Result], wall: float) -> dict:
+    latencies = np.array([result.seconds for result in results]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for result in results if result.status >= 400),
+        'throughput_rps': round(len(results) / wall, 1) if wall else None,
+        'mean_ms': round(float(latencies.mean()), 2) if len(latencies) else None,
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'max_ms': round(float(latencies.max()), 2) if len(latencies) else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a realistic query mix against the location API and print throughput '
+        'and p50/p95/p99 latency per endpoint as JSON. Runs in-process against a '
+        'scratch database seeded with synthetic data, or against a running server with --url.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server, e.g. http://127.0.0.1:8000; '
+                 'its own data is used and nothing is seeded'
+        )
+        parser.add_argument(
+            '--database-path',
+            help='Seed from this source database instead of a synthetic one'
+        )
+        add_size_arguments(parser)
+        parser.set_defaults(zipcodes=100000)
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests')
+        parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent first')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads')
+        parser.add_argument(
+            '--no-response-cache',
+            action='store_true',
+            help='In-process only: bypass the dataset response cache so every request hits the database'
+        )
+        parser.add_argument(
+            '--sqlite-profile',
+            choices=('configured', 'stock'),
+            default='configured',
+            help='In-process only: configured applies SQLITE_PRAGMAS, query_only and CONN_MAX_AGE '
+                 'from settings; stock opens a plain connection per request'
+        )
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+        report = {'options': {
+            name: options[name]
+            for name in ('requests', 'warmup', 'concurrency', 'seed', 'no_response_cache', 'sqlite_profile')
+        }}
+
+        if options['url']:
+            report['target'] = options['url']
+            fetch = self.http_fetcher(options['url'].rstrip('/'))
+            report.update(self.benchmark(fetch, options))
+        else:
+            report['target'] = 'in-process'
+            with self.sqlite_profile(options['sqlite_profile']), \
+                    tempfile.TemporaryDirectory(prefix='location-benchmark-') as directory, \
+                    scratch_database(os.path.join(directory, 'target.sqlite3')):
+                report['dataset'] = self.seed(directory, options)
+                overrides = {'DEBUG': False, 'ALLOWED_HOSTS': ['testserver']}
+                if options['sqlite_profile'] == 'configured':
+                    # Measured like an API worker process
+                    overrides['SQLITE_QUERY_ONLY'] = True
+                if options['no_response_cache']:
+                    overrides['DATASET_CACHE_PATHS'] = []
+                with override_settings(**overrides):
+                    caches[getattr(settings, 'DATASET_CACHE_ALIAS', 'default')].clear()
+                    report.update(self.benchmark(self.client_fetcher(), options))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    @contextmanager
+    def sqlite_profile(self, profile):
+        """Run with the SQLite settings under test; ``stock`` is SQLite's and Django's defaults"""
+        if profile == 'configured':
+            yield
+            return
+        settings_dict = connections['default'].settings_dict
+        conn_max_age = settings_dict['CONN_MAX_AGE']
+        settings_dict['CONN_MAX_AGE'] = 0
+        try:
+            with override_settings(SQLITE_PRAGMAS={}, SQLITE_QUERY_ONLY=False):
+                yield
+        finally:
+            settings_dict['CONN_MAX_AGE'] = conn_max_age
+
+    def seed(self, directory, options) -> dict:
+        source = options['database_path']
+        if source is None:
+            source = os.path.join(directory, 'source.sqlite3')
+            generate_source(source, **size_options(options))
+        elif not os.path.exists(source):
+            raise CommandError(f'Database file not found: {source}')
+        call_command('import_locations', database_path=source, stdout=io.StringIO(), stderr=io.StringIO())
+        return {
+            str(model._meta.verbose_name_plural): model.objects.count()
+            for model in (Country, State, City, Location)
+        }
+
+    def client_fetcher(self) -> Callable[[str], Tuple[int, bytes]]:
+        local = threading.local()
+
+        def fetch(path):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            response = client.get(path)
+            return response.status_code, response.content if not response.streaming else b''
+        return fetch
+
+    def http_fetcher(self, base_url) -> Callable[[str], Tuple[int, bytes]]:
+        def fetch(path):
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=60) as response:
+                    return response.status, response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, e.read()
+        return fetch
+
+    def samples(self, fetch) -> dict:
+        """Ids and names to build requests from, read through the API itself"""
+        rng = random.Random(0)
+
+        def page(endpoint, **params):
+            status, content = fetch(f'{endpoint}?{urlencode({"page_size": 1000, **params})}')
+            if status != 200:
+                raise CommandError(f'GET {endpoint} returned {status}; is the API up and seeded?')
+            return json.loads(content)
+
+        countries = page('/api/countries/')
+        states = page('/api/states/')
+        cities = page('/api/cities/')
+        locations = page('/api/locations/')
+        samples = {
+            'countries': [(row['id'], row['name']) for row in countries['results']],
+            'states': [(row['id'], row['name']) for row in states['results']],
+            'city_count': cities['count'],
+            'location_count': locations['count'],
+        }
+        # A few random pages, so cities and codes are not all from the first states
+        city_rows = []
+        for _ in range(3):
+            city_rows += page('/api/cities/', page=rng.randint(1, page_count(cities['count'], 1000)))['results']
+        location_rows = page('/api/locations/', page=rng.randint(1, page_count(locations['count'], 1000)))['results']
+        samples['cities'] = [(row['id'], row['name']) for row in cities['results'] + city_rows]
+        samples['zip_codes'] = [row['zip_code'] for row in locations['results'] + location_rows]
+        if not all(samples[key] for key in ('countries', 'states', 'cities', 'zip_codes')):
+            raise CommandError('The API returned no data to benchmark against')
+        return samples
+
+    def plan(self, samples, count, seed) -> List[Tuple[Scenario, str]]:
+        """The same seed and data give the same request sequence, for comparing runs"""
+        rng = random.Random(seed)
+        chosen = rng.choices(SCENARIOS, weights=[scenario.weight for scenario in SCENARIOS], k=count)
+        requests = []
+        for scenario in chosen:
+            params = scenario.params(rng, samples)
+            query = f'?{urlencode(params)}' if params else ''
+            requests.append((scenario, scenario.endpoint + query))
+        return requests
+
+    def run(self, fetch, requests, concurrency) -> List[Result]:
+        def send(request):
+            scenario, path = request
+            start = time.perf_counter()
+            status, _ = fetch(path)
+            return Result(scenario.name, scenario.endpoint, status, time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(send, requests))
+
+    def benchmark(self, fetch, options) -> dict:
+        samples = self.samples(fetch)
+        requests = self.plan(samples, options['warmup'] + options['requests'], options['seed'])
+        self.run(fetch, requests[:options['warmup']], options['concurrency'])
+
+        start = time.perf_counter()
+        results = self.run(fetch, requests[options['warmup']:], options['concurrency'])
+        wall = time.perf_counter() - start
+
+        by_scenario, by_endpoint = defaultdict(list), defaultdict(list)
+        for result in results:
+            by_scenario[result.scenario].append(result)
+            by_endpoint[result.endpoint].append(result)
+        return {
+            'wall_seconds': round(wall, 3),
+            'overall': summarize(results, wall),
+            'endpoints': {endpoint: summarize(rows, wall) for endpoint, rows in sorted(by_endpoint.items())},
+            'scenarios': {
+                name: {'endpoint': rows[0].endpoint, **summarize(rows, wall)}
+                for name, rows in sorted(by_scenario.items())
+            },
+        }
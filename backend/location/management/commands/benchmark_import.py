@@ -0,0 +1,122 @@
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from location.importer import WRITERS
+from location.importer.synthetic import generate_source
+from location.management.commands.generate_source import add_size_arguments, size_options
+from location.management.commands.import_locations import Command as ImportLocations
+from location.models import City, Country, Location, SourceFingerprint, State
+
+STAGES = {
+    Country._meta.db_table: 'countries',
+    State._meta.db_table: 'states',
+    City._meta.db_table: 'cities',
+    Location._meta.db_table: 'locations',
+    SourceFingerprint._meta.db_table: 'fingerprints',
+}
+
+
+def peak_rss_mb(who) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+@contextmanager
+def scratch_database(path):
+    """Point the default connection at an empty, migrated file for the duration"""
+    connection = connections['default']
+    if connection.vendor != 'sqlite':
+        raise CommandError('Benchmarks need a SQLite database')
+    original = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    try:
+        call_command('migrate', interactive=False, verbosity=0)
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = original
+
+
+class Command(BaseCommand):
+    help = (
+        'Run import_locations against a synthetic (or given) source in a scratch '
+        'database and print rows/sec per stage, peak RSS and wall time as JSON. '
+        'The configured database is not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database-path',
+            help='Existing source database; a synthetic one is generated when omitted'
+        )
+        add_size_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=ImportLocations.BATCH_SIZE)
+        parser.add_argument('--writer', choices=sorted(WRITERS), default='raw')
+        parser.add_argument('--workers', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        report = {'options': {
+            name: options[name] for name in ('batch_size', 'writer', 'workers')
+        }}
+        with tempfile.TemporaryDirectory(prefix='location-benchmark-') as directory:
+            source = options['database_path']
+            if source is None:
+                source = os.path.join(directory, 'source.sqlite3')
+                start = time.perf_counter()
+                report['source'] = generate_source(source, **size_options(options))
+                report['source']['seed'] = options['seed']
+                report['generate_seconds'] = round(time.perf_counter() - start, 3)
+            else:
+                if not os.path.exists(source):
+                    raise CommandError(f'Database file not found: {source}')
+                report['source'] = {'path': os.path.abspath(source)}
+
+            with scratch_database(os.path.join(directory, 'target.sqlite3')):
+                command = ImportLocations()
+                start = time.perf_counter()
+                call_command(
+                    command, database_path=source, batch_size=options['batch_size'],
+                    writer=options['writer'], workers=options['workers'], stdout=io.StringIO(),
+                )
+                wall = time.perf_counter() - start
+                imported = {
+                    STAGES[model._meta.db_table]: model.objects.count()
+                    for model in (Country, State, City, Location)
+                }
+
+        writer = command.writer
+        report['stages'] = {
+            STAGES.get(table, table): {
+                'rows': writer.rows[table],
+                'seconds': round(writer.seconds[table], 3),
+                'rows_per_sec': round(rate) if rate is not None else None,
+            }
+            for table, rate in writer.rates().items()
+        }
+        report['imported'] = imported
+        report['wall_seconds'] = round(wall, 3)
+        report['locations_per_sec'] = round(imported['locations'] / wall) if wall else None
+        report['peak_rss_mb'] = {
+            'process': round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+            'workers': round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
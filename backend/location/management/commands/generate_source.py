@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from location.importer.synthetic import generate_source
+
+
+class Command(BaseCommand):
+    help = 'Write a synthetic source database in the layout import_locations reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='SQLite file to create')
+        add_size_arguments(parser)
+        parser.add_argument('--force', action='store_true', help='Overwrite an existing file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if os.path.exists(path):
+            if not options['force']:
+                raise CommandError(f'{path} exists; use --force to overwrite it')
+            os.remove(path)
+        start_time = time.time()
+        counts = generate_source(path, **size_options(options))
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {path} in {time.time() - start_time:.2f} seconds: '
+            + ', '.join(f'{count} {table}' for table, count in counts.items())
+        ))
+
+
+def add_size_arguments(parser):
+    parser.add_argument('--countries', type=int, default=3)
+    parser.add_argument('--states', type=int, default=50, help='States per country')
+    parser.add_argument('--cities', type=int, default=200, help='Cities per state')
+    parser.add_argument('--zipcodes', type=int, default=300000, help='Zipcode rows in total')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def size_options(options):
+    return {name: options[name] for name in ('countries', 'states', 'cities', 'zipcodes', 'seed')}
@@ -1 +1,122 @@
- 
\ No newline at end of file
+import csv
+import gzip
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tqdm import tqdm
+
+from location.dataset import publish_import
+from location.importer import WRITERS
+from location.importer.csv_feed import FEED_FIELDS, CsvImport, read_chunks, resolve_columns
+from location.importer.writers import deferred_indexes
+from location.models import Location
+from location.search import deferred_location_fts, deferred_location_search
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Import country/state/city/ZIP rows from a CSV or TSV feed. Countries, states '
+        'and cities already in the database are reused; a (city, ZIP code) pair that '
+        'already exists has its coordinates updated, so rerunning a feed adds nothing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or TSV file, optionally gzipped (.gz)')
+        parser.add_argument(
+            '--delimiter',
+            help='Field delimiter; sniffed from the header when omitted'
+        )
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument(
+            '--column',
+            action='append',
+            default=[],
+            metavar='FIELD=HEADER',
+            help=f"Map a field to a header name; fields: {', '.join(FEED_FIELDS)}"
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parser processes; 0 parses in this process'
+        )
+        parser.add_argument(
+            '--chunk-mb',
+            type=float,
+            default=4,
+            help='Size of the blocks of records handed to each parser process'
+        )
+        parser.add_argument('--writer', choices=sorted(WRITERS), default='raw')
+
+    def open_feed(self, path, encoding):
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding=encoding, newline='')
+        return open(path, encoding=encoding, newline='')
+
+    def column_overrides(self, values):
+        overrides = {}
+        for value in values:
+            field, sep, header = value.partition('=')
+            if not sep or field not in FEED_FIELDS:
+                raise CommandError(f'Invalid --column {value!r}; use FIELD=HEADER with one of {", ".join(FEED_FIELDS)}')
+            overrides[field] = header
+        return overrides
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Feed not found: {path}')
+        overrides = self.column_overrides(options['column'])
+
+        with self.open_feed(path, options['encoding']) as stream:
+            header_line = stream.readline()
+            delimiter = options['delimiter']
+            if delimiter is None:
+                try:
+                    delimiter = csv.Sniffer().sniff(header_line, delimiters=',\t;|').delimiter
+                except csv.Error:
+                    delimiter = ','
+            elif delimiter == '\\t':
+                delimiter = '\t'
+            header = next(csv.reader([header_line], delimiter=delimiter))
+            try:
+                indexes = resolve_columns(header, overrides)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            total = None if path.endswith('.gz') else os.path.getsize(path)
+            writer = WRITERS[options['writer']]()
+            feed = CsvImport(delimiter, indexes, workers=options['workers'], writer=writer)
+
+            with tqdm(total=total, unit='B', unit_scale=True, desc='Importing feed') as pbar:
+                def chunks():
+                    for chunk in read_chunks(stream, int(options['chunk_mb'] * 1024 * 1024)):
+                        pbar.update(len(chunk))
+                        yield chunk
+
+                with transaction.atomic(), deferred_location_fts(), deferred_location_search(), \
+                        deferred_indexes(Location):
+                    counts = feed.run(chunks())
+
+        elapsed = time.time() - start_time
+        for table, rate in writer.rates().items():
+            speed = f'{rate:,.0f} rows/sec' if rate is not None else 'too fast to time'
+            self.stdout.write(f'{table}: {writer.rows[table]} rows in {writer.seconds[table]:.2f}s ({speed})')
+        parsed = sum(counts[key] for key in ('locations', 'updated', 'unchanged', 'rejected'))
+        self.stdout.write(
+            f"Parsed {parsed} rows ({parsed / elapsed:,.0f} rows/sec overall), "
+            f"updated {counts['updated']}, unchanged {counts['unchanged']}, rejected {counts['rejected']}"
+        )
+
+        version = publish_import(source=path, sender=self.__class__)
+        self.stdout.write(self.style.SUCCESS(
+            f'Feed import completed in {time.time() - start_time:.2f} seconds '
+            f'(dataset version {version.tag}): '
+            + ', '.join(f'{counts[table]} {table}' for table in ('countries', 'states', 'cities', 'locations'))
+        ))
@@ -1,12 +1,19 @@
 import logging
-from contextlib import closing
-from typing import Dict, List, Any
+from contextlib import closing, nullcontext
 import sqlite3
-from django.core.management.base import BaseCommand
-from django.db import transaction, connection
-from django.db.models import Model
-from location.models import Country, State, City, Location
-from tqdm import tqdm
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, connections
+from location.dataset import publish_import, reset, stamp_version
+from location.hierarchy import build_hierarchies
+from location.importer import WRITERS, ImportPipeline, IncrementalImport, clear_location_tables
+from location.importer.delta import unfingerprinted_rows
+from location.importer.resumable import ResumableImport, SourceChanged
+from location.importer.shadow import ShadowDatabase
+from location.importer.sharded import ShardedImport
+from location.importer.writers import create_model_indexes, deferred_indexes, drop_model_indexes
+from location.models import Location
+from location.search import deferred_location_fts, deferred_location_search
+from location.signals import dataset_imported
 import os
 import time
 
@@ -16,14 +23,10 @@ class Command(BaseCommand):
     help = 'Import location data from SQLite database efficiently'
 
     BATCH_SIZE = 10000  # Increased batch size for better performance
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.models_map: Dict[str, Dict[int, Model]] = {
-            'countries': {},
-            'states': {},
-            'cities': {},
-        }
+
+    # The BulkWriter of the last run, for callers that run the command
+    # in-process and want its per-table stats, e.g. benchmark_import
+    writer = None
 
     def add_arguments(self, parser):
         path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'allcountries.sqlite3')
@@ -33,164 +36,56 @@ class Command(BaseCommand):
             default=path,
             help='Path to SQLite database file'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=self.BATCH_SIZE,
+            help='Rows read, mapped and written per batch'
+        )
+        parser.add_argument(
+            '--source-cache-mb',
+            type=int,
+            default=64,
+            help='Page cache for the source database in MB; bounds importer memory'
+        )
+        parser.add_argument(
+            '--writer',
+            choices=sorted(WRITERS),
+            default='raw',
+            help='raw: prepared executemany INSERTs on the cursor; orm: Model.objects.bulk_create'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Apply only rows added, changed or removed since the last import'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Commit every batch with a checkpoint, and continue an interrupted '
+                 '--resume import of the same source instead of starting over'
+        )
+        parser.add_argument(
+            '--shadow',
+            action='store_true',
+            help='Build a complete new database file beside the live one and swap it in '
+                 'atomically; the API keeps serving the old data until the swap'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Build cities and locations in this many processes, one shard of states each, '
+                 'and merge the shards into the database; 0 imports in this process'
+        )
 
-    def disable_indexes(self):
-        """Temporarily disable indexes for faster bulk insertion"""
-        with connection.cursor() as cursor:
-            cursor.execute('DROP INDEX IF EXISTS location_location_zip_code_idx;')
-            cursor.execute('DROP INDEX IF EXISTS location_location_city_id_idx;')
-
-    def enable_indexes(self):
-        """Re-enable indexes after import"""
-        with connection.cursor() as cursor:
-            cursor.execute('CREATE INDEX location_location_zip_code_idx ON location_location(zip_code);')
-            cursor.execute('CREATE INDEX location_location_city_id_idx ON location_location(city_id);')
-
-    def bulk_create_with_progress(self, model_class: Model, objects: List[Any], 
-                                desc: str) -> None:
-        """Bulk create objects with progress bar"""
-        total_objects = len(objects)
-        created_objects = []
-        
-        with tqdm(total=total_objects, desc=desc) as pbar:
-            for i, obj in enumerate(objects, 1):
-                created_objects.append(obj)
-                
-                if i % self.BATCH_SIZE == 0 or i == total_objects:
-                    model_class.objects.bulk_create(created_objects)
-                    pbar.update(len(created_objects))
-                    created_objects = []
-
-    def import_data(self, source_cursor: sqlite3.Cursor) -> None:
-        """Import data from source database with optimized batching"""
-        
-        # Import countries
-        logger.info("Importing countries...")
-        source_cursor.execute('SELECT id, name, alpha2, alpha3, iso FROM countries')
-        country_batch = []
-        for row in source_cursor.fetchall():
-            country = Country(
-                name=row[1],
-                alpha2=row[2] if row[2] else '',
-                alpha3=row[3] if row[3] else ''
-            )
-            country_batch.append(country)
-            self.models_map['countries'][row[0]] = country
-        self.bulk_create_with_progress(Country, country_batch, "Importing countries")
-
-        # Import states
-        logger.info("Importing states...")
-        source_cursor.execute('''
-            SELECT id, name, country_id, abbr 
-            FROM states 
-            ORDER BY country_id
-        ''')
-        state_batch = []
-        for row in source_cursor.fetchall():
-            try:
-                state = State(
-                    name=row[1],
-                    country=self.models_map['countries'][row[2]],
-                    abbreviation=row[3] if row[3] else ''
-                )
-                state_batch.append(state)
-                self.models_map['states'][row[0]] = state
-            except KeyError:
-                logger.warning(f"Country not found for state: {row[1]}")
-                continue
-        self.bulk_create_with_progress(State, state_batch, "Importing states")
-
-        # Import cities from zipcodes table
-        logger.info("Importing cities...")
-        source_cursor.execute('''
-            SELECT DISTINCT city, state_id 
-            FROM zipcodes 
-            WHERE city IS NOT NULL 
-              AND state_id IS NOT NULL 
-              AND city != ''
-            ORDER BY state_id, city
-        ''')
-        city_batch = []
-        city_cache = set()  # To prevent duplicates
-        
-        for row in source_cursor.fetchall():
-            city_name = row[0]
-            state_id = row[1]
-            
-            try:
-                # Create unique key for city+state combination
-                cache_key = f"{city_name}_{state_id}"
-                if cache_key in city_cache:
-                    continue
-                
-                city = City(
-                    name=city_name,
-                    state=self.models_map['states'][state_id]
-                )
-                city_batch.append(city)
-                city_cache.add(cache_key)
-            except KeyError:
-                logger.warning(f"State not found for city: {city_name}")
-                continue
-            
-        self.bulk_create_with_progress(City, city_batch, "Importing cities")
-
-        # Create a mapping of city names to City objects for location import
-        city_map = {(city.name, city.state_id): city for city in City.objects.all()}
-
-        # Import locations from zipcodes table
-        logger.info("Importing locations...")
-        source_cursor.execute('''
-            SELECT code, city, state_id, lat, lon, area_code 
-            FROM zipcodes 
-            WHERE city IS NOT NULL 
-              AND state_id IS NOT NULL 
-              AND code IS NOT NULL
-              AND city != ''
-            ORDER BY state_id, city
-        ''')
-        
-        location_batch = []
-        total_locations = 0
-        
-        with tqdm(desc="Importing locations") as pbar:
-            while True:
-                rows = source_cursor.fetchmany(self.BATCH_SIZE)
-                if not rows:
-                    break
-                    
-                for row in rows:
-                    try:
-                        zip_code = row[0]
-                        city_name = row[1]
-                        state_id = row[2]
-                        state = self.models_map['states'][state_id]
-                        
-                        city = city_map.get((city_name, state_id))
-                        if city is None:
-                            logger.warning(f"City not found: {city_name}, {state_id}")
-                            continue
-
-                        location = Location(
-                            city=city,
-                            state=state,
-                            country=state.country,
-                            zip_code=zip_code,
-                            latitude=row[3],
-                            longitude=row[4]
-                        )
-                        location_batch.append(location)
-                        total_locations += 1
-                    except (KeyError, IndexError) as e:
-                        logger.warning(f"Error processing zipcode row: {row} - {str(e)}")
-                        continue
-                
-                if location_batch:
-                    Location.objects.bulk_create(location_batch)
-                    pbar.update(len(location_batch))
-                    location_batch = []
+    def disable_indexes(self, using='default'):
+        """Temporarily drop the location indexes for faster bulk insertion"""
+        drop_model_indexes(Location, using)
 
-        logger.info(f"Imported {total_locations} locations")
+    def enable_indexes(self, using='default'):
+        """Recreate the location indexes after import, including any an interrupted run left out"""
+        create_model_indexes(Location, using)
 
     def validate_database(self, cursor: sqlite3.Cursor) -> bool:
         """Validate that the database has all required tables and columns"""
@@ -225,9 +120,143 @@ class Command(BaseCommand):
 
         return True
 
+    def report_rates(self, writer):
+        for table, rate in writer.rates().items():
+            speed = f'{rate:,.0f} rows/sec' if rate is not None else 'too fast to time'
+            self.stdout.write(f'{table}: {writer.rows[table]} rows in {writer.seconds[table]:.2f}s ({speed})')
+
+    def publish(self, database_path):
+        """Make the imported data live and tell caches to rebuild"""
+        version = publish_import(source=database_path, sender=self.__class__)
+        self.stdout.write(f'Dataset version {version.tag}')
+
+    def full_pipeline(self, source_cursor, options, writer, using='default'):
+        if not options['workers']:
+            return ImportPipeline(
+                source_cursor, batch_size=options['batch_size'], using=using, writer=writer
+            )
+        if connections[using].vendor != 'sqlite':
+            raise CommandError('--workers needs a SQLite database')
+        return ShardedImport(
+            source_cursor, options['database_path'], options['workers'],
+            batch_size=options['batch_size'], using=using, writer=writer,
+            source_cache_mb=options['source_cache_mb'],
+        )
+
+    def staged(self, pipeline):
+        """Stage a sharded import's rows before its transaction and remove them after"""
+        if isinstance(pipeline, ShardedImport):
+            return pipeline.staged()
+        return nullcontext()
+
+    def import_full(self, source_cursor, options):
+        # Disable indexes temporarily
+        self.disable_indexes()
+
+        try:
+            # Replace all data in a single transaction
+            writer = WRITERS[options['writer']]()
+            pipeline = self.full_pipeline(source_cursor, options, writer)
+            with self.staged(pipeline), transaction.atomic():
+                clear_location_tables()
+                with deferred_location_fts(), deferred_location_search():
+                    counts = pipeline.run()
+        finally:
+            # Make sure indexes are re-enabled even if import fails
+            self.enable_indexes()
+
+        self.report_rates(writer)
+        self.stdout.write(
+            'Imported ' + ', '.join(f'{count} {table}' for table, count in counts.items())
+        )
+        self.publish(options['database_path'])
+        return writer
+
+    def import_resumable(self, source_cursor, options):
+        # Batches commit one by one, so indexes stay dropped until the run
+        # (or its resumption) completes.
+        self.disable_indexes()
+        pipeline = ResumableImport(
+            source_cursor, options['database_path'], batch_size=options['batch_size'],
+            writer=WRITERS[options['writer']](),
+        )
+        try:
+            counts = pipeline.run()
+        except SourceChanged as e:
+            raise CommandError(str(e))
+        finally:
+            self.enable_indexes()
+
+        if pipeline.resumed:
+            self.stdout.write('Resumed an interrupted import')
+        self.report_rates(pipeline.writer)
+        self.stdout.write(
+            'Imported ' + ', '.join(f'{count} {table}' for table, count in counts.items())
+        )
+        self.publish(options['database_path'])
+        return pipeline.writer
+
+    def import_incremental(self, source_cursor, options):
+        unmatched = unfingerprinted_rows()
+        if unmatched:
+            raise CommandError(
+                f'{unmatched} existing rows have no source fingerprint (imported by an older '
+                'version or by import_from_csv); run a full import before using --incremental.'
+            )
+
+        # Indexes stay in place: the delta is small and updates and deletes
+        # look rows up by id. FTS and LocationSearch rows are kept in step
+        # by the triggers.
+        with transaction.atomic():
+            writer = WRITERS[options['writer']]()
+            pipeline = IncrementalImport(
+                source_cursor, batch_size=options['batch_size'], writer=writer
+            )
+            delta = pipeline.run()
+
+        for table, counts in delta.items():
+            self.stdout.write(
+                f"{table}: +{counts['inserted']} ~{counts['updated']} -{counts['deleted']}"
+            )
+        if not pipeline.changed:
+            # Same data, same version: caches and ETags stay valid
+            self.stdout.write('No changes; dataset version unchanged')
+            return writer
+        self.publish(options['database_path'])
+        return writer
+
+    def import_shadow(self, source_cursor, options):
+        shadow = ShadowDatabase()
+        self.stdout.write(f'Building shadow database {shadow.path}')
+        try:
+            shadow.create()
+            writer = WRITERS[options['writer']](shadow.alias)
+            pipeline = self.full_pipeline(source_cursor, options, writer, using=shadow.alias)
+            with self.staged(pipeline), transaction.atomic(using=shadow.alias), \
+                    deferred_location_fts(shadow.alias), deferred_location_search(shadow.alias), \
+                    deferred_indexes(Location, shadow.alias):
+                counts = pipeline.run()
+            build_hierarchies(shadow.alias)
+            version = stamp_version(source=options['database_path'], using=shadow.alias)
+            shadow.finish()
+        except BaseException:
+            shadow.discard()
+            raise
+
+        self.report_rates(writer)
+        self.stdout.write(
+            'Imported ' + ', '.join(f'{count} {table}' for table, count in counts.items())
+        )
+        shadow.swap()
+        reset()
+        dataset_imported.send(sender=self.__class__)
+        self.stdout.write(f'Dataset version {version.tag}')
+        return writer
+
     def handle(self, *args, **options):
         start_time = time.time()
         database_path = options['database_path']
+        self.writer = None
         
         # Check if database file exists
         if not os.path.exists(database_path):
@@ -248,34 +277,34 @@ class Command(BaseCommand):
                     ))
                     return
 
-                # Set pragmas for better SQLite performance
-                source_cursor.execute('PRAGMA cache_size = -2000000')  # 2GB cache
-                source_cursor.execute('PRAGMA temp_store = MEMORY')
+                # Set pragmas for better SQLite performance. The page cache is
+                # capped and sorts spill to disk so memory stays bounded
+                # however large the source is.
+                source_cursor.execute(f"PRAGMA cache_size = -{options['source_cache_mb'] * 1024}")
+                source_cursor.execute('PRAGMA temp_store = FILE')
                 source_cursor.execute('PRAGMA synchronous = OFF')
                 source_cursor.execute('PRAGMA journal_mode = MEMORY')
                 
-                # Disable indexes temporarily
-                self.disable_indexes()
-                
-                try:
-                    # Import all data in a single transaction
-                    with transaction.atomic():
-                        self.import_data(source_cursor)
-                    
-                    # Re-enable indexes
-                    self.enable_indexes()
-                    
-                    end_time = time.time()
-                    elapsed_time = end_time - start_time
-                    
-                    self.stdout.write(self.style.SUCCESS(
-                        f'Data import completed successfully in {elapsed_time:.2f} seconds'
-                    ))
-                except Exception as e:
-                    # Make sure indexes are re-enabled even if import fails
-                    self.enable_indexes()
-                    raise
-                
+                modes = [mode for mode in ('incremental', 'resume', 'shadow') if options[mode]]
+                if len(modes) > 1:
+                    raise CommandError(f"--{' and --'.join(modes)} cannot be combined")
+                if options['workers'] < 0:
+                    raise CommandError('--workers must be 0 or more')
+                if options['workers'] and (options['incremental'] or options['resume']):
+                    raise CommandError('--workers applies to full and --shadow imports only')
+                if options['resume']:
+                    self.writer = self.import_resumable(source_cursor, options)
+                elif options['shadow']:
+                    self.writer = self.import_shadow(source_cursor, options)
+                elif options['incremental']:
+                    self.writer = self.import_incremental(source_cursor, options)
+                else:
+                    self.writer = self.import_full(source_cursor, options)
+
+                self.stdout.write(self.style.SUCCESS(
+                    f'Data import completed successfully in {time.time() - start_time:.2f} seconds'
+                ))
+
         except sqlite3.Error as e:
             self.stderr.write(self.style.ERROR(
                 f"SQLite error: {str(e)}"
@@ -0,0 +1,131 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence
+
+# Latency buckets start below a millisecond because the in-memory endpoints
+# (autocomplete, nearest) answer well under that.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram labelled by endpoint"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, value: float) -> None:
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                # One slot per bucket, then +Inf, sum and count
+                series = self._series[endpoint] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            snapshot = {endpoint: list(series) for endpoint, series in self._series.items()}
+        for endpoint, series in sorted(snapshot.items()):
+            label = endpoint.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{endpoint="{label}"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{endpoint="{label}"}} {series[-1]}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'location_request_duration_seconds',
+    'Total time spent handling a request, including rendering.',
+    LATENCY_BUCKETS,
+)
+SQL_DURATION = Histogram(
+    'location_sql_duration_seconds',
+    'Time spent executing SQL per sampled request.',
+    LATENCY_BUCKETS,
+)
+SQL_QUERIES = Histogram(
+    'location_sql_queries',
+    'Number of SQL queries run per sampled request.',
+    QUERY_COUNT_BUCKETS,
+)
+SERIALIZE_DURATION = Histogram(
+    'location_serialize_duration_seconds',
+    'Time spent serializing and rendering results per sampled request.',
+    LATENCY_BUCKETS,
+)
+
+HISTOGRAMS = (REQUEST_DURATION, SQL_DURATION, SQL_QUERIES, SERIALIZE_DURATION)
+
+
+class RequestSample:
+    """Per-request counters, only collected for sampled requests"""
+    __slots__ = ('sql_queries', 'sql_time', 'serialize_time')
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Hook for ``connection.execute_wrapper`` timing every statement"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_queries += 1
+
+
+current_sample: ContextVar[Optional[RequestSample]] = ContextVar('location_metrics_sample', default=None)
+
+
+@contextmanager
+def serializing():
+    """Count the enclosed block as serialization time if the request is sampled"""
+    sample = current_sample.get()
+    if sample is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.serialize_time += time.perf_counter() - start
+
+
+def record(endpoint: str, duration: float, sample: Optional[RequestSample] = None) -> None:
+    REQUEST_DURATION.observe(endpoint, duration)
+    if sample is not None:
+        SQL_DURATION.observe(endpoint, sample.sql_time)
+        SQL_QUERIES.observe(endpoint, sample.sql_queries)
+        SERIALIZE_DURATION.observe(endpoint, sample.serialize_time)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+import hashlib
+import random
+import time
+from contextlib import ExitStack
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import (
+    get_conditional_response, has_vary_header, patch_cache_control, patch_vary_headers,
+)
+from django.utils.http import http_date
+
+from location import metrics
+from location.dataset import current_version
+
+
+def endpoint_label(request) -> str:
+    """Name the endpoint after the view that handled it, e.g. CityViewSet.list"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    if view_class is not None:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{view_class.__name__}.{action}'
+    return match.view_name
+
+
+class RequestMetricsMiddleware:
+    """Record request latency for every request and SQL/serialization
+    breakdowns for a ``METRICS_SAMPLE_RATE`` fraction of them.
+
+    Sampled requests run with an ``execute_wrapper`` on every database
+    connection; unsampled ones only pay for two ``perf_counter`` calls.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 0.1)
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            sample = None
+        else:
+            sample = metrics.RequestSample()
+            token = metrics.current_sample.set(sample)
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(sample.execute_wrapper))
+                    response = self.get_response(request)
+            finally:
+                metrics.current_sample.reset(token)
+
+        endpoint = endpoint_label(request)
+        if endpoint != 'metrics':
+            metrics.record(endpoint, time.perf_counter() - start, sample)
+        return response
+
+
+def request_fingerprint(request) -> str:
+    """Hash of everything a read-only API response depends on.
+
+    Query parameters are sorted by name so ``?a=1&b=2`` and ``?b=2&a=1``
+    share an entry; ``Accept`` is included because it picks the renderer,
+    and the scheme and host because paginated bodies hold absolute
+    ``next``/``previous`` links.
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    accept = request.META.get('HTTP_ACCEPT', '')
+    raw = f'{request.scheme}://{request.get_host()}{request.path}?{query}\n{accept}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class DatasetCacheMiddleware:
+    """Conditional GET and a server-side response cache for the API.
+
+    API responses only change when a new dataset is imported, so they get
+    an ETag and Last-Modified derived from the live ``DatasetVersion`` and
+    the normalized request. A matching ``If-None-Match`` or
+    ``If-Modified-Since`` is answered with 304 and repeated requests are
+    replayed from the ``DATASET_CACHE_ALIAS`` cache with the headers the
+    view set, neither touching the database while the (TTL-cached) version
+    is unchanged. ``If-Modified-Since`` is only honoured for requests that
+    have succeeded before. Cache keys embed the version tag, so an import
+    invalidates every entry at once.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(getattr(settings, 'DATASET_CACHE_PATHS', ['/api/']))
+        self.timeout = getattr(settings, 'DATASET_CACHE_TIMEOUT', 3600)
+        self.max_bytes = getattr(settings, 'DATASET_CACHE_MAX_BYTES', 1024 * 1024)
+        self.cache = caches[getattr(settings, 'DATASET_CACHE_ALIAS', 'default')]
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(self.paths):
+            return self.get_response(request)
+        version = current_version()
+        if version is None:
+            return self.get_response(request)
+
+        fingerprint = request_fingerprint(request)
+        etag = f'"{version.tag[:12]}-{fingerprint[:20]}"'
+        last_modified = int(version.imported_at.timestamp())
+        key = f'location:response:{version.tag}:{fingerprint}'
+
+        # An entry means this request has succeeded before. Without one,
+        # If-Modified-Since could turn a 400 or 404 into a 304, so only an
+        # ETag, which is handed out with successful responses alone, counts.
+        cached = self.cache.get(key)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified if cached is not None else None,
+        )
+        if response is None and request.method == 'GET' and cached is not None:
+            headers, content = cached
+            if content is not None:
+                response = HttpResponse(content, headers=headers)
+        if response is not None:
+            # Short-circuited before URL resolution; resolve anyway so the
+            # metrics middleware can label the endpoint.
+            try:
+                request.resolver_match = resolve(request.path_info)
+            except Resolver404:
+                pass
+        else:
+            response = self.get_response(request)
+            if response.status_code != 200 or response.streaming:
+                return response
+            if request.method == 'GET':
+                # Entries are replayed whatever the Accept-Encoding, so views
+                # that vary on it keep their own in-memory copies instead;
+                # like large bodies, they are only recorded as having succeeded
+                stored = len(response.content) <= self.max_bytes \
+                    and not has_vary_header(response, 'Accept-Encoding')
+                self.cache.set(
+                    key, (dict(response.items()), response.content if stored else None), self.timeout,
+                )
+
+        # Like GZipMiddleware: a compressed body only matches weakly
+        response['ETag'] = f'W/{etag}' if response.has_header('Content-Encoding') else etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept',))
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        return response
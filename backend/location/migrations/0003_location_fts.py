@@ -0,0 +1,108 @@
+from django.db import migrations
+
+FTS_TABLE = 'location_location_fts'
+
+CREATE_SQL = [
+    f'''
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        zip_code, city, state, country,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '2 3'
+    )
+    ''',
+    f'''
+    INSERT INTO {FTS_TABLE} (rowid, zip_code, city, state, country)
+    SELECT l.id, l.zip_code, ci.name, s.name, co.name
+    FROM location_location l
+    JOIN location_city ci ON ci.id = l.city_id
+    JOIN location_state s ON s.id = l.state_id
+    JOIN location_country co ON co.id = l.country_id
+    ''',
+    f'''
+    CREATE TRIGGER location_location_fts_insert AFTER INSERT ON location_location BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, zip_code, city, state, country)
+        SELECT new.id, new.zip_code,
+               (SELECT name FROM location_city WHERE id = new.city_id),
+               (SELECT name FROM location_state WHERE id = new.state_id),
+               (SELECT name FROM location_country WHERE id = new.country_id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_location_fts_delete AFTER DELETE ON location_location BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_location_fts_update AFTER UPDATE ON location_location BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE} (rowid, zip_code, city, state, country)
+        SELECT new.id, new.zip_code,
+               (SELECT name FROM location_city WHERE id = new.city_id),
+               (SELECT name FROM location_state WHERE id = new.state_id),
+               (SELECT name FROM location_country WHERE id = new.country_id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_city_fts_rename AFTER UPDATE OF name ON location_city BEGIN
+        UPDATE {FTS_TABLE} SET city = new.name
+        WHERE rowid IN (SELECT id FROM location_location WHERE city_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_state_fts_rename AFTER UPDATE OF name ON location_state BEGIN
+        UPDATE {FTS_TABLE} SET state = new.name
+        WHERE rowid IN (SELECT id FROM location_location WHERE state_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_country_fts_rename AFTER UPDATE OF name ON location_country BEGIN
+        UPDATE {FTS_TABLE} SET country = new.name
+        WHERE rowid IN (SELECT id FROM location_location WHERE country_id = new.id);
+    END
+    ''',
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS location_country_fts_rename',
+    'DROP TRIGGER IF EXISTS location_state_fts_rename',
+    'DROP TRIGGER IF EXISTS location_city_fts_rename',
+    'DROP TRIGGER IF EXISTS location_location_fts_update',
+    'DROP TRIGGER IF EXISTS location_location_fts_delete',
+    'DROP TRIGGER IF EXISTS location_location_fts_insert',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def fts5_supported(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = {row[0] for row in cursor.fetchall()}
+    return 'ENABLE_FTS5' in options
+
+
+def create_fts(apps, schema_editor):
+    # Search falls back to icontains filters wherever FTS5 is unavailable
+    if not fts5_supported(schema_editor):
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0002_alter_city_options_alter_country_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:21
+
+from django.db import migrations, models
+import django.utils.timezone
+import location.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0004_location_lat_lon_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(default=location.models.new_version_tag, max_length=32, unique=True)),
+                ('imported_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'get_latest_by': 'id',
+            },
+        ),
+    ]
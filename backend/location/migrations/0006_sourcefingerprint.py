@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0005_datasetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=16)),
+                ('source_id', models.IntegerField()),
+                ('digest', models.BigIntegerField()),
+                ('target_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sourcefingerprint',
+            constraint=models.UniqueConstraint(fields=('table', 'source_id'), name='location_fingerprint_source_uniq'),
+        ),
+    ]
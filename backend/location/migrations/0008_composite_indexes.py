@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0007_importcheckpoint'),
+    ]
+
+    operations = [
+        # Created by hand by import_locations before indexes were managed
+        # here; superseded by location_zip_code_idx and location_city_zip_idx.
+        migrations.RunSQL(
+            [
+                'DROP INDEX IF EXISTS location_location_zip_code_idx',
+                'DROP INDEX IF EXISTS location_location_city_id_idx',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='city',
+            index=models.Index(fields=['state', 'name'], name='location_city_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['zip_code'], name='location_zip_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['city', 'zip_code'], name='location_city_zip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='state',
+            index=models.Index(fields=['country', 'name'], name='location_state_country_idx'),
+        ),
+    ]
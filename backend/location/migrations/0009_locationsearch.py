@@ -0,0 +1,152 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+SEARCH_TABLE = 'location_locationsearch'
+
+COLUMNS = '''
+    id, zip_code, latitude, longitude,
+    city_id, city_name, city_key,
+    state_id, state_name, state_abbreviation, state_key,
+    country_id, country_name, country_alpha2, country_key
+'''
+
+CREATE_SQL = [
+    f'''
+    INSERT INTO {SEARCH_TABLE} ({COLUMNS})
+    SELECT l.id, l.zip_code, l.latitude, l.longitude,
+           ci.id, ci.name, location_fold(ci.name),
+           s.id, s.name, s.abbreviation, location_fold(s.name),
+           co.id, co.name, co.alpha2, location_fold(co.name)
+    FROM location_location l
+    JOIN location_city ci ON ci.id = l.city_id
+    JOIN location_state s ON s.id = l.state_id
+    JOIN location_country co ON co.id = l.country_id
+    ''',
+    f'''
+    CREATE TRIGGER location_search_insert AFTER INSERT ON location_location BEGIN
+        INSERT INTO {SEARCH_TABLE} ({COLUMNS})
+        SELECT new.id, new.zip_code, new.latitude, new.longitude,
+               ci.id, ci.name, location_fold(ci.name),
+               s.id, s.name, s.abbreviation, location_fold(s.name),
+               co.id, co.name, co.alpha2, location_fold(co.name)
+        FROM location_city ci, location_state s, location_country co
+        WHERE ci.id = new.city_id AND s.id = new.state_id AND co.id = new.country_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_search_delete AFTER DELETE ON location_location BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE id = old.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_search_update AFTER UPDATE ON location_location BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE id = old.id;
+        INSERT INTO {SEARCH_TABLE} ({COLUMNS})
+        SELECT new.id, new.zip_code, new.latitude, new.longitude,
+               ci.id, ci.name, location_fold(ci.name),
+               s.id, s.name, s.abbreviation, location_fold(s.name),
+               co.id, co.name, co.alpha2, location_fold(co.name)
+        FROM location_city ci, location_state s, location_country co
+        WHERE ci.id = new.city_id AND s.id = new.state_id AND co.id = new.country_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_city_search_rename AFTER UPDATE OF name ON location_city
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE {SEARCH_TABLE} SET city_name = new.name, city_key = location_fold(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE city_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_state_search_rename AFTER UPDATE OF name, abbreviation ON location_state
+    WHEN old.name IS NOT new.name OR old.abbreviation IS NOT new.abbreviation BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET state_name = new.name, state_abbreviation = new.abbreviation, state_key = location_fold(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE state_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_country_search_rename AFTER UPDATE OF name, alpha2 ON location_country
+    WHEN old.name IS NOT new.name OR old.alpha2 IS NOT new.alpha2 BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET country_name = new.name, country_alpha2 = new.alpha2, country_key = location_fold(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE country_id = new.id);
+    END
+    ''',
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS location_country_search_rename',
+    'DROP TRIGGER IF EXISTS location_state_search_rename',
+    'DROP TRIGGER IF EXISTS location_city_search_rename',
+    'DROP TRIGGER IF EXISTS location_search_update',
+    'DROP TRIGGER IF EXISTS location_search_delete',
+    'DROP TRIGGER IF EXISTS location_search_insert',
+]
+
+
+def fold_name(value):
+    """location.search.fold_name as of this migration, frozen so later edits to it cannot change migrate"""
+    if value is None:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold().strip()
+
+
+def create_triggers(apps, schema_editor):
+    # The list endpoints read the joined tables wherever this is unavailable
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    # Normally defined by location.db.register_sqlite_functions; the
+    # connection may predate the app registering that receiver. The
+    # populate statement runs here, so the frozen copy is registered.
+    connection.ensure_connection()
+    connection.connection.create_function('location_fold', 1, fold_name, deterministic=True)
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0008_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationSearch',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('zip_code', models.CharField(max_length=10)),
+                ('latitude', models.FloatField(null=True)),
+                ('longitude', models.FloatField(null=True)),
+                ('city_id', models.IntegerField()),
+                ('city_name', models.CharField(max_length=255)),
+                ('city_key', models.CharField(max_length=255)),
+                ('state_id', models.IntegerField()),
+                ('state_name', models.CharField(max_length=255)),
+                ('state_abbreviation', models.CharField(max_length=2)),
+                ('state_key', models.CharField(max_length=255)),
+                ('country_id', models.IntegerField()),
+                ('country_name', models.CharField(max_length=255)),
+                ('country_alpha2', models.CharField(max_length=2)),
+                ('country_key', models.CharField(max_length=255)),
+            ],
+            options={
+                'verbose_name_plural': 'location search rows',
+                'indexes': [models.Index(fields=['zip_code'], name='location_search_zip_idx'), models.Index(fields=['city_id', 'zip_code'], name='location_search_city_zip_idx')],
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
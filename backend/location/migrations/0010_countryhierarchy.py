@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0009_locationsearch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryHierarchy',
+            fields=[
+                ('country_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('data_with_zip_counts', models.BinaryField()),
+            ],
+            options={
+                'verbose_name_plural': 'country hierarchies',
+            },
+        ),
+    ]
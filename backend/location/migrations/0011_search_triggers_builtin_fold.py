@@ -0,0 +1,106 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'location_locationsearch'
+
+COLUMNS = '''
+    id, zip_code, latitude, longitude,
+    city_id, city_name, city_key,
+    state_id, state_name, state_abbreviation, state_key,
+    country_id, country_name, country_alpha2, country_key
+'''
+
+# The triggers of 0009 with lower() in place of location_fold, a function
+# only Django connections define: with those, any write to the location
+# tables from the sqlite3 shell or another program failed. lower() folds
+# ASCII only; location.search.fold_location_search_keys re-folds the keys
+# exactly after every import, and a post_save receiver after ORM saves.
+CREATE_SQL = [
+    f'''
+    CREATE TRIGGER location_search_insert AFTER INSERT ON location_location BEGIN
+        INSERT INTO {SEARCH_TABLE} ({COLUMNS})
+        SELECT new.id, new.zip_code, new.latitude, new.longitude,
+               ci.id, ci.name, lower(ci.name),
+               s.id, s.name, s.abbreviation, lower(s.name),
+               co.id, co.name, co.alpha2, lower(co.name)
+        FROM location_city ci, location_state s, location_country co
+        WHERE ci.id = new.city_id AND s.id = new.state_id AND co.id = new.country_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_search_update AFTER UPDATE ON location_location BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE id = old.id;
+        INSERT INTO {SEARCH_TABLE} ({COLUMNS})
+        SELECT new.id, new.zip_code, new.latitude, new.longitude,
+               ci.id, ci.name, lower(ci.name),
+               s.id, s.name, s.abbreviation, lower(s.name),
+               co.id, co.name, co.alpha2, lower(co.name)
+        FROM location_city ci, location_state s, location_country co
+        WHERE ci.id = new.city_id AND s.id = new.state_id AND co.id = new.country_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_city_search_rename AFTER UPDATE OF name ON location_city
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE {SEARCH_TABLE} SET city_name = new.name, city_key = lower(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE city_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_state_search_rename AFTER UPDATE OF name, abbreviation ON location_state
+    WHEN old.name IS NOT new.name OR old.abbreviation IS NOT new.abbreviation BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET state_name = new.name, state_abbreviation = new.abbreviation, state_key = lower(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE state_id = new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER location_country_search_rename AFTER UPDATE OF name, alpha2 ON location_country
+    WHEN old.name IS NOT new.name OR old.alpha2 IS NOT new.alpha2 BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET country_name = new.name, country_alpha2 = new.alpha2, country_key = lower(new.name)
+        WHERE id IN (SELECT id FROM location_location WHERE country_id = new.id);
+    END
+    ''',
+]
+
+TRIGGERS = [
+    'location_search_insert',
+    'location_search_update',
+    'location_city_search_rename',
+    'location_state_search_rename',
+    'location_country_search_rename',
+]
+
+
+def table_exists(schema_editor):
+    connection = schema_editor.connection
+    return connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+
+
+def replace_triggers(apps, schema_editor):
+    if not table_exists(schema_editor):
+        return
+    for name in TRIGGERS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def restore_triggers(apps, schema_editor):
+    if not table_exists(schema_editor):
+        return
+    for name in TRIGGERS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement.replace('lower(', 'location_fold('))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0010_countryhierarchy'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_triggers, restore_triggers),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 class Country(models.Model):
     name = models.CharField(max_length=255)
@@ -16,6 +19,12 @@ class State(models.Model):
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
     abbreviation = models.CharField(max_length=2, default='')
 
+    class Meta:
+        indexes = [
+            # States of a country, by name
+            models.Index(fields=['country', 'name'], name='location_state_country_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -25,6 +34,10 @@ class City(models.Model):
 
     class Meta:
         verbose_name_plural = "cities"
+        indexes = [
+            # Cities of a state, by name; also the importer's (state, name) lookups
+            models.Index(fields=['state', 'name'], name='location_city_state_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -37,5 +50,131 @@ class Location(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Exact zip code lookups (batch lookup, ?zip=) and the default ordering
+            models.Index(fields=['zip_code'], name='location_zip_code_idx'),
+            # Zip codes of a city, in zip code order
+            models.Index(fields=['city', 'zip_code'], name='location_city_zip_idx'),
+            # Bounding-box prefilter for radius searches
+            models.Index(fields=['latitude', 'longitude'], name='location_lat_lon_idx'),
+        ]
+
     def __str__(self):
         return f"{self.city}, {self.state} {self.zip_code}"
+
+class LocationSearch(models.Model):
+    """Flat, read-only copy of one Location with its city, state and country.
+
+    ``id`` is the Location id. The ``*_key`` columns hold the names folded
+    by ``location.search.fold_name`` (lowercase, accents stripped) so name
+    filters need neither joins nor case-insensitive comparisons. The rows
+    are written only by the triggers of migration 0011, which key names
+    with SQLite's ASCII-only ``lower()``, and by the bulk loads in
+    ``location.search``; ``fold_location_search_keys`` after every import
+    and the ``fold_saved_names`` post_save receiver re-fold the keys
+    exactly. Never save these models directly.
+    """
+    id = models.IntegerField(primary_key=True)
+    zip_code = models.CharField(max_length=10)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    city_id = models.IntegerField()
+    city_name = models.CharField(max_length=255)
+    city_key = models.CharField(max_length=255)
+    state_id = models.IntegerField()
+    state_name = models.CharField(max_length=255)
+    state_abbreviation = models.CharField(max_length=2)
+    state_key = models.CharField(max_length=255)
+    country_id = models.IntegerField()
+    country_name = models.CharField(max_length=255)
+    country_alpha2 = models.CharField(max_length=2)
+    country_key = models.CharField(max_length=255)
+
+    class Meta:
+        verbose_name_plural = "location search rows"
+        indexes = [
+            # The list endpoints' default ordering
+            models.Index(fields=['zip_code'], name='location_search_zip_idx'),
+            # Zip codes of a city, in zip code order
+            models.Index(fields=['city_id', 'zip_code'], name='location_search_city_zip_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.city_name}, {self.state_name} {self.zip_code}"
+
+class CountryHierarchy(models.Model):
+    """One country's states and cities as gzip-compressed JSON.
+
+    Built by ``location.hierarchy.build_hierarchies`` whenever an import is
+    published, in two variants: ``data`` with ids and names only, and
+    ``data_with_zip_counts`` with each city's number of zip codes added.
+    """
+    country_id = models.IntegerField(primary_key=True)
+    data = models.BinaryField()
+    data_with_zip_counts = models.BinaryField()
+
+    class Meta:
+        verbose_name_plural = "country hierarchies"
+
+    def __str__(self):
+        return f"Hierarchy of country {self.country_id}"
+
+def new_version_tag():
+    return uuid.uuid4().hex
+
+class DatasetVersion(models.Model):
+    """One row per completed import; the latest row is the live dataset"""
+    tag = models.CharField(max_length=32, default=new_version_tag, unique=True)
+    imported_at = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        get_latest_by = 'id'
+
+    def __str__(self):
+        return f"{self.tag} ({self.imported_at:%Y-%m-%d %H:%M})"
+
+class SourceFingerprint(models.Model):
+    """Content hash of one imported source row and the row it became.
+
+    ``table`` is the source table (countries, states or zipcodes) and
+    ``target_id`` the id of the Country, State or Location created from it,
+    so incremental imports can tell inserted, changed and removed rows apart.
+    """
+    table = models.CharField(max_length=16)
+    source_id = models.IntegerField()
+    digest = models.BigIntegerField()
+    target_id = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'source_id'], name='location_fingerprint_source_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.table}:{self.source_id}"
+
+class ImportCheckpoint(models.Model):
+    """Durable progress of one stage of a resumable import.
+
+    Saved in the same transaction as the batch it describes, so after a
+    crash ``position`` is exactly the last source key that was committed.
+    ``signature`` identifies the source file so a changed source is never
+    resumed into a half-built import.
+    """
+    source = models.CharField(max_length=255)
+    signature = models.CharField(max_length=64)
+    stage = models.CharField(max_length=16)
+    position = models.JSONField(null=True, blank=True)
+    rows = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'stage'], name='location_checkpoint_stage_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.stage} @ {self.position}"
@@ -0,0 +1,291 @@
+import re
+import unicodedata
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional
+
+from django.db import connections
+
+from location.models import City, Country, Location, LocationSearch, State
+
+# FTS5 index over the denormalized zip/city/state/country text of every
+# Location, keyed by rowid = location_location.id. Created and kept in sync
+# by triggers in migration 0003_location_fts.
+FTS_TABLE = 'location_location_fts'
+FTS_INSERT_TRIGGER = 'location_location_fts_insert'
+
+# Same projection the migration uses to populate the table
+FTS_POPULATE_SQL = f'''
+    INSERT INTO {FTS_TABLE} (rowid, zip_code, city, state, country)
+    SELECT l.id, l.zip_code, ci.name, s.name, co.name
+    FROM location_location l
+    JOIN location_city ci ON ci.id = l.city_id
+    JOIN location_state s ON s.id = l.state_id
+    JOIN location_country co ON co.id = l.country_id
+    WHERE l.id > %s
+'''
+
+# Identical to the trigger migration 0003 creates, so it can be restored
+# after a bulk load even if the process that dropped it died.
+FTS_INSERT_TRIGGER_SQL = f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_INSERT_TRIGGER} AFTER INSERT ON location_location BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, zip_code, city, state, country)
+        SELECT new.id, new.zip_code,
+               (SELECT name FROM location_city WHERE id = new.city_id),
+               (SELECT name FROM location_state WHERE id = new.state_id),
+               (SELECT name FROM location_country WHERE id = new.country_id);
+    END
+'''
+
+# Flat projection of every Location (see models.LocationSearch), kept in
+# sync by the triggers of migrations 0009 and 0011. The triggers can only
+# lowercase the name keys, since the schema must stay writable from
+# connections that lack Django's functions; the bulk statements below run
+# on Django connections and fold them exactly with fold_name, registered
+# as location_fold by location.db.register_sqlite_functions.
+SEARCH_TABLE = 'location_locationsearch'
+SEARCH_INSERT_TRIGGER = 'location_search_insert'
+
+# Same projection the migration uses to populate the table
+SEARCH_POPULATE_SQL = f'''
+    INSERT INTO {SEARCH_TABLE} (
+        id, zip_code, latitude, longitude,
+        city_id, city_name, city_key,
+        state_id, state_name, state_abbreviation, state_key,
+        country_id, country_name, country_alpha2, country_key
+    )
+    SELECT l.id, l.zip_code, l.latitude, l.longitude,
+           ci.id, ci.name, location_fold(ci.name),
+           s.id, s.name, s.abbreviation, location_fold(s.name),
+           co.id, co.name, co.alpha2, location_fold(co.name)
+    FROM location_location l
+    JOIN location_city ci ON ci.id = l.city_id
+    JOIN location_state s ON s.id = l.state_id
+    JOIN location_country co ON co.id = l.country_id
+    WHERE l.id > %s
+'''
+
+# Identical to the trigger migration 0011 creates
+SEARCH_INSERT_TRIGGER_SQL = f'''
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_INSERT_TRIGGER} AFTER INSERT ON location_location BEGIN
+        INSERT INTO {SEARCH_TABLE} (
+            id, zip_code, latitude, longitude,
+            city_id, city_name, city_key,
+            state_id, state_name, state_abbreviation, state_key,
+            country_id, country_name, country_alpha2, country_key
+        )
+        SELECT new.id, new.zip_code, new.latitude, new.longitude,
+               ci.id, ci.name, lower(ci.name),
+               s.id, s.name, s.abbreviation, lower(s.name),
+               co.id, co.name, co.alpha2, lower(co.name)
+        FROM location_city ci, location_state s, location_country co
+        WHERE ci.id = new.city_id AND s.id = new.state_id AND co.id = new.country_id;
+    END
+'''
+
+# Re-folds the keys the triggers could only lowercase
+SEARCH_FOLD_SQL = [
+    f'UPDATE {SEARCH_TABLE} SET {name}_key = location_fold({name}_name) '
+    f'WHERE {name}_key IS NOT location_fold({name}_name)'
+    for name in ('city', 'state', 'country')
+]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = {}
+_search_available = {}
+
+
+def normalize_name(value: str) -> str:
+    """Casefold and strip accents so 'San José' and 'san jose' share a key"""
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold().strip()
+
+
+@lru_cache(maxsize=65536)
+def fold_name(value: Optional[str]) -> Optional[str]:
+    """The key a name is filtered by: 'São Paulo' and 'SAO PAULO' both fold to 'sao paulo'"""
+    if value is None:
+        return None
+    return normalize_name(value)
+
+
+def fts_available(using: str = 'default') -> bool:
+    """Whether the FTS table exists on this connection (cached per alias)"""
+    available = _fts_available.get(using)
+    if available is None:
+        connection = connections[using]
+        available = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+        _fts_available[using] = available
+    return available
+
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix query and all of them must match, so
+    ``new yor`` finds "New York" and ``021`` finds every ZIP starting with
+    021. Returns None when the text has no searchable words.
+    """
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def optimize_location_fts(using: str = 'default') -> None:
+    """Merge the FTS b-trees after a bulk load so lookups stay one seek"""
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+def suspend_location_fts(using: str = 'default') -> Optional[int]:
+    """Drop the per-row FTS insert trigger ahead of a bulk load.
+
+    Returns the highest location id already indexed, to be passed to
+    ``resume_location_fts`` once the load is done, or None when there is no
+    FTS table. New locations must get ids above the returned one.
+    """
+    if not fts_available(using):
+        return None
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'SELECT coalesce(max(rowid), 0) FROM {FTS_TABLE}')
+        last_indexed = cursor.fetchone()[0]
+        cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_INSERT_TRIGGER}')
+    return last_indexed
+
+
+def resume_location_fts(last_indexed: Optional[int], using: str = 'default') -> None:
+    """Index every location above ``last_indexed`` in one pass and restore the trigger"""
+    if last_indexed is None:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(FTS_POPULATE_SQL, [last_indexed])
+        cursor.execute(FTS_INSERT_TRIGGER_SQL)
+
+
+@contextmanager
+def deferred_location_fts(using: str = 'default'):
+    """Index locations inserted in the block in one pass at the end.
+
+    The insert trigger costs three name lookups and an FTS write per row,
+    which dominates a bulk load. It is dropped for the duration of the
+    block and every location with an id above the highest one already
+    indexed is added with a single INSERT ... SELECT afterwards, so callers
+    must allocate new ids above the existing ones. Use inside a
+    transaction so the trigger cannot stay dropped if the block fails.
+    """
+    last_indexed = suspend_location_fts(using)
+    if last_indexed is None:
+        yield
+        return
+    try:
+        yield
+    except BaseException:
+        with connections[using].cursor() as cursor:
+            cursor.execute(FTS_INSERT_TRIGGER_SQL)
+        raise
+    resume_location_fts(last_indexed, using)
+
+
+def search_table_available(using: str = 'default') -> bool:
+    """Whether the trigger-maintained LocationSearch table serves this connection (cached per alias)"""
+    available = _search_available.get(using)
+    if available is None:
+        connection = connections[using]
+        available = (
+            connection.vendor == 'sqlite'
+            and SEARCH_TABLE in connection.introspection.table_names()
+        )
+        _search_available[using] = available
+    return available
+
+
+def suspend_location_search(using: str = 'default') -> Optional[int]:
+    """Drop the per-row LocationSearch insert trigger ahead of a bulk load.
+
+    The counterpart of ``suspend_location_fts``: returns the highest
+    location id already projected, for ``resume_location_search``, or None
+    when the table is not in use.
+    """
+    if not search_table_available(using):
+        return None
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'SELECT coalesce(max(id), 0) FROM {SEARCH_TABLE}')
+        last_projected = cursor.fetchone()[0]
+        cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_INSERT_TRIGGER}')
+    return last_projected
+
+
+def resume_location_search(last_projected: Optional[int], using: str = 'default') -> None:
+    """Project every location above ``last_projected`` in one pass and restore the trigger"""
+    if last_projected is None:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(SEARCH_POPULATE_SQL, [last_projected])
+        cursor.execute(SEARCH_INSERT_TRIGGER_SQL)
+
+
+@contextmanager
+def deferred_location_search(using: str = 'default'):
+    """Project locations inserted in the block in one pass at the end.
+
+    Same contract as ``deferred_location_fts``: new locations must get ids
+    above the existing ones, and the block should run in a transaction.
+    """
+    last_projected = suspend_location_search(using)
+    if last_projected is None:
+        yield
+        return
+    try:
+        yield
+    except BaseException:
+        with connections[using].cursor() as cursor:
+            cursor.execute(SEARCH_INSERT_TRIGGER_SQL)
+        raise
+    resume_location_search(last_projected, using)
+
+
+def fold_location_search_keys(using: str = 'default') -> None:
+    """Give every LocationSearch row its exactly folded name keys.
+
+    Rows written by the triggers only have lowercased keys, so accented
+    names would not match their unaccented spelling. Run when an import is
+    published; a full table scan that rewrites only the stale rows.
+    """
+    if not search_table_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        for statement in SEARCH_FOLD_SQL:
+            cursor.execute(statement)
+
+
+# The LocationSearch key column of each model with a searchable name
+SEARCH_KEY_COLUMNS = {City: 'city_key', State: 'state_key', Country: 'country_key'}
+
+
+def fold_saved_names(sender, instance, raw=False, using='default', **kwargs) -> None:
+    """Fold the keys of the LocationSearch rows a saved model touches; connected to ``post_save``.
+
+    Covers admin and other ORM saves between imports. ``QuerySet.update``
+    sends no signal; rows it changed are re-folded when the next import
+    is published.
+    """
+    if raw or not search_table_available(using):
+        return
+    rows = LocationSearch.objects.using(using)
+    if sender is Location:
+        names = rows.filter(id=instance.pk).values_list('city_name', 'state_name', 'country_name').first()
+        if names is not None:
+            rows.filter(id=instance.pk).update(**{
+                column: fold_name(name) for column, name in zip(SEARCH_KEY_COLUMNS.values(), names)
+            })
+    else:
+        column = SEARCH_KEY_COLUMNS[sender]
+        rows.filter(**{column.replace('_key', '_id'): instance.pk}).update(**{column: fold_name(instance.name)})
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent by the import commands once new location data has been committed.
+# In-process caches built from the location tables listen to this to drop
+# their stale copies.
+dataset_imported = Signal()
@@ -0,0 +1,191 @@
+import math
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from django.db.models import Q, QuerySet
+
+from location.caches import DatasetCache
+from location.models import Location
+
+# Mean Earth radius (IUGG), the usual choice for haversine distances
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Map degrees to points on the unit sphere, shape (n, 3)"""
+    phi = np.radians(lats)
+    lam = np.radians(lons)
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def chord_to_km(chord_squared: np.ndarray) -> np.ndarray:
+    """Great-circle distance for squared chord lengths on the unit sphere"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.sqrt(chord_squared) / 2, 1.0))
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distances from one point to arrays of points, in km"""
+    phi = math.radians(lat)
+    phis = np.radians(lats)
+    half_dphi = (phis - phi) / 2
+    half_dlam = np.radians(lons - lon) / 2
+    h = np.sin(half_dphi) ** 2 + math.cos(phi) * np.cos(phis) * np.sin(half_dlam) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float
+                 ) -> Tuple[Tuple[float, float], List[Tuple[float, float]]]:
+    """Latitude range and longitude range(s) covering a circle on the sphere.
+
+    The longitude span widens with latitude (Matuschek's formula), becomes
+    the whole circle when the radius reaches a pole, and is split in two
+    when it crosses the antimeridian.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    lat_min = lat - math.degrees(angular)
+    lat_max = lat + math.degrees(angular)
+    if lat_min <= -90 or lat_max >= 90:
+        return (max(lat_min, -90.0), min(lat_max, 90.0)), [(-180.0, 180.0)]
+
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(lat)))))
+    lon_min, lon_max = lon - delta_lon, lon + delta_lon
+    if lon_min < -180:
+        return (lat_min, lat_max), [(lon_min + 360, 180.0), (-180.0, lon_max)]
+    if lon_max > 180:
+        return (lat_min, lat_max), [(lon_min, 180.0), (-180.0, lon_max - 360)]
+    return (lat_min, lat_max), [(lon_min, lon_max)]
+
+
+def locations_within(queryset: QuerySet, lat: float, lon: float,
+                     radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Ids and distances of locations within ``radius_km``, nearest first.
+
+    Candidates come from a range scan on the (latitude, longitude) index;
+    exact distances are then computed for all of them in one NumPy pass.
+    """
+    lat_range, lon_ranges = bounding_box(lat, lon, radius_km)
+    lon_filter = Q()
+    for lon_range in lon_ranges:
+        lon_filter |= Q(longitude__range=lon_range)
+
+    rows = (
+        queryset
+        .filter(latitude__range=lat_range)
+        .filter(lon_filter)
+        .values_list('id', 'latitude', 'longitude')
+    )
+    data = np.fromiter(
+        rows.iterator(chunk_size=10000),
+        dtype=[('id', np.int64), ('lat', np.float64), ('lon', np.float64)],
+    )
+    distances = haversine_km(lat, lon, data['lat'], data['lon'])
+    inside = distances <= radius_km
+    ids, distances = data['id'][inside], distances[inside]
+    order = np.argsort(distances, kind='stable')
+    return ids[order], distances[order]
+
+
+class LocationKDTree:
+    """Static k-d tree over geocoded locations for nearest-neighbour lookups.
+
+    Points are stored as 3D unit vectors, so the straight-line (chord)
+    distance used for pruning orders points exactly like the great-circle
+    distance and nothing special happens at the poles or the antimeridian.
+    The tree is implicit: points are reordered so each node covers a
+    contiguous slice split at its midpoint, and node ``i`` has children
+    ``2i + 1`` and ``2i + 2``.
+    """
+
+    LEAF_SIZE = 32
+
+    def __init__(self, rows: Iterable[Tuple[int, float, float]]):
+        data = np.fromiter(rows, dtype=[('id', np.int64), ('lat', np.float64), ('lon', np.float64)])
+        ids = data['id']
+        points = unit_vectors(data['lat'], data['lon'])
+        count = len(ids)
+
+        depth = max(0, math.ceil(math.log2(max(count, 1) / self.LEAF_SIZE)))
+        self.split_axes = np.full(2 ** (depth + 1), -1, dtype=np.int8)
+        self.split_values = np.zeros(2 ** (depth + 1), dtype=np.float64)
+
+        order = np.arange(count)
+        stack = [(0, 0, count)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo <= self.LEAF_SIZE:
+                continue
+            subset = order[lo:hi]
+            coords = points[subset]
+            axis = int(np.argmax(coords.max(axis=0) - coords.min(axis=0)))
+            mid = (lo + hi) // 2
+            partition = np.argpartition(coords[:, axis], mid - lo)
+            order[lo:hi] = subset[partition]
+            self.split_axes[node] = axis
+            self.split_values[node] = points[order[mid], axis]
+            stack.append((2 * node + 1, lo, mid))
+            stack.append((2 * node + 2, mid, hi))
+
+        self.ids = ids[order]
+        self.points = points[order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[int, float]]:
+        """Return ``(location_id, distance_km)`` for the k closest points"""
+        k = min(k, len(self.ids))
+        if k <= 0:
+            return []
+        query = unit_vectors(np.array([lat]), np.array([lon]))[0]
+
+        # Best k so far as parallel arrays, kept sorted by squared chord
+        best_d2 = np.full(k, np.inf)
+        best_pos = np.full(k, -1, dtype=np.int64)
+
+        # Entries carry a lower bound on the squared chord to their subtree
+        stack = [(0, 0, len(self.ids), 0.0)]
+        while stack:
+            node, lo, hi, bound = stack.pop()
+            if bound >= best_d2[-1]:
+                continue
+            axis = self.split_axes[node] if node < len(self.split_axes) else -1
+            if axis < 0:
+                d2 = ((self.points[lo:hi] - query) ** 2).sum(axis=1)
+                merged_d2 = np.concatenate((best_d2, d2))
+                merged_pos = np.concatenate((best_pos, np.arange(lo, hi)))
+                keep = np.argsort(merged_d2, kind='stable')[:k]
+                best_d2, best_pos = merged_d2[keep], merged_pos[keep]
+                continue
+
+            mid = (lo + hi) // 2
+            diff = query[axis] - self.split_values[node]
+            near, far = (2 * node + 1, lo, mid), (2 * node + 2, mid, hi)
+            if diff >= 0:
+                near, far = far, near
+            # The far side goes on the stack first so it is popped after the
+            # near side has had a chance to tighten the bound.
+            stack.append((*far, max(bound, diff * diff)))
+            stack.append((*near, bound))
+
+        found = best_pos >= 0
+        distances = chord_to_km(best_d2[found])
+        return list(zip(self.ids[best_pos[found]].tolist(), distances.tolist()))
+
+
+def build_location_tree() -> LocationKDTree:
+    rows = (
+        Location.objects
+        .filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('id', 'latitude', 'longitude')
+        .iterator(chunk_size=10000)
+    )
+    return LocationKDTree(rows)
+
+
+location_tree = DatasetCache(build_location_tree)
+
+
+def get_location_tree() -> LocationKDTree:
+    """Return the process-wide k-d tree, building it on first use"""
+    return location_tree.get()
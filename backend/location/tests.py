@@ -1,3 +1,1305 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import ExitStack, closing, redirect_stderr
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import orjson
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from location import dataset, metrics
+from location.api.renderers import FastJSONRenderer
+from location.api.serializers import LocationSerializer
+from location.api.views import CityViewSet, CountryViewSet, LocationViewSet, StateViewSet, ZipCodeViewSet
+from location.autocomplete import city_index, get_city_index
+from location.city_zips import city_zip_lists
+from location.dataset import stamp_version
+from location.hierarchy import build_hierarchies, get_hierarchies, hierarchies
+from location.importer import ImportPipeline, clear_location_tables
+from location.importer.delta import merge_diff
+from location.importer.pipeline import row_digest
+from location.importer.resumable import ResumableImport
+from location.importer.sharded import partition
+from location.importer.shadow import ShadowDatabase
+from location.importer.synthetic import generate_source
+from location.importer.writers import create_model_indexes, drop_model_indexes
+from location.management.commands.import_locations import Command as ImportLocationsCommand
+from location.models import (
+    City, Country, CountryHierarchy, DatasetVersion, ImportCheckpoint, Location, LocationSearch,
+    SourceFingerprint, State,
+)
+from location.search import (
+    FTS_TABLE, SEARCH_INSERT_TRIGGER, deferred_location_fts, deferred_location_search,
+    fold_location_search_keys, fts_available, fts_query, search_table_available,
+)
+from location.signals import dataset_imported
+from location.spatial import (
+    bounding_box, get_location_tree, haversine_km, location_tree, locations_within,
+)
+from location.warmup import WARMED, warm_indexes
+
+
+def query_plan(sql: str) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+class LocationDataMixin:
+    @classmethod
+    def setUpTestData(cls):
+        for c in range(2):
+            country = Country.objects.create(name=f'Country {c}', alpha2=f'C{c}', alpha3=f'CC{c}')
+            for s in range(3):
+                state = State.objects.create(name=f'State {c}{s}', country=country, abbreviation=f'S{s}')
+                for i in range(5):
+                    city = City.objects.create(name=f'City {c}{s}{i}', state=state)
+                    Location.objects.bulk_create(
+                        Location(
+                            city=city, state=state, country=country, zip_code=f'{c}{s}{i}{z}0',
+                            latitude=40 + i / 10, longitude=-70 - z / 10,
+                        )
+                        for z in range(4)
+                    )
+        cls.city = City.objects.select_related('state').order_by('id').first()
+        cls.state = cls.city.state
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class QueryPlanTests(LocationDataMixin, TestCase):
+    """The filter and ordering paths of the API are served by an index"""
+
+    def endpoint_plans(self, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            if data is None:
+                response = self.client.get(path)
+            else:
+                response = self.client.post(path, data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [query_plan(query['sql']) for query in queries.captured_queries]
+
+    def assertIndexed(self, plans, index):
+        """Some query searches or scans ``index`` and needs no sort for its ORDER BY"""
+        for plan in plans:
+            if f'INDEX {index}' in plan:
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+                return
+        self.fail(f'No query used {index}:\n' + '\n---\n'.join(plans))
+
+    def test_states_of_country_by_name(self):
+        plans = self.endpoint_plans(f'/api/states/?country={self.state.country_id}&ordering=name')
+        self.assertIndexed(plans, 'location_state_country_idx')
+
+    def test_cities_of_state_by_name(self):
+        plans = self.endpoint_plans(f'/api/cities/?state={self.state.id}&ordering=name')
+        self.assertIndexed(plans, 'location_city_state_idx')
+
+    def test_locations_in_zip_code_order(self):
+        self.assertIndexed(self.endpoint_plans('/api/locations/'), 'location_search_zip_idx')
+        self.assertIndexed(self.endpoint_plans('/api/zipcodes/'), 'location_search_zip_idx')
+
+    def test_location_lists_need_no_joins(self):
+        for path in ('/api/locations/?state=state', '/api/zipcodes/?country=country&ordering=city__name'):
+            for plan in self.endpoint_plans(path):
+                self.assertIn('location_locationsearch', plan)
+                self.assertNotIn('location_city', plan)
+
+    def test_zip_code_batch_lookup(self):
+        plans = self.endpoint_plans('/api/zipcodes/batch/', {'zip_codes': ['00000', '11110']})
+        self.assertIndexed(plans, 'location_zip_code_idx')
+
+    def test_zip_codes_of_city(self):
+        queryset = Location.objects.filter(city_id=self.city.id).order_by('zip_code')
+        self.assertIndexed([query_plan(str(queryset.query))], 'location_city_zip_idx')
+        city_zip_lists.invalidate()
+        for path in (f'/api/zipcodes/?city={self.city.id}', f'/api/zipcodes/?city={self.city.id}&ordering=zip_code'):
+            self.assertIndexed(self.endpoint_plans(path), 'location_search_city_zip_idx')
+
+    def test_radius_search(self):
+        plans = self.endpoint_plans('/api/zipcodes/within/?lat=40&lon=-70&radius_km=50')
+        self.assertIndexed(plans, 'location_lat_lon_idx')
+
+    def test_import_restores_indexes(self):
+        drop_model_indexes(Location)
+        create_model_indexes(Location)
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, Location._meta.db_table)
+        for index in Location._meta.indexes:
+            self.assertIn(index.name, existing)
+
+
+@override_settings(DATASET_CACHE_PATHS=[], DATASET_VERSION_TTL=3600)
+class QueryCountTests(LocationDataMixin, TestCase):
+    """Pin how many queries each endpoint runs, with process caches warm"""
+
+    def setUp(self):
+        dataset.reset()
+        dataset.current_version()
+        get_city_index()
+        get_location_tree()
+        fts_available()
+        search_table_available()
+        city_zip_lists.invalidate()
+        hierarchies.invalidate()
+        get_hierarchies().blob(self.state.country_id)
+
+    def assertQueries(self, count, path, data=None):
+        with self.subTest(path=path), self.assertNumQueries(count):
+            if data is None:
+                response = self.client.get(path)
+            else:
+                response = self.client.post(path, data, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+    def test_countries(self):
+        self.assertQueries(2, '/api/countries/')
+        self.assertQueries(2, '/api/countries/?search=coun')
+        self.assertQueries(0, f'/api/countries/{self.state.country_id}/hierarchy/?zip_counts=true')
+
+    def test_states(self):
+        self.assertQueries(2, '/api/states/')
+        # The country filter validates its id first
+        self.assertQueries(3, f'/api/states/?country={self.state.country_id}')
+
+    def test_cities(self):
+        self.assertQueries(2, '/api/cities/')
+        self.assertQueries(3, f'/api/cities/?state={self.state.id}')
+        self.assertQueries(2, '/api/cities/?search=city')
+        self.assertQueries(0, '/api/cities/autocomplete/?search=cit')
+
+    def test_locations(self):
+        self.assertQueries(2, '/api/locations/')
+        # A probe of the FTS match decides on the substring fallback
+        self.assertQueries(3, '/api/locations/?search=city')
+        self.assertQueries(2, '/api/locations/?state=state')
+        self.assertQueries(1, '/api/locations/export/?output=csv')
+
+    def test_zipcodes(self):
+        self.assertQueries(2, '/api/zipcodes/')
+        # One read of the city's list, then every page variant is sliced from it
+        self.assertQueries(1, f'/api/zipcodes/?city={self.city.id}')
+        self.assertQueries(0, f'/api/zipcodes/?city={self.city.id}&page_size=2&page=2')
+        self.assertQueries(2, f'/api/zipcodes/?city={self.city.id}&ordering=-zip_code')
+        self.assertQueries(3, '/api/zipcodes/?search=001')
+        self.assertQueries(1, '/api/zipcodes/batch/', {'zip_codes': ['00000', '11110']})
+        self.assertQueries(1, '/api/zipcodes/nearest/?lat=40&lon=-70&k=3')
+        self.assertQueries(2, '/api/zipcodes/within/?lat=40&lon=-70&radius_km=50')
+
+
+@override_settings(DATASET_CACHE_PATHS=[], METRICS_SAMPLE_RATE=1)
+class MetricsTests(LocationDataMixin, TestCase):
+    """/metrics serves Prometheus histograms to allowlisted addresses only"""
+
+    def test_allowlist(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 403)
+        # Forwarding headers are client-controlled and ignored
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_sampled_request(self):
+        self.client.get('/api/countries/')
+        body = self.client.get('/metrics').content.decode()
+        for name in ('location_request_duration_seconds', 'location_sql_queries',
+                     'location_serialize_duration_seconds'):
+            self.assertIn(f'{name}_count{{endpoint="CountryViewSet.list"}}', body)
+        self.assertNotIn('endpoint="metrics"', body)
+
+    def test_rendering_counts_as_serialization(self):
+        dumps = orjson.dumps
+
+        def slow_dumps(*args, **kwargs):
+            time.sleep(0.02)
+            return dumps(*args, **kwargs)
+
+        with mock.patch('location.api.renderers.orjson.dumps', slow_dumps), \
+                mock.patch('location.middleware.metrics.record', wraps=metrics.record) as record:
+            self.assertEqual(self.client.get(f'/api/countries/{self.state.country_id}/').status_code, 200)
+        (endpoint, _, sample), _ = record.call_args
+        self.assertEqual(endpoint, 'CountryViewSet.retrieve')
+        self.assertGreaterEqual(sample.serialize_time, 0.02)
+
+
+@override_settings(DATASET_CACHE_PATHS=['/api/'], DATASET_VERSION_TTL=3600, ALLOWED_HOSTS=['*'])
+class DatasetCacheTests(LocationDataMixin, TestCase):
+    """Conditional GETs and replays are answered without the database until the next import"""
+
+    def setUp(self):
+        caches['default'].clear()
+        stamp_version(source='test')
+        dataset.current_version()
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/countries/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']},
+                            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+                self.assertEqual(self.client.get('/api/countries/', **headers).status_code, 304)
+        self.assertEqual(self.client.get('/api/countries/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_replay(self):
+        response = self.client.get(f'/api/states/?ordering=name&country={self.state.country_id}')
+        with self.assertNumQueries(0):
+            replayed = self.client.get(f'/api/states/?country={self.state.country_id}&ordering=name')
+        self.assertEqual((replayed.status_code, replayed['ETag']), (200, response['ETag']))
+        self.assertEqual(replayed.content, response.content)
+        # Except for the Cookie the session middleware adds to Vary once
+        # the (skipped) auth middleware has read the session
+        headers = {name: value for name, value in response.items() if name != 'Vary'}
+        self.assertEqual({name: value for name, value in replayed.items() if name != 'Vary'}, headers)
+        self.assertIn('Allow', replayed)
+
+    def test_modified_since_needs_success(self):
+        since = {'HTTP_IF_MODIFIED_SINCE': self.client.get('/api/countries/')['Last-Modified']}
+        for path, status in (('/api/countries/?page=999999', 404), ('/api/states/?country=x', 400),
+                             ('/api/countries/999999/', 404)):
+            with self.subTest(path=path):
+                for _ in range(2):
+                    self.assertEqual(self.client.get(path, **since).status_code, status)
+
+    @override_settings(DATASET_CACHE_MAX_BYTES=0)
+    def test_conditional_get_uncached(self):
+        response = self.client.get('/api/countries/')
+        with self.assertNumQueries(0):
+            for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']},
+                            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+                self.assertEqual(self.client.get('/api/countries/', **headers).status_code, 304)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/countries/').content, response.content)
+        self.assertTrue(queries.captured_queries)
+
+    def test_links_follow_scheme_and_host(self):
+        for host, secure in (('a.example', False), ('b.example', False), ('a.example', True)):
+            response = self.client.get('/api/cities/?ordering=name&page_size=2', HTTP_HOST=host, secure=secure)
+            scheme = 'https' if secure else 'http'
+            self.assertTrue(response.json()['next'].startswith(f'{scheme}://{host}/api/cities/'))
+
+    def test_import_misses(self):
+        response = self.client.get('/api/countries/')
+        stamp_version(source='test')
+        with CaptureQueriesContext(connection) as queries:
+            fresh = self.client.get('/api/countries/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+        self.assertTrue(queries.captured_queries)
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class AutocompleteTests(TestCase):
+    """The city index ranks like the city list: exact, then prefix, then contains, by name"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Country', alpha2='CO', alpha3='COU')
+        cls.first = State.objects.create(name='First', country=country, abbreviation='FI')
+        cls.second = State.objects.create(name='Second', country=country, abbreviation='SE')
+        for state, names in ((cls.first, ['San Jose', 'San Joseph', 'Old San Jose Town', 'Sant', 'Jose']),
+                             (cls.second, ['San José', 'Los Sanos', 'Santa Ana', 'Jose'])):
+            City.objects.bulk_create(City(name=name, state=state) for name in names)
+
+    def setUp(self):
+        city_index.invalidate()
+
+    def search(self, query, **kwargs):
+        return [(city['name'], city['state'], city['match_rank'])
+                for city in get_city_index().search(query, **kwargs)]
+
+    def test_ranking(self):
+        first, second = self.first.id, self.second.id
+        expected = [
+            ('Jose', first, 3), ('Jose', second, 3),
+            ('San Jose', first, 2), ('San José', second, 2), ('San Joseph', first, 2),
+            ('Sant', first, 2), ('Santa Ana', second, 2),
+            ('Los Sanos', second, 1), ('Old San Jose Town', first, 1),
+        ]
+        self.assertEqual(self.search('san jose'), expected)
+        # Case and accents fold away, in the query and in the names
+        self.assertEqual(self.search('SAN  JOSÉ'), expected)
+        self.assertEqual(self.search('san jose', limit=4), expected[:4])
+        self.assertEqual(self.search('san jose', state_id=second), [row for row in expected if row[1] == second])
+        self.assertEqual(self.search('osé'), [('Jose', first, 1), ('Jose', second, 1), ('Old San Jose Town', first, 1),
+                                             ('San Jose', first, 1), ('San José', second, 1), ('San Joseph', first, 1)])
+        self.assertEqual(self.search('an', state_id=999), [])
+        self.assertEqual(self.search(' '), [])
+
+    def test_matches_city_list(self):
+        # Without accents, which the list endpoint does not fold
+        for query, state in (('san jose', self.first.id), ('sant ana', None), ('ANA', None), ('los', None), ('an', self.first.id)):
+            with self.subTest(query=query, state=state):
+                path = f'/api/cities/?search={query}&page_size=100' + (f'&state={state}' if state else '')
+                listed = [(city['id'], city['name']) for city in self.client.get(path).json()['results']]
+                indexed = [(city['id'], city['name'])
+                           for city in get_city_index().search(query, state_id=state, limit=100)]
+                self.assertEqual(indexed, listed)
+
+    def test_endpoint(self):
+        response = self.client.get(f'/api/cities/autocomplete/?search=san jose&state={self.first.id}&limit=2')
+        self.assertEqual(response.json(), [
+            {'id': City.objects.get(name='Jose', state=self.first).id, 'name': 'Jose', 'state': self.first.id,
+             'match_rank': 3},
+            {'id': City.objects.get(name='San Jose').id, 'name': 'San Jose', 'state': self.first.id, 'match_rank': 2},
+        ])
+        self.assertEqual(self.client.get('/api/cities/autocomplete/').json(), [])
+        for query in ('limit=0', 'limit=x', 'state=x'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/cities/autocomplete/?search=san&{query}').status_code, 400)
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class PaginationTests(LocationDataMixin, TestCase):
+    """The uncounted and cursor modes reach every row exactly once"""
+
+    def walk(self, path):
+        """The results of every page, following ``next`` links from ``path``"""
+        pages = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            pages.append(body['results'])
+            path = body['next']
+        return pages
+
+    def test_cursor_walk(self):
+        for path, model, key in (
+            ('/api/locations/?pagination=cursor&page_size=7', Location, 'zip_code'),
+            # Four zip codes per city: pages break inside runs of equal keys
+            ('/api/zipcodes/?pagination=cursor&page_size=3&ordering=-city__name', Location, 'zip_code'),
+            ('/api/cities/?pagination=cursor&page_size=4', City, 'id'),
+        ):
+            with self.subTest(path=path):
+                pages = self.walk(path)
+                rows = [row[key] for page in pages for row in page]
+                self.assertEqual(sorted(rows), sorted(model.objects.values_list(key, flat=True)))
+                self.assertTrue(pages[-1])
+        zip_codes = [row['zip_code'] for page in self.walk('/api/zipcodes/?pagination=cursor&page_size=50')
+                     for row in page]
+        self.assertEqual(zip_codes, sorted(zip_codes))
+
+    def test_cursor_with_search(self):
+        response = self.client.get('/api/locations/?pagination=cursor&search=City 00')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.json())
+        self.assertEqual(self.client.get('/api/cities/?pagination=cursor&search=city').status_code, 400)
+        pages = self.walk('/api/locations/?pagination=cursor&page_size=3&search=City 00&ordering=zip_code')
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 3, 3, 3, 2])
+
+    def test_uncounted(self):
+        pages = self.walk('/api/locations/?count=false&page_size=50')
+        self.assertEqual([len(page) for page in pages], [50, 50, 20])
+        last = self.client.get('/api/locations/?count=false&page_size=50&page=3').json()
+        self.assertEqual((last['count'], last['next']), (None, None))
+        self.assertIn('page=2', last['previous'])
+        exact = self.client.get('/api/locations/?count=false&page_size=60&page=2').json()
+        self.assertEqual((len(exact['results']), exact['next']), (60, None))
+        # Without a count a page past the end is only known to be empty
+        beyond = self.client.get('/api/locations/?count=false&page=9').json()
+        self.assertEqual((beyond['results'], beyond['next']), ([], None))
+        self.assertEqual(self.client.get('/api/locations/?count=false&page=0').status_code, 404)
+
+
+@override_settings(DATASET_VERSION_TTL=3600)
+class WarmupTests(LocationDataMixin, TestCase):
+    """The in-memory indexes are built before requests need them"""
+
+    def setUp(self):
+        dataset.reset()
+        for cache in WARMED:
+            cache.invalidate()
+
+    def test_warm_indexes(self):
+        warm_indexes()
+        with self.assertNumQueries(0):
+            tree = get_location_tree()
+            cities = get_city_index().search('city 01', limit=5)
+        self.assertEqual(len(tree), Location.objects.count())
+        self.assertEqual(len(cities), 5)
+
+    def test_import_rebuilds_used_indexes(self):
+        get_city_index()
+        stamp_version(source='test')
+        dataset_imported.send(sender=self.__class__)
+        self.assertIsNotNone(city_index._entry)
+        # Never used in this process, so not built
+        self.assertIsNone(location_tree._entry)
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class LocationSearchTests(LocationDataMixin, TestCase):
+    """The LocationSearch projection follows the location tables"""
+
+    def results(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_list_matches_serializer(self):
+        locations = Location.objects.select_related('city', 'state', 'country').order_by('zip_code', 'id')
+        expected = LocationSerializer(locations[:100], many=True).data
+        self.assertEqual(self.results('/api/locations/?page_size=100'), expected)
+
+    def fts_ids(self, text):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [fts_query(text)])
+            return sorted(rowid for rowid, in cursor.fetchall())
+
+    def test_fts_triggers(self):
+        location = Location.objects.create(
+            city=City.objects.create(name='Zanzibar', state=self.state), state=self.state,
+            country=self.state.country, zip_code='77777',
+        )
+        self.assertEqual((self.fts_ids('zanzi'), self.fts_ids('7777')), ([location.id], [location.id]))
+        location.zip_code = '88888'
+        location.city = self.city
+        location.save()
+        self.assertEqual((self.fts_ids('zanzi'), self.fts_ids('7777')), ([], []))
+        self.assertIn(location.id, self.fts_ids(f'{self.city.name} 8888'))
+        City.objects.filter(pk=self.city.pk).update(name='Renamed')
+        renamed = Location.objects.filter(city=self.city).values_list('id', flat=True)
+        self.assertEqual(self.fts_ids('renamed'), sorted(renamed))
+        location.delete()
+        self.assertEqual(self.fts_ids('8888'), [])
+
+    def test_substring_fallback(self):
+        for search, expected in (
+            # Fragments from inside a word or a ZIP code
+            ('ity 01', Location.objects.filter(city__name__startswith='City 01')),
+            ('230', Location.objects.filter(zip_code__contains='230')),
+        ):
+            with self.subTest(search=search):
+                self.assertTrue(expected.exists())
+                rows = self.results(f'/api/locations/?search={search}&page_size=1000')
+                self.assertEqual(sorted(row['id'] for row in rows), sorted(expected.values_list('id', flat=True)))
+        # Word prefixes still go through FTS, ranked
+        self.assertEqual(len(self.results('/api/zipcodes/?search=city 01')), 20)
+        self.assertEqual(self.results('/api/locations/?search=nowhere'), [])
+
+    def test_renames_and_deletes(self):
+        self.city.name = 'São Tomé'
+        self.city.save()
+        State.objects.filter(pk=self.state.pk).update(abbreviation='ZZ')
+        row = LocationSearch.objects.filter(city_id=self.city.pk).first()
+        self.assertEqual((row.city_name, row.city_key, row.state_abbreviation), ('São Tomé', 'sao tome', 'ZZ'))
+        self.assertEqual(len(self.results('/api/locations/?city=SAO tom')), 4)
+
+        # Writes that bypass post_save are lowercased, then folded when an import is published
+        Country.objects.filter(pk=self.state.country_id).update(name='ÉIRE')
+        self.assertEqual(LocationSearch.objects.filter(country_key='Éire').count(), 60)
+        fold_location_search_keys()
+        self.assertEqual(LocationSearch.objects.filter(country_key='eire').count(), 60)
+
+        Location.objects.filter(city=self.city).delete()
+        self.assertFalse(LocationSearch.objects.filter(city_id=self.city.pk).exists())
+        self.assertEqual(LocationSearch.objects.count(), Location.objects.count())
+
+    def test_schema_writable_without_django(self):
+        """The triggers use only built-in SQL, so other programs can write the tables"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE name LIKE 'location_%%' AND sql IS NOT NULL "
+                "AND name NOT LIKE 'location_location_fts_%%' ORDER BY type = 'trigger'"
+            )
+            schema = [sql for sql, in cursor.fetchall()]
+        with sqlite3.connect(':memory:') as plain:
+            for sql in schema:
+                plain.execute(sql)
+            plain.execute("INSERT INTO location_country (id, name, alpha2, alpha3) VALUES (1, 'Perú', 'PE', 'PER')")
+            plain.execute("INSERT INTO location_state (id, name, country_id, abbreviation) VALUES (1, 'Lima', 1, 'LI')")
+            plain.execute("INSERT INTO location_city (id, name, state_id) VALUES (1, 'Lima', 1)")
+            plain.execute(
+                'INSERT INTO location_location (id, city_id, state_id, country_id, zip_code) '
+                "VALUES (1, 1, 1, 1, '15001')"
+            )
+            plain.execute("UPDATE location_city SET name = 'Callao' WHERE id = 1")
+            plain.execute("UPDATE location_location SET zip_code = '07001' WHERE id = 1")
+            self.assertEqual(
+                plain.execute('SELECT zip_code, city_key, country_key FROM location_locationsearch').fetchall(),
+                [('07001', 'callao', 'perú')],
+            )
+            plain.execute('DELETE FROM location_location')
+            self.assertEqual(plain.execute('SELECT count(*) FROM location_locationsearch').fetchone(), (0,))
+
+    def test_zip_codes_of_city_id(self):
+        namesake = City.objects.create(name=self.city.name, state=State.objects.exclude(pk=self.state.pk).first())
+        Location.objects.create(city=namesake, state=namesake.state, country=namesake.state.country, zip_code='77777')
+        city_zip_lists.invalidate()
+        expected = [f'{self.city.name[-3:]}{z}0' for z in range(4)]
+        self.assertEqual([row['zip_code'] for row in self.results(f'/api/zipcodes/?city={self.city.id}')], expected)
+        self.assertEqual(
+            [row['zip_code'] for row in self.results(f'/api/zipcodes/?city={self.city.id}&ordering=zip_code')],
+            expected,
+        )
+        self.assertEqual(len(self.results(f'/api/zipcodes/?city={self.city.name}')), 5)
+
+    def test_deferred_bulk_load(self):
+        last = Location.objects.order_by('-id').first()
+        with transaction.atomic(), deferred_location_search():
+            Location.objects.bulk_create(
+                Location(id=last.id + n, city_id=last.city_id, state_id=last.state_id,
+                         country_id=last.country_id, zip_code=f'9999{n}')
+                for n in range(1, 4)
+            )
+            self.assertEqual(LocationSearch.objects.filter(zip_code__startswith='9999').count(), 0)
+        self.assertEqual(LocationSearch.objects.filter(zip_code__startswith='9999').count(), 3)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = %s", [SEARCH_INSERT_TRIGGER])
+            self.assertIsNotNone(cursor.fetchone())
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class FastListTests(LocationDataMixin, TestCase):
+    """The values_list fast path and FastJSONRenderer emit exactly the serializer's bytes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        city = City.objects.create(name='Line\u2028Para\u2029graph', state=cls.state)
+        Location.objects.bulk_create(
+            Location(city=city, state=cls.state, country=cls.state.country, zip_code=f'9999{n}',
+                     latitude=lat, longitude=lon)
+            for n, (lat, lon) in enumerate([(None, None), (1e-05, -2.5e-06), (0.0001, 1.5e-07), (-0.0, 12.0)])
+        )
+
+    PATHS = [
+        '/api/countries/?page_size=1000',
+        '/api/states/?ordering=-name&page_size=1000',
+        '/api/cities/?ordering=name&page_size=1000',
+        '/api/locations/?page_size=1000',
+        '/api/locations/?city=line',
+        '/api/zipcodes/?ordering=city__name&page_size=1000',
+    ]
+
+    def test_matches_serializer(self):
+        views = (CountryViewSet, StateViewSet, CityViewSet, LocationViewSet, ZipCodeViewSet)
+        for path in self.PATHS:
+            with self.subTest(path=path):
+                fast = self.client.get(path)
+                with ExitStack() as stack:
+                    for view in views:
+                        stack.enter_context(mock.patch.object(view, 'fast_list', False))
+                    slow = self.client.get(path)
+                self.assertEqual(fast.status_code, 200)
+                self.assertEqual(fast.content, slow.content)
+        body = self.client.get('/api/locations/?city=line').content
+        self.assertIn(b'Line\\u2028Para\\u2029graph', body)
+        self.assertIn(b'"latitude":1e-05,"longitude":-2.5e-06', body)
+
+    def test_renderer(self):
+        payloads = [
+            {'name': 'a\u2028b\u2029c', 'other': 'São Tomé ☃ \U0001f600'},
+            [0.1, 1e-05, 0.0001, 1.5e16, 1e16, 123456789.125, -0.0, 2 ** 63, None, True, ''],
+            {'nested': [{'x': 1e-07}], 'text': 'e5 1e5 and 2e-3 in a string'},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(FastJSONRenderer().render('\u2028'), b'"\\u2028"')
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class FieldShapeTests(LocationDataMixin, TestCase):
+    """``?fields=`` narrows and ``?expand=`` inlines relations on the list endpoints"""
+
+    def get(self, path, status=200):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def test_fields_narrow_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get('/api/locations/?fields=zip_code,city_name&page_size=2').json()['results']
+        self.assertEqual(rows, [
+            {'zip_code': '00000', 'city_name': 'City 000'},
+            {'zip_code': '00010', 'city_name': 'City 000'},
+        ])
+        self.assertNotIn('latitude', queries.captured_queries[-1]['sql'])
+
+    def test_expand_in_one_query(self):
+        with self.assertNumQueries(2):
+            rows = self.get('/api/cities/?expand=state,country&ordering=name&page_size=1').json()['results']
+        self.assertEqual(rows, [{
+            'id': self.city.id, 'name': 'City 000',
+            'state': {'id': self.state.id, 'name': 'State 00', 'abbreviation': 'S0'},
+            'country': {'id': self.state.country_id, 'name': 'Country 0', 'alpha2': 'C0'},
+        }])
+        row = self.get('/api/zipcodes/?expand=city&fields=zip_code,city&page_size=1').json()['results'][0]
+        self.assertEqual(row, {'zip_code': '00000', 'city': {'id': self.city.id, 'name': 'City 000'}})
+
+    def test_cursor_pages_without_the_keyset_fields(self):
+        page = self.get('/api/locations/?pagination=cursor&ordering=city__name&fields=zip_code&page_size=3').json()
+        following = self.get(page['next'].replace('http://testserver', '')).json()
+        self.assertEqual([row['zip_code'] for row in following['results']], ['00030', '00100', '00110'])
+
+    def test_unknown_names(self):
+        self.assertIn('alpha3', self.get('/api/countries/?fields=code', status=400).json()['fields'])
+        self.get('/api/countries/?expand=state', status=400)
+
+    def test_csv_export_headers(self):
+        response = self.get('/api/locations/export/?output=csv&fields=zip_code,state&expand=state&zip_code=00000')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['zip_code,state.id,state.name,state.abbreviation', f'00000,{self.state.id},State 00,S0'],
+        )
+
+
+@override_settings(DATASET_CACHE_PATHS=['/api/'])
+class ExportTests(LocationDataMixin, TestCase):
+    """Exports stream the rows the list endpoint pages through, with the same filters"""
+
+    QUERIES = ['', 'state=state 01', 'search=city 00&ordering=-zip_code', 'zip_code=99']
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Location.objects.create(
+            city=cls.city, state=cls.state, country=cls.state.country, zip_code='99999',
+        )
+
+    def listed(self, query):
+        return self.client.get(f'/api/locations/?{query}&page_size=1000').json()['results']
+
+    def export(self, query, output):
+        response = self.client.get(f'/api/locations/export/?{query}&output={output}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('ETag'))
+        return list(response.streaming_content)
+
+    def test_ndjson(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                lines = b''.join(self.export(query, 'ndjson')).decode().splitlines()
+                self.assertEqual([json.loads(line) for line in lines], self.listed(query))
+        self.assertEqual(len(self.listed('')), 121)
+
+    def test_csv(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                listed = self.listed(query)
+                header, *rows = csv.reader(io.StringIO(b''.join(self.export(query, 'csv')).decode()))
+                self.assertEqual(header, list(listed[0]))
+                self.assertEqual(rows, [['' if value is None else str(value) for value in row.values()]
+                                        for row in listed])
+
+    def test_chunks(self):
+        with mock.patch('location.api.export.ROWS_PER_CHUNK', 50):
+            self.assertEqual([chunk.count(b'\n') for chunk in self.export('', 'ndjson')], [50, 50, 21])
+            self.assertEqual([chunk.count(b'\n') for chunk in self.export('', 'csv')], [1, 50, 50, 21])
+        self.assertEqual(self.export('zip_code=nothing', 'csv'), [b'id,zip_code,latitude,longitude,city,state,country,city_name,state_name,country_name\r\n'])
+
+    def test_unknown_output(self):
+        self.assertEqual(self.client.get('/api/locations/export/?output=xml').status_code, 400)
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class BatchLookupTests(LocationDataMixin, TestCase):
+    """Batch lookups split the codes into IN queries the database accepts"""
+
+    def batch(self, zip_codes):
+        return self.client.post('/api/zipcodes/batch/', {'zip_codes': zip_codes}, content_type='application/json')
+
+    def test_chunks(self):
+        codes = list(Location.objects.order_by('zip_code').values_list('zip_code', flat=True))
+        missing = ['00001', 'nowhere']
+        wanted = codes[::-1] + [f' {codes[0]} ', codes[1]] + missing
+        with mock.patch.object(connection.features, 'max_query_params', 11):
+            # 122 distinct codes, 10 per query
+            with self.assertNumQueries(13):
+                response = self.batch(wanted)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['missing'], missing)
+        self.assertCountEqual(data['results'], codes)
+        listed = self.client.get('/api/zipcodes/?page_size=1000').json()['results']
+        self.assertEqual(data['results'], {row['zip_code']: [row] for row in listed})
+
+    def test_invalid(self):
+        for body in ({}, {'zip_codes': '00000'}, {'zip_codes': ['00000', 1]}):
+            with self.subTest(body=body):
+                response = self.client.post('/api/zipcodes/batch/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        with mock.patch.object(ZipCodeViewSet, 'max_batch_size', 2):
+            self.assertEqual(self.batch(['00000', '00010']).status_code, 200)
+            self.assertEqual(self.batch(['00000', '00010', '00020']).status_code, 400)
+
+
+@override_settings(DATASET_CACHE_PATHS=['/api/'], DATASET_VERSION_TTL=3600)
+class HierarchyTests(LocationDataMixin, TestCase):
+    """A country's states and cities come from the documents built at import"""
+
+    def setUp(self):
+        dataset.reset()
+        hierarchies.invalidate()
+        self.path = f'/api/countries/{self.state.country_id}/hierarchy/'
+
+    def test_states_and_cities(self):
+        document = self.client.get(self.path, {'zip_counts': 'true'}).json()
+        self.assertEqual((document['name'], document['alpha2']), ('Country 0', 'C0'))
+        self.assertEqual([state['name'] for state in document['states']], ['State 00', 'State 01', 'State 02'])
+        self.assertEqual(document['states'][0]['cities'][0], {'id': self.city.id, 'name': 'City 000', 'zip_count': 4})
+        self.assertEqual(
+            self.client.get(self.path).json()['states'][0]['cities'][0], {'id': self.city.id, 'name': 'City 000'},
+        )
+        self.assertEqual(
+            self.client.get(self.path, {'zip_counts': ''}).json()['states'][0]['cities'][0],
+            {'id': self.city.id, 'name': 'City 000'},
+        )
+        self.assertEqual(self.client.get(self.path, {'zip_counts': 'maybe'}).status_code, 400)
+
+    def test_unknown_country(self):
+        get_hierarchies()
+        for _ in range(2):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/countries/999999/hierarchy/').status_code, 404)
+
+    def test_gzip_sent_as_stored(self):
+        self.assertEqual(build_hierarchies(), 2)
+        dataset.stamp_version()
+        hierarchies.invalidate()
+        stored = CountryHierarchy.objects.get(country_id=self.state.country_id)
+        with self.assertNumQueries(3):
+            # The dataset version, the country ids, then every stored document at once
+            response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual((response['Content-Encoding'], response.content), ('gzip', bytes(stored.data)))
+        self.assertTrue(response['ETag'].startswith('W/'))
+        plain = self.client.get(self.path)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain.content, gzip.decompress(response.content))
+        for header in ('gzip;q=0', 'br, gzip; q=0.0', 'identity', '*;q=0', 'gzip;q=0, *'):
+            with self.subTest(header=header):
+                refused = self.client.get(self.path, HTTP_ACCEPT_ENCODING=header)
+                self.assertFalse(refused.has_header('Content-Encoding'))
+                self.assertEqual(refused.content, plain.content)
+        for header in ('GZIP;q=0.5', 'br;q=1, *;q=0.1', 'x-gzip'):
+            with self.subTest(header=header):
+                self.assertEqual(self.client.get(self.path, HTTP_ACCEPT_ENCODING=header)['Content-Encoding'], 'gzip')
+
+    def test_country_deleted(self):
+        other = Country.objects.create(name='Country 9', alpha2='C9', alpha3='CC9')
+        path = f'/api/countries/{other.id}/hierarchy/'
+        get_hierarchies()
+        other.delete()
+        for _ in range(2):
+            self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertNotIn(other.id, get_hierarchies().blobs)
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class SpatialTests(TestCase):
+    """The k-d tree and the radius scan agree with brute force, across the antimeridian and the poles"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(7)
+        lats = np.concatenate((
+            np.degrees(np.arcsin(rng.uniform(-1, 1, 400))),  # uniform on the sphere
+            rng.uniform(-1, 1, 100),                         # straddling the antimeridian
+            rng.uniform(88, 90, 50),                         # around the north pole
+        ))
+        lons = np.concatenate((
+            rng.uniform(-180, 180, 400),
+            (rng.uniform(179, 181, 100) + 180) % 360 - 180,
+            rng.uniform(-180, 180, 50),
+        ))
+        country = Country.objects.create(name='Country', alpha2='CO', alpha3='COU')
+        state = State.objects.create(name='State', country=country, abbreviation='ST')
+        city = City.objects.create(name='City', state=state)
+        Location.objects.bulk_create(
+            Location(city=city, state=state, country=country, zip_code=f'{n:05d}', latitude=lat, longitude=lon)
+            for n, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist()))
+        )
+        Location.objects.create(city=city, state=state, country=country, zip_code='NOGEO')
+
+    def setUp(self):
+        location_tree.invalidate()
+        rows = Location.objects.filter(latitude__isnull=False).values_list('id', 'latitude', 'longitude')
+        self.ids, lats, lons = (np.array(column) for column in zip(*rows))
+        self.lats, self.lons = lats.astype(float), lons.astype(float)
+
+    def brute_force(self, lat, lon):
+        """Every geocoded id and its distance from the point, nearest first"""
+        distances = haversine_km(lat, lon, self.lats, self.lons)
+        order = np.argsort(distances)
+        return self.ids[order], distances[order]
+
+    POINTS = [(0, 179.9), (0.5, -179.99), (0, 180), (-0.3, -180), (89.9, 10), (-90, 0), (37.5, -122.3)]
+
+    def test_bounding_box(self):
+        self.assertEqual(bounding_box(0, 179.5, 111.2)[1][1][0], -180.0)
+        (lat_min, lat_max), lon_ranges = bounding_box(0, -179.5, 111.2)
+        self.assertEqual([len(lon_ranges), lon_ranges[1][0]], [2, -180.0])
+        self.assertAlmostEqual(lon_ranges[0][0], 179.5, places=2)
+        self.assertEqual(bounding_box(89.5, 0, 100)[1], [(-180.0, 180.0)])
+
+    def test_nearest(self):
+        tree = get_location_tree()
+        self.assertEqual(len(tree), len(self.ids))
+        for lat, lon in self.POINTS:
+            with self.subTest(lat=lat, lon=lon):
+                ids, distances = self.brute_force(lat, lon)
+                found = tree.nearest(lat, lon, 10)
+                self.assertEqual([location_id for location_id, _ in found], ids[:10].tolist())
+                np.testing.assert_allclose([distance for _, distance in found], distances[:10], atol=1e-6)
+        self.assertEqual(len(tree.nearest(0, 0, len(self.ids) + 5)), len(self.ids))
+
+    def test_within(self):
+        for lat, lon in self.POINTS:
+            for radius in (50, 300, 2500):
+                with self.subTest(lat=lat, lon=lon, radius=radius):
+                    ids, distances = self.brute_force(lat, lon)
+                    inside = distances <= radius
+                    found_ids, found_distances = locations_within(Location.objects.all(), lat, lon, radius)
+                    self.assertEqual(found_ids.tolist(), ids[inside].tolist())
+                    np.testing.assert_allclose(found_distances, distances[inside])
+
+    def test_endpoints(self):
+        ids, distances = self.brute_force(0, 179.95)
+        nearest = self.client.get('/api/zipcodes/nearest/?lat=0&lon=179.95&k=5').json()
+        self.assertEqual([row['id'] for row in nearest], ids[:5].tolist())
+        self.assertEqual([row['distance_km'] for row in nearest], [round(d, 3) for d in distances[:5].tolist()])
+
+        within = self.client.get('/api/zipcodes/within/?lat=0&lon=179.95&radius_km=150&ordering=-distance').json()
+        self.assertEqual([row['id'] for row in within['results']], ids[distances <= 150][::-1].tolist())
+        # Both sides of the antimeridian
+        self.assertEqual({row['longitude'] > 0 for row in within['results']}, {True, False})
+
+    def test_within_skips_deleted(self):
+        def deleting(*args):
+            ids, distances = locations_within(*args)
+            Location.objects.filter(id=ids[0]).delete()
+            return ids, distances
+
+        with mock.patch('location.api.views.locations_within', deleting):
+            response = self.client.get('/api/zipcodes/within/?lat=0&lon=180&radius_km=150')
+        ids, distances = self.brute_force(0, 180)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], ids[1:(distances <= 150).sum()].tolist())
+
+
+class SqliteConnectionTests(TestCase):
+    """New SQLite connections get SQLITE_PRAGMAS, and query_only when asked"""
+
+    PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal', 'mmap_size': 1 << 20, 'cache_size': -2048}
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp(prefix='location-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'db.sqlite3')
+        with closing(sqlite3.connect(self.path)) as db:
+            db.execute('CREATE TABLE t (x INTEGER)')
+
+    def connect(self):
+        alias = 'location_pragmas'
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': self.path}
+        self.addCleanup(self.remove_alias, alias)
+        return connections[alias].cursor()
+
+    def remove_alias(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def pragma(self, cursor, name):
+        return cursor.execute(f'PRAGMA {name}').fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS=PRAGMAS, SQLITE_QUERY_ONLY=False)
+    def test_pragmas(self):
+        cursor = self.connect()
+        self.assertEqual(self.pragma(cursor, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(cursor, 'synchronous'), 1)
+        self.assertEqual(self.pragma(cursor, 'mmap_size'), 1 << 20)
+        self.assertEqual(self.pragma(cursor, 'cache_size'), -2048)
+        self.assertEqual(self.pragma(cursor, 'query_only'), 0)
+        cursor.execute('INSERT INTO t VALUES (1)')
+
+    @override_settings(SQLITE_PRAGMAS=PRAGMAS, SQLITE_QUERY_ONLY=True)
+    def test_query_only(self):
+        cursor = self.connect()
+        # The journal mode was switched before writes were refused
+        self.assertEqual(self.pragma(cursor, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(cursor, 'query_only'), 1)
+        self.assertEqual(cursor.execute('SELECT count(*) FROM t').fetchone()[0], 0)
+        with self.assertRaisesMessage(OperationalError, 'readonly'):
+            cursor.execute('INSERT INTO t VALUES (1)')
+
+    @override_settings(SQLITE_PRAGMAS={'no such pragma': 1, 'cache_size': -2048}, SQLITE_QUERY_ONLY=False)
+    def test_failed_pragma(self):
+        with self.assertLogs('location.db', 'WARNING') as logs:
+            cursor = self.connect()
+        self.assertIn('no such pragma', logs.output[0])
+        self.assertEqual(self.pragma(cursor, 'cache_size'), -2048)
+
+
+class SourceMixin:
+    """A small synthetic source database written once per class, and import helpers"""
+    source_size = {'countries': 2, 'states': 3, 'cities': 4, 'zipcodes': 300}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp(prefix='location-tests-')
+        cls.addClassCleanup(shutil.rmtree, cls.directory, ignore_errors=True)
+        cls.source = os.path.join(cls.directory, 'source.sqlite3')
+        generate_source(cls.source, **cls.source_size)
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(ImportPipeline, 'show_progress', False))
+
+    def edited_source(self, *statements):
+        """A copy of the source with ``statements`` applied"""
+        path = tempfile.mktemp(suffix='.sqlite3', dir=self.directory)
+        shutil.copy(self.source, path)
+        with sqlite3.connect(path) as source:
+            for statement in statements:
+                source.execute(statement)
+        return path
+
+    def import_locations(self, path=None, **options):
+        stdout = io.StringIO()
+        call_command(
+            'import_locations', database_path=path or self.source,
+            stdout=stdout, stderr=io.StringIO(), **options
+        )
+        return stdout.getvalue()
+
+    def dataset(self):
+        """Every location with its names, independent of the ids the import allocated"""
+        self.assertEqual(LocationSearch.objects.count(), Location.objects.count())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM location_location_fts')
+            self.assertEqual(cursor.fetchone()[0], Location.objects.count())
+        return {
+            'counts': [model.objects.count() for model in (Country, State, City, Location)],
+            'cities': sorted(City.objects.values_list('state__name', 'name')),
+            'locations': sorted(Location.objects.values_list(
+                'country__name', 'state__name', 'state__abbreviation', 'city__name',
+                'zip_code', 'latitude', 'longitude',
+            )),
+            'search': sorted(LocationSearch.objects.values_list(
+                'country_name', 'state_name', 'city_name', 'zip_code', 'latitude', 'longitude',
+            )),
+        }
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class ImportTests(SourceMixin, TestCase):
+    """Full imports replace the tables and deltas keep them equal to a fresh import"""
+
+    def test_merge_diff(self):
+        rows = [(1, 'same'), (2, 'changed'), (4, 'added')]
+        stored = [(1, row_digest(('same',)), 10), (2, row_digest(('before',)), 20), (3, 7, 30)]
+        self.assertEqual(list(merge_diff(iter(rows), iter(stored))), [
+            ((2, 'changed'), row_digest(('changed',)), stored[1]),
+            (None, 7, stored[2]),
+            ((4, 'added'), row_digest(('added',)), None),
+        ])
+        self.assertEqual(list(merge_diff(iter([]), iter(stored[:1]))), [(None, stored[0][1], stored[0])])
+
+    def test_full_import_replaces(self):
+        self.import_locations()
+        fresh = self.dataset()
+        self.assertEqual(fresh['counts'][0], 2)
+        self.import_locations()
+        self.assertEqual(self.dataset(), fresh)
+        self.assertIn('No changes', self.import_locations(incremental=True))
+        self.assertEqual(self.dataset(), fresh)
+
+    def test_incremental_matches_fresh_import(self):
+        edited = self.edited_source(
+            'UPDATE zipcodes SET lat = lat + 1 WHERE id = 1',
+            'UPDATE zipcodes SET city = (SELECT city FROM zipcodes WHERE id = 4) WHERE id = 3',
+            'DELETE FROM zipcodes WHERE id = 2',
+            "INSERT INTO zipcodes VALUES (100000, '99999', 1, 'Newtown', '555', 1.5, 2.5, 4)",
+            "UPDATE states SET name = 'Renamed' WHERE id = 2",
+            'DELETE FROM states WHERE id = 3',
+        )
+        self.import_locations()
+        self.import_locations()
+        output = self.import_locations(edited, incremental=True)
+        self.assertIn('states: +0 ~1 -1', output)
+        applied = self.dataset()
+        # The zipcodes of the removed state are skipped with a warning
+        with self.assertLogs('location.importer', 'WARNING'):
+            self.import_locations(edited)
+        self.assertEqual(applied, self.dataset())
+
+    def test_empty_cities_match_fresh_import(self):
+        # Every zipcode of one city loses its code, another city only some of its codes
+        cities = sqlite3.connect(self.source).execute(
+            'SELECT state_id, city FROM zipcodes GROUP BY state_id, city HAVING count(*) > 1 ORDER BY state_id, city LIMIT 2'
+        ).fetchall()
+        self.assertEqual(len(cities), 2)
+        (state_a, city_a), (state_b, city_b) = cities
+        edited = self.edited_source(
+            f"UPDATE zipcodes SET code = NULL WHERE state_id = {state_a} AND city = '{city_a}'",
+            f"UPDATE zipcodes SET code = NULL WHERE id = (SELECT min(id) FROM zipcodes "
+            f"WHERE state_id = {state_b} AND city = '{city_b}')",
+        )
+        self.import_locations()
+        output = self.import_locations(edited, incremental=True)
+        self.assertIn('cities: +0 ~0 -1', output)
+        applied = self.dataset()
+        for options in ({}, {'resume': True}):
+            with self.subTest(**options):
+                clear_location_tables()
+                self.import_locations(edited, **options)
+                self.assertEqual(self.dataset(), applied)
+        self.assertIn('cities: +1 ~0 -0', self.import_locations(self.source, incremental=True))
+        self.assertEqual(self.dataset()['cities'], sorted(
+            (state, city) for state, city in sqlite3.connect(self.source).execute(
+                'SELECT DISTINCT s.name, z.city FROM zipcodes z JOIN states s ON s.id = z.state_id'
+            )
+        ))
+
+    def test_incremental_needs_fingerprinted_rows(self):
+        self.import_locations()
+        location = Location.objects.first()
+        Location.objects.create(
+            city_id=location.city_id, state_id=location.state_id, country_id=location.country_id, zip_code='X',
+        )
+        with self.assertRaisesMessage(CommandError, '1 existing rows have no source fingerprint'), \
+                self.assertLogs('location', 'ERROR'):
+            self.import_locations(incremental=True)
+
+
+    def test_writer_stats(self):
+        command = ImportLocationsCommand()
+        # Writes too fast for the clock have no rate rather than an infinite one
+        with mock.patch('location.importer.writers.time') as clock:
+            clock.perf_counter.return_value = 1.0
+            call_command(command, database_path=self.source, stdout=io.StringIO(), stderr=io.StringIO())
+        table = Location._meta.db_table
+        self.assertEqual(command.writer.rows[table], Location.objects.count())
+        self.assertEqual((command.writer.seconds[table], command.writer.rates()[table]), (0.0, None))
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class CsvImportTests(SourceMixin, TestCase):
+    """A flat feed of the source's rows imports the same dataset as the source itself"""
+
+    FEED_SQL = '''
+        SELECT c.name, c.alpha2, s.name, s.abbr, z.city, z.code, z.lat, z.lon
+        FROM zipcodes z JOIN states s ON s.id = z.state_id JOIN countries c ON c.id = s.country_id
+        ORDER BY z.id
+    '''
+
+    def write_feed(self, delimiter):
+        path = tempfile.mktemp(suffix='.csv', dir=self.directory)
+        with sqlite3.connect(self.source) as source, open(path, 'w', newline='') as feed:
+            writer = csv.writer(feed, delimiter=delimiter)
+            writer.writerow(['Country', 'ISO2', 'State', 'State_Abbr', 'City', 'Zip', 'Lat', 'Lng'])
+            writer.writerows(source.execute(self.FEED_SQL))
+            # A city name with the delimiter, a quote and a line break, and a row without a city
+            writer.writerow(['Multi', 'MU', 'Line', 'ML', 'Saint "Quoted",\nTown', '00001', '', ''])
+            writer.writerow(['Multi', 'MU', 'Line', 'ML', '', '00002', '1', '2'])
+        return path
+
+    def test_feed_matches_source(self):
+        self.import_locations()
+        expected = self.dataset()
+        expected['counts'] = [count + 1 for count in expected['counts']]
+        expected['cities'] = sorted(expected['cities'] + [('Line', 'Saint "Quoted",\nTown')])
+        expected['locations'] = sorted(
+            expected['locations'] + [('Multi', 'Line', 'ML', 'Saint "Quoted",\nTown', '00001', None, None)]
+        )
+        expected['search'] = sorted(
+            expected['search'] + [('Multi', 'Line', 'Saint "Quoted",\nTown', '00001', None, None)]
+        )
+        for delimiter, workers in ((',', 0), ('\t', 2)):
+            with self.subTest(delimiter=delimiter, workers=workers):
+                path = self.write_feed(delimiter)
+                clear_location_tables()
+                with redirect_stderr(io.StringIO()), self.assertLogs('location.importer', 'WARNING'):
+                    call_command(
+                        'import_from_csv', path, workers=workers, chunk_mb=0.002,
+                        stdout=io.StringIO(), stderr=io.StringIO(),
+                    )
+                self.assertEqual(self.dataset(), expected)
+
+    def import_feed(self, path):
+        stdout = io.StringIO()
+        with redirect_stderr(io.StringIO()), self.assertLogs('location.importer', 'WARNING'):
+            call_command('import_from_csv', path, workers=0, stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_rerun(self):
+        path = self.write_feed(',')
+        self.import_feed(path)
+        expected = self.dataset()
+        ids = sorted(Location.objects.values_list('id', flat=True))
+        output = self.import_feed(path)
+        self.assertIn(f'updated 0, unchanged {len(ids)}', output)
+        self.assertEqual(self.dataset(), expected)
+        self.assertEqual(sorted(Location.objects.values_list('id', flat=True)), ids)
+
+        moved = Location.objects.order_by('id').first()
+        with open(path, 'a', newline='') as feed:
+            writer = csv.writer(feed)
+            writer.writerow([moved.country.name, '', moved.state.name, '', moved.city.name, moved.zip_code, '1.5', '2.5'])
+            writer.writerow(['Multi', 'MU', 'Lower', 'lo', 'Town', '00003', '', ''])
+        self.assertIn('updated 1', self.import_feed(path))
+        self.assertEqual(Location.objects.count(), len(ids) + 1)
+        moved.refresh_from_db()
+        self.assertEqual((moved.latitude, moved.longitude), (1.5, 2.5))
+        self.assertEqual(State.objects.get(name='Lower').abbreviation, 'LO')
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class ShadowImportTests(SourceMixin, TestCase):
+    """A shadow database replaces the live file's imported tables and keeps the rest"""
+
+    def live_database(self, journal_mode):
+        """A migrated database file holding an import of half the source, and its alias"""
+        path = os.path.join(self.directory, f'live-{journal_mode}.sqlite3')
+        alias = f'location_live_{journal_mode}'
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': path}
+        self.addCleanup(self.remove_alias, alias)
+        call_command('migrate', database=alias, interactive=False, verbosity=0)
+        old = self.edited_source('DELETE FROM zipcodes WHERE id % 2 = 0')
+        self.run_import(old, alias)
+        DatasetVersion.objects.using(alias).create(source=old)
+        connections[alias].close()
+        with sqlite3.connect(path) as live:
+            live.execute(f'PRAGMA journal_mode = {journal_mode}')
+        return path, alias
+
+    def remove_alias(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def run_import(self, path, using):
+        with closing(sqlite3.connect(path)) as source, transaction.atomic(using=using), \
+                deferred_location_fts(using), deferred_location_search(using):
+            ImportPipeline(source.cursor(), using=using).run()
+
+    def test_swap(self):
+        self.import_locations()
+        expected = self.dataset()
+        for journal_mode in ('delete', 'wal'):
+            with self.subTest(journal_mode=journal_mode):
+                path, alias = self.live_database(journal_mode)
+                reader = sqlite3.connect(path)
+                self.addCleanup(reader.close)
+                self.assertEqual(reader.execute('SELECT count(*) FROM location_location').fetchone(), (150,))
+
+                shadow = ShadowDatabase(using=alias)
+                shadow.create()
+                self.run_import(self.source, shadow.alias)
+                stamp_version(source=self.source, using=shadow.alias)
+                shadow.finish()
+                shadow.swap()
+                self.assertFalse(os.path.exists(shadow.path))
+
+                with sqlite3.connect(path) as live:
+                    self.assertEqual(live.execute('PRAGMA journal_mode').fetchone(), (journal_mode,))
+                    # The version history is copied over, not replaced
+                    sources = [source for source, in live.execute('SELECT source FROM location_datasetversion ORDER BY id')]
+                    self.assertEqual((len(sources), sources[-1]), (2, self.source))
+                    for table in ('location_location', 'location_locationsearch', 'location_location_fts'):
+                        self.assertEqual(live.execute(f'SELECT count(*) FROM {table}').fetchone(), (300,))
+                    self.assertEqual(
+                        sorted(live.execute(
+                            'SELECT country_name, state_name, city_name, zip_code, latitude, longitude '
+                            'FROM location_locationsearch'
+                        )),
+                        expected['search'],
+                    )
+                if journal_mode == 'wal':
+                    # Connections open on the old file see the new data once their snapshot ends
+                    self.assertEqual(reader.execute('SELECT count(*) FROM location_location').fetchone(), (300,))
+
+    def test_remove_files(self):
+        alias = 'location_live_remove'
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': os.path.join(self.directory, 'remove.sqlite3')}
+        self.addCleanup(self.remove_alias, alias)
+        shadow = ShadowDatabase(using=alias)
+        # What a build that crashed in WAL mode leaves behind
+        leftovers = [shadow.path, *(f'{shadow.path}{suffix}' for suffix in ('-journal', '-wal', '-shm'))]
+        for path in leftovers:
+            open(path, 'wb').close()
+        shadow.remove_files()
+        self.assertEqual([path for path in leftovers if os.path.exists(path)], [])
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class ResumableImportTests(SourceMixin, TestCase):
+    """An import interrupted at any stage resumes without duplicating or losing rows"""
+
+    def crash_after(self, stage, rows):
+        """Fail the batch that takes ``stage`` past ``rows`` rows, after its writes"""
+        commit = ResumableImport.commit
+
+        def crashing(pipeline, checkpoint, position, count):
+            commit(pipeline, checkpoint, position, count)
+            if checkpoint.stage == stage and checkpoint.rows > rows:
+                raise RuntimeError('Simulated crash')
+        return mock.patch.object(ResumableImport, 'commit', crashing)
+
+    def test_resume_after_crash(self):
+        self.import_locations()
+        expected = self.dataset()
+        for stage, rows in (('states', 2), ('cities', 10), ('locations', 0), ('locations', 150)):
+            with self.subTest(stage=stage, rows=rows):
+                with self.crash_after(stage, rows), self.assertRaisesMessage(RuntimeError, 'Simulated crash'), \
+                        self.assertLogs('location', 'ERROR'):
+                    self.import_locations(resume=True, batch_size=2 if stage == 'states' else 40)
+                self.assertTrue(ImportCheckpoint.objects.exists())
+                output = self.import_locations(resume=True, batch_size=40)
+                self.assertIn('Resumed an interrupted import', output)
+                self.assertIn('Imported 2 countries, 6 states', output)
+                self.assertEqual(self.dataset(), expected)
+                self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+@override_settings(DATASET_CACHE_PATHS=[])
+class ShardedImportTests(SourceMixin, TransactionTestCase):
+    """Staging cities and locations in worker processes imports the same dataset.
+
+    Not a TestCase: SQLite cannot detach the staging file inside the test's
+    transaction.
+    """
+
+    def test_partition(self):
+        self.assertEqual(partition([(1, 50), (2, 30), (3, 30), (4, 10)], 2), [[1, 4], [2, 3]])
+        self.assertEqual(partition([(1, 5)], 3), [[1]])
+
+    def test_matches_single_process(self):
+        self.import_locations()
+        expected = self.dataset()
+        fingerprints = sorted(SourceFingerprint.objects.values_list('table', 'source_id', 'digest'))
+        with redirect_stderr(io.StringIO()):
+            output = self.import_locations(workers=2, batch_size=25)
+        self.assertIn(f"Imported 2 countries, 6 states, {expected['counts'][2]} cities, 300 locations", output)
+        self.assertEqual(self.dataset(), expected)
+        self.assertEqual(sorted(SourceFingerprint.objects.values_list('table', 'source_id', 'digest')), fingerprints)
+        # Fingerprints point at the rows the merge renumbered
+        self.assertFalse(
+            SourceFingerprint.objects.filter(table='zipcodes')
+            .exclude(target_id__in=Location.objects.values('id')).exists()
+        )
+        self.assertIn('No changes', self.import_locations(incremental=True))
@@ -0,0 +1,42 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from location.autocomplete import city_index
+from location.spatial import location_tree
+
+logger = logging.getLogger(__name__)
+
+# The in-memory indexes each built from a full scan of a location table;
+# without warming, the first request to need one waits for that scan.
+WARMED = (city_index, location_tree)
+
+
+def warm_indexes() -> None:
+    """Build the in-memory indexes of the current dataset now"""
+    try:
+        for cache in WARMED:
+            cache.get()
+    except DatabaseError as e:
+        # Not migrated yet; requests build them once the tables exist
+        logger.warning(f"Could not warm the location indexes: {e}")
+
+
+def start_warming() -> None:
+    """Warm the indexes in a background thread; called by the WSGI and ASGI entry points.
+
+    Requests that arrive first and need an index wait for the build in
+    progress instead of starting their own.
+    """
+    if not getattr(settings, 'LOCATION_WARM_INDEXES', True):
+        return
+
+    def run():
+        try:
+            warm_indexes()
+        finally:
+            # The connections this thread opened
+            connections.close_all()
+    threading.Thread(target=run, name='location-warmup', daemon=True).start()
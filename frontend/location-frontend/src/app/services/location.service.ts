@@ -40,6 +40,14 @@ export class LocationService {
     return this.http.get(`${this.baseUrl}/cities/`, { params });
   }
 
+  getHierarchy(countryId: number, zipCounts: boolean = false): Observable<any> {
+    let params = new HttpParams();
+    if (zipCounts) {
+      params = params.set('zip_counts', 'true');
+    }
+    return this.http.get(`${this.baseUrl}/countries/${countryId}/hierarchy/`, { params });
+  }
+
   getZipCodes(cityName?: string, search?: string, page: number = 1): Observable<any> {
     let params = new HttpParams().set('page', page.toString());
     if (search) {